@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Any
+
+from fastapi import HTTPException
+
+from app.core.config import get_settings
+from app.graph.nodes import keyword_intent
+
+settings = get_settings()
+
+EXPENSIVE_LANES = {"diagnose", "plan"}
+CHAT_LANES = {"report", "diagnose", "plan"}
+
+
+class AdmissionRejected(HTTPException):
+    def __init__(self, status_code: int, lane: str, reason: str, retry_after: int) -> None:
+        super().__init__(
+            status_code=status_code,
+            detail=f"服务繁忙（{lane}: {reason}），请稍后重试",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class _Lane:
+    """单个意图的并发上限 + 短有界等待队列；队列满立即拒绝，排队超时也拒绝。"""
+
+    def __init__(self, name: str, limit: int, max_queue: int) -> None:
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.running = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed_full = 0
+        self.shed_timeout = 0
+        self.shed_soft = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> None:
+        if self.running < self.limit and not self._waiters:
+            self.running += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed_full += 1
+            raise AdmissionRejected(429, self.name, "队列已满", settings.admission_retry_after_sec)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+        except asyncio.TimeoutError as exc:
+            if waiter.done() and not waiter.cancelled():
+                # 超时与放行同时发生：名额已经转交给本请求，正常进入。
+                self.admitted += 1
+                return
+            waiter.cancel()
+            self.shed_timeout += 1
+            raise AdmissionRejected(503, self.name, "排队超时", settings.admission_retry_after_sec) from exc
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+
+    def release(self) -> None:
+        # 名额直接转交给下一个仍在等待的请求，running 不变；没有等待者才真正归还。
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed_full": self.shed_full,
+            "shed_timeout": self.shed_timeout,
+            "shed_soft": self.shed_soft,
+        }
+
+
+class AdmissionSlot:
+    def __init__(self, controller: AdmissionController, lane: _Lane | None) -> None:
+        self._controller = controller
+        self._lane = lane
+
+    async def reroute(self, intent: str) -> None:
+        # 入口按关键词预判；LLM 分类落在另一条聊天道时改占正确的道：先还旧名额再按新道准入，被拒绝则按新道返回 429/503。
+        lane = self._lane
+        if lane is None or intent not in CHAT_LANES or lane.name == intent:
+            return
+        self.release()
+        self._controller.rerouted += 1
+        self._lane = await self._controller._acquire(intent)
+
+    def release(self) -> None:
+        # 幂等：流式接口在生成器 finally 与响应结束回调里都会调用。
+        lane, self._lane = self._lane, None
+        if lane is not None:
+            lane.release()
+
+
+class AdmissionController:
+    """按意图分道准入：report/execute 各自独立配额；diagnose/plan 额外受全局软上限约束，过载时最先被拒绝。"""
+
+    def __init__(self) -> None:
+        self.lanes = {
+            "report": _Lane("report", settings.admission_report_limit, settings.admission_report_queue),
+            "diagnose": _Lane("diagnose", settings.admission_diagnose_limit, settings.admission_diagnose_queue),
+            "plan": _Lane("plan", settings.admission_plan_limit, settings.admission_plan_queue),
+            "execute": _Lane("execute", settings.admission_execute_limit, settings.admission_execute_queue),
+        }
+        self.rerouted = 0
+
+    def lane_for_query(self, query: str) -> str:
+        # 入口处无法等 LLM 分类，先按关键词预判；route_intent 分类后经 AdmissionSlot.reroute 纠正。
+        return keyword_intent(query)
+
+    def _chat_load(self) -> int:
+        return sum(self.lanes[name].running + self.lanes[name].queued for name in CHAT_LANES)
+
+    async def admit(self, lane_name: str) -> AdmissionSlot:
+        return AdmissionSlot(self, await self._acquire(lane_name))
+
+    async def _acquire(self, lane_name: str) -> _Lane | None:
+        if not settings.admission_enabled:
+            return None
+        lane = self.lanes[lane_name]
+        if lane_name in EXPENSIVE_LANES and self._chat_load() >= settings.admission_chat_soft_limit:
+            lane.shed_soft += 1
+            raise AdmissionRejected(503, lane_name, "系统高负载，优先保障报表查询", settings.admission_retry_after_sec)
+        await lane.acquire(settings.admission_queue_timeout_ms / 1000)
+        return lane
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": settings.admission_enabled,
+            "chat_load": self._chat_load(),
+            "chat_soft_limit": settings.admission_chat_soft_limit,
+            "rerouted": self.rerouted,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+admission = AdmissionController()
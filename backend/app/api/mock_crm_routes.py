@@ -19,11 +19,16 @@ class CreateCouponRequest(BaseModel):
     duration_days: int = 7
 
 
-@router.post("/coupons")
-async def create_coupon(payload: CreateCouponRequest, session: AsyncSession = Depends(get_db_session)):
-    await asyncio.sleep(0.1)
-    now = datetime.now()
-    coupon = Coupon(
+class CreateCouponBatchRequest(BaseModel):
+    items: list[CreateCouponRequest]
+
+
+class PublishCouponBatchRequest(BaseModel):
+    coupon_ids: list[int]
+
+
+def _coupon_from_request(payload: CreateCouponRequest, now: datetime) -> Coupon:
+    return Coupon(
         name=payload.name,
         type=payload.offer.get("type", "full_reduction"),
         threshold=Decimal(str(payload.offer.get("threshold", 0))),
@@ -32,6 +37,12 @@ async def create_coupon(payload: CreateCouponRequest, session: AsyncSession = De
         end_at=now + timedelta(days=payload.duration_days),
         status="draft",
     )
+
+
+@router.post("/coupons")
+async def create_coupon(payload: CreateCouponRequest, session: AsyncSession = Depends(get_db_session)):
+    await asyncio.sleep(0.1)
+    coupon = _coupon_from_request(payload, datetime.now())
     session.add(coupon)
     await session.commit()
     await session.refresh(coupon)
@@ -48,3 +59,30 @@ async def publish_coupon(coupon_id: int, session: AsyncSession = Depends(get_db_
     coupon.status = "published"
     await session.commit()
     return {"status": "published", "coupon_id": coupon.id}
+
+
+# 批量接口：模拟真实 CRM 的单次往返开销，一次请求处理多张券。
+@router.post("/coupons:batch")
+async def create_coupons_batch(payload: CreateCouponBatchRequest, session: AsyncSession = Depends(get_db_session)):
+    await asyncio.sleep(0.1)
+    now = datetime.now()
+    coupons = [_coupon_from_request(item, now) for item in payload.items]
+    session.add_all(coupons)
+    await session.commit()
+    return {"coupon_ids": [coupon.id for coupon in coupons]}
+
+
+@router.post("/coupons:publish-batch")
+async def publish_coupons_batch(payload: PublishCouponBatchRequest, session: AsyncSession = Depends(get_db_session)):
+    await asyncio.sleep(0.1)
+    result = await session.execute(select(Coupon).where(Coupon.id.in_(payload.coupon_ids)))
+    coupons = {coupon.id: coupon for coupon in result.scalars().all()}
+    for coupon in coupons.values():
+        coupon.status = "published"
+    await session.commit()
+    return {
+        "results": [
+            {"coupon_id": coupon_id, "status": "published" if coupon_id in coupons else "not_found"}
+            for coupon_id in payload.coupon_ids
+        ]
+    }
@@ -1,15 +1,30 @@
 ﻿import asyncio
 import json
-from typing import Any
+import time
+from typing import Any, Literal
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Header, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from sqlalchemy import text
 
+from app.api.admission import AdmissionRejected, admission
+from app.api.sse import EventChannel, sse_frame, watch_disconnect
+from app.core.batch_cache import BatchCache, use_batch_cache
 from app.core.config import get_settings
+from app.core.serialize import FastJSONResponse, dumps
+from app.core.tracing import tracer
+from app.db.crud import get_action_log_by_key
 from app.db.engine import AsyncSessionLocal
-from app.graph.graph import ainvoke
+from app.rag.executor import embedding_executor
+from app.graph.events import chat_result, progress_events
+from app.graph.graph import ainvoke, astream
+from app.graph.memory import session_memory
+from app.graph.nodes import execute_campaign_batch
+from app.integrations.crm_client import crm_client
+from app.jobs.outbox import outbox_dispatcher
+from app.jobs.manager import JobQueueFullError, job_manager, job_payload
 
 router = APIRouter(prefix="/api", tags=["api"])
 settings = get_settings()
@@ -17,10 +32,30 @@ settings = get_settings()
 
 class ChatRequest(BaseModel):
     query: str
+    report_format: Literal["rows", "columnar"] | None = None
+    # 同一 session_id 的追问可复用上一轮报表结果；为空则每次独立问答。
+    session_id: str | None = None
+
+
+class ChatBatchRequest(BaseModel):
+    queries: list[str]
+    concurrency: int | None = None
+    report_format: Literal["rows", "columnar"] | None = None
+
+
+class JobRequest(BaseModel):
+    query: str
 
 
 class ExecuteRequest(BaseModel):
     plan: dict[str, Any]
+    # >0 时等待 outbox 投递结果（上限 30s）；重复提交同一方案时等待的是首个执行的结果。
+    wait_ms: int = 0
+
+
+class ExecuteBatchRequest(BaseModel):
+    plans: list[dict[str, Any]]
+    wait_ms: int = 0
 
 
 @router.get("/health")
@@ -29,71 +64,190 @@ async def health():
 
 
 @router.post("/chat")
-async def chat(payload: ChatRequest):
+async def chat(payload: ChatRequest, x_deadline_ms: float | None = Header(default=None)):
+    # 准入在 try 之外：429/503 直接返回给客户端，不被包装成 500。
+    slot = await admission.admit(admission.lane_for_query(payload.query))
     try:
-        result = await ainvoke(payload.query)
-        return {
-            "intent": result.get("intent"),
-            "answer": result.get("answer"),
-            "report": result.get("report"),
-            "plan": result.get("plan"),
-            "debug": {**(result.get("debug") or {}), "model": settings.deepseek_model},
-        }
+        result = await ainvoke(
+            payload.query,
+            report_format=payload.report_format,
+            deadline_ms=x_deadline_ms,
+            session_id=payload.session_id,
+            admission_cb=slot.reroute,
+        )
+        # 直接返回响应对象，绕过 jsonable_encoder；Decimal/datetime 由 orjson 处理。
+        return FastJSONResponse(chat_result(result))
+    except AdmissionRejected:
+        # 分类后换道被拒：同样以 429/503 + Retry-After 返回。
+        raise
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
+    finally:
+        slot.release()
 
 
 @router.post("/chat/stream")
-async def chat_stream(payload: ChatRequest, request: Request):
-    queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
-
-    def _sse(data: dict[str, Any]) -> str:
-        return f"data: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+async def chat_stream(
+    payload: ChatRequest,
+    request: Request,
+    x_deadline_ms: float | None = Header(default=None),
+):
+    # 在建立 SSE 之前准入，被拒绝时返回带 Retry-After 的普通 HTTP 错误而不是流内 error 事件。
+    slot = await admission.admit(admission.lane_for_query(payload.query))
+    channel = EventChannel(settings.sse_queue_maxsize)
 
     async def on_token(token: str) -> None:
-        await queue.put({"type": "token", "content": token})
+        await channel.put({"type": "token", "content": token})
 
     async def _run_graph() -> dict[str, Any]:
-        return await ainvoke(payload.query, stream_cb=on_token)
-
-    task = asyncio.create_task(_run_graph())
+        result: dict[str, Any] = {}
+        try:
+            async for node, update in astream(
+                payload.query,
+                stream_cb=on_token,
+                report_format=payload.report_format,
+                deadline_ms=x_deadline_ms,
+                session_id=payload.session_id,
+                admission_cb=slot.reroute,
+            ):
+                if node == "__end__":
+                    result = update
+                    continue
+                for event in progress_events(node, update):
+                    await channel.put(event)
+            return result
+        finally:
+            slot.release()
+            await channel.close()
 
     async def event_gen():
-        yield _sse({"type": "start"})
+        task = asyncio.create_task(_run_graph())
+        watcher = asyncio.create_task(watch_disconnect(request, task))
+        try:
+            yield sse_frame({"type": "start"})
+            async for event in channel.events(settings.sse_flush_ms, settings.sse_flush_chars):
+                yield sse_frame(event)
+
+            # 通道关闭后图任务即将结束；用 wait 取结果，避免把取消当作异常抛出。
+            await asyncio.wait({task})
+            if task.cancelled():
+                return
+            result = task.result()
+            yield sse_frame({"type": "done", "result": chat_result(result)})
+        except Exception as exc:
+            err = {"type": "error", "message": str(exc)}
+            yield sse_frame(err)
+        finally:
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
+            slot.release()
+
+    return StreamingResponse(
+        event_gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+        # 兜底：生成器从未被迭代（客户端提前断开）时也归还名额。
+        background=BackgroundTask(slot.release),
+    )
+
+
+@router.post("/chat/batch")
+async def chat_batch(payload: ChatBatchRequest, x_deadline_ms: float | None = Header(default=None)):
+    if not payload.queries:
+        raise HTTPException(status_code=400, detail="queries 不能为空")
+    if len(payload.queries) > settings.chat_batch_max_queries:
+        raise HTTPException(status_code=400, detail=f"单批最多 {settings.chat_batch_max_queries} 条问题")
 
+    limit = max(1, min(payload.concurrency or settings.chat_batch_max_concurrency, settings.chat_batch_max_concurrency))
+    semaphore = asyncio.Semaphore(limit)
+    cache = BatchCache()
+
+    async def _run_one(index: int, query: str) -> dict[str, Any]:
+        async with semaphore:
+            started = time.perf_counter()
+            line: dict[str, Any] = {"type": "result", "index": index, "query": query}
+            # 每条子问题与单条 /chat 一样按意图准入，批量接口不能绕过分道配额与降载；被拒绝的记为失败行。
+            try:
+                slot = await admission.admit(admission.lane_for_query(query))
+            except AdmissionRejected as exc:
+                line.update(ok=False, error=exc.detail, shed=True, retry_after=int(exc.headers["Retry-After"]))
+                line["elapsed_ms"] = int((time.perf_counter() - started) * 1000)
+                return line
+            # 每个子任务持有独立上下文，在其中挂上批次缓存，整条图链路共享 schema/意图/SQL/向量结果。
+            with use_batch_cache(cache):
+                try:
+                    # 预算从拿到准入名额开始计时，排队时间不计入单条问题的预算。
+                    result = await ainvoke(
+                        query,
+                        report_format=payload.report_format,
+                        deadline_ms=x_deadline_ms,
+                        admission_cb=slot.reroute,
+                    )
+                    line.update(ok=True, result=chat_result(result))
+                except AdmissionRejected as exc:
+                    line.update(ok=False, error=exc.detail, shed=True, retry_after=int(exc.headers["Retry-After"]))
+                except Exception as exc:
+                    line.update(ok=False, error=str(exc))
+                finally:
+                    slot.release()
+            line["elapsed_ms"] = int((time.perf_counter() - started) * 1000)
+            return line
+
+    async def ndjson_gen():
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(_run_one(i, q)) for i, q in enumerate(payload.queries)]
+        failed = shed = 0
         try:
-            while True:
-                if await request.is_disconnected():
+            # 按完成顺序输出，慢问题不阻塞已完成结果；客户端用 index 对齐原始顺序。
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                failed += 0 if line["ok"] else 1
+                shed += 1 if line.get("shed") else 0
+                yield dumps(line) + b"\n"
+            summary = {
+                "type": "summary",
+                "total": len(tasks),
+                "failed": failed,
+                "shed": shed,
+                "concurrency": limit,
+                "elapsed_ms": int((time.perf_counter() - started) * 1000),
+                "cache": cache.stats(),
+            }
+            yield dumps(summary) + b"\n"
+        finally:
+            for task in tasks:
+                if not task.done():
                     task.cancel()
-                    break
 
-                if task.done() and queue.empty():
-                    break
+    return StreamingResponse(ndjson_gen(), media_type="application/x-ndjson")
 
-                try:
-                    event = await asyncio.wait_for(queue.get(), timeout=0.1)
-                    yield _sse(event)
-                except TimeoutError:
-                    continue
 
-            if task.cancelled():
-                return
+@router.post("/jobs", status_code=202)
+async def create_job(payload: JobRequest):
+    query = payload.query.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="query 不能为空")
+    try:
+        job, reused = await job_manager.submit(query)
+    except JobQueueFullError as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "5"}) from exc
+    return {"job_id": job.id, "status": job.status, "reused": reused}
 
-            result = await task
-            done_payload = {
-                "type": "done",
-                "result": {
-                    "intent": result.get("intent"),
-                    "answer": result.get("answer"),
-                    "report": result.get("report"),
-                    "plan": result.get("plan"),
-                    "debug": {**(result.get("debug") or {}), "model": settings.deepseek_model},
-                },
-            }
-            yield _sse(done_payload)
-        except Exception as exc:
-            err = {"type": "error", "message": str(exc)}
-            yield _sse(err)
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return FastJSONResponse(job_payload(job))
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    async def event_gen():
+        async for event in job_manager.events(job_id):
+            yield sse_frame(event)
 
     return StreamingResponse(
         event_gen(),
@@ -104,61 +258,196 @@ async def chat_stream(payload: ChatRequest, request: Request):
 
 @router.post("/execute")
 async def execute(payload: ExecuteRequest):
+    slot = await admission.admit("execute")
     try:
-        result = await ainvoke("执行上架", plan=payload.plan)
-        return {
-            "intent": "execute",
-            "execution": result.get("execution"),
-            "debug": {**(result.get("debug") or {}), "model": settings.deepseek_model},
-        }
+        # 执行链路有外部副作用，不做预算截断。
+        result = await ainvoke("执行上架", plan=payload.plan, deadline_ms=0)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
+    finally:
+        slot.release()
+
+    execution = result.get("execution") or {}
+    if payload.wait_ms > 0 and execution.get("publish_status") == "pending":
+        # 等待期间不占准入名额，也不持有数据库连接。
+        log = await outbox_dispatcher.wait_result(execution["idempotency_key"], min(payload.wait_ms, 30000) / 1000)
+        if log is not None:
+            execution = json.loads(log.response_json)
+    return {
+        "intent": "execute",
+        "execution": execution,
+        "debug": {**(result.get("debug") or {}), "model": settings.deepseek_model},
+    }
+
+
+@router.post("/execute/batch")
+async def execute_batch(payload: ExecuteBatchRequest):
+    if not payload.plans:
+        raise HTTPException(status_code=400, detail="plans 不能为空")
+    if len(payload.plans) > settings.execute_batch_max_plans:
+        raise HTTPException(status_code=400, detail=f"单批最多 {settings.execute_batch_max_plans} 个方案")
+
+    started = time.perf_counter()
+    slot = await admission.admit("execute")
+    try:
+        batch = await execute_campaign_batch(payload.plans)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    finally:
+        slot.release()
+
+    executions = batch["executions"]
+    pending = [key for key, execution in executions.items() if execution.get("publish_status") == "pending"]
+    if payload.wait_ms > 0 and pending:
+        # CRM 并发由 outbox 投递者数量与单批大小限定；这里只按批回查结果。
+        logs = await outbox_dispatcher.wait_results(pending, min(payload.wait_ms, 30000) / 1000)
+        executions.update({key: json.loads(log.response_json) for key, log in logs.items()})
+
+    elapsed = time.perf_counter() - started
+    statuses = [execution.get("publish_status") for execution in executions.values()]
+    outcomes = list(batch["outcomes"].values())
+    return FastJSONResponse(
+        {
+            "items": [{"idempotency_key": key, "execution": executions[key]} for key in batch["keys"]],
+            "summary": {
+                "plans": len(batch["keys"]),
+                "unique": len(executions),
+                "reserved": outcomes.count("reserved"),
+                "requeued": outcomes.count("requeued"),
+                "existing": outcomes.count("existing"),
+                "plans_fixed": batch["plans_fixed"],
+                "published": statuses.count("published"),
+                "failed": statuses.count("failed"),
+                "pending": statuses.count("pending"),
+                "reserve_ms": batch["reserve_ms"],
+                "elapsed_ms": int(elapsed * 1000),
+                "plans_per_sec": round(len(executions) / elapsed, 1) if elapsed > 0 else None,
+            },
+        }
+    )
+
+
+@router.get("/execute/{idempotency_key}")
+async def execution_status(idempotency_key: str):
+    # /execute 只返回 pending，客户端用幂等键轮询投递结果。
+    async with AsyncSessionLocal() as session:
+        log = await get_action_log_by_key(session, idempotency_key)
+    if log is None:
+        raise HTTPException(status_code=404, detail="执行记录不存在")
+    return {"intent": "execute", "status": log.status, "execution": json.loads(log.response_json)}
+
+
+@router.get("/admission/stats")
+async def admission_stats():
+    return {**admission.stats(), "embedding": embedding_executor.stats()}
+
+
+@router.get("/chat/memory/stats")
+async def chat_memory_stats():
+    return session_memory.stats()
+
+
+@router.get("/crm/stats")
+async def crm_stats():
+    return {**crm_client.stats(), "outbox": outbox_dispatcher.stats()}
+
+
+@router.get("/trace/stats")
+async def trace_stats():
+    return tracer.stats()
 
 
 @router.get("/action-logs/summary")
-async def action_logs_summary(limit: int = 20):
+async def action_logs_summary(limit: int = 20, before_id: int | None = None, include_payload: bool = False):
     n = max(1, min(limit, 100))
+    # 列表默认不带大字段 request_json，明细按需通过 /action-logs/{id} 获取。
+    columns = "id, idempotency_key, action_type, status, error_message, created_at"
+    if include_payload:
+        columns += ", request_json"
+    where = "WHERE id < :before_id" if before_id is not None else ""
     try:
         async with AsyncSessionLocal() as session:
-            total = await session.scalar(text("SELECT COUNT(*) FROM action_logs"))
-            success_cnt = await session.scalar(text("SELECT COUNT(*) FROM action_logs WHERE status='success'"))
-            failed_cnt = await session.scalar(text("SELECT COUNT(*) FROM action_logs WHERE status='failed'"))
-            last_created_at = await session.scalar(text("SELECT MAX(created_at) FROM action_logs"))
-            latest_rows = (
+            # 单次条件聚合，走 (status, created_at) 覆盖索引，不回表。
+            agg = (
                 await session.execute(
                     text(
                         """
-                        SELECT id, idempotency_key, action_type, status, request_json, error_message, created_at
+                        SELECT
+                            COUNT(*) AS total,
+                            COALESCE(SUM(CASE WHEN status = 'success' THEN 1 ELSE 0 END), 0) AS success,
+                            COALESCE(SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END), 0) AS failed,
+                            COALESCE(SUM(CASE WHEN status IN ('pending', 'processing') THEN 1 ELSE 0 END), 0) AS pending,
+                            MAX(created_at) AS last_created_at
                         FROM action_logs
+                        """
+                    )
+                )
+            ).mappings().one()
+            latest_rows = (
+                await session.execute(
+                    text(
+                        f"""
+                        SELECT {columns}
+                        FROM action_logs
+                        {where}
                         ORDER BY id DESC
                         LIMIT :n
                         """
                     ),
-                    {"n": n},
+                    {"n": n + 1, "before_id": before_id},
                 )
             ).mappings().all()
 
-        total_v = int(total or 0)
-        success_v = int(success_cnt or 0)
-        failed_v = int(failed_cnt or 0)
+        total_v = int(agg["total"] or 0)
+        success_v = int(agg["success"] or 0)
+        failed_v = int(agg["failed"] or 0)
+        pending_v = int(agg["pending"] or 0)
+        last_created_at = agg["last_created_at"]
         success_rate = round((success_v / total_v) * 100, 2) if total_v > 0 else 0.0
         summary_text = (
-            f"累计执行日志 {total_v} 条，其中成功 {success_v} 条，失败 {failed_v} 条，"
+            f"累计执行日志 {total_v} 条，其中成功 {success_v} 条，失败 {failed_v} 条，投递中 {pending_v} 条，"
             f"成功率 {success_rate:.2f}%。"
         )
         if last_created_at is not None:
             summary_text += f"最近一次执行时间：{last_created_at}。"
 
+        items = [dict(r) for r in latest_rows[:n]]
         return {
             "summary": summary_text,
             "metrics": {
                 "total": total_v,
                 "success": success_v,
                 "failed": failed_v,
+                "pending": pending_v,
                 "success_rate": success_rate,
                 "last_created_at": last_created_at,
             },
-            "items": [dict(r) for r in latest_rows],
+            "items": items,
+            "next_before_id": items[-1]["id"] if len(latest_rows) > n else None,
         }
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
+
+
+@router.get("/action-logs/{log_id}")
+async def action_log_detail(log_id: int):
+    try:
+        async with AsyncSessionLocal() as session:
+            row = (
+                await session.execute(
+                    text(
+                        """
+                        SELECT id, idempotency_key, action_type, status, request_json, response_json,
+                               error_message, created_at
+                        FROM action_logs
+                        WHERE id = :id
+                        """
+                    ),
+                    {"id": log_id},
+                )
+            ).mappings().one_or_none()
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    if row is None:
+        raise HTTPException(status_code=404, detail="日志不存在")
+    return dict(row)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+from typing import Any
+
+from fastapi import Request
+
+from app.core.serialize import dumps_str
+
+_CLOSED = object()
+
+
+def sse_frame(data: dict[str, Any]) -> str:
+    return f"data: {dumps_str(data)}\n\n"
+
+
+class EventChannel:
+    """生产者（图执行）与 SSE 输出之间的有界事件通道，队列满时反压生产者。"""
+
+    def __init__(self, maxsize: int) -> None:
+        self._queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=max(1, maxsize))
+        self._closed = False
+
+    async def put(self, event: dict[str, Any]) -> None:
+        await self._queue.put(event)
+
+    async def close(self) -> None:
+        # 不阻塞：客户端断开后没人消费，队列可能一直是满的，生产者的 finally 不能卡在这里。
+        # 队列满时只置标记，消费者取空队列后看到标记即结束，已缓冲的事件不丢。
+        self._closed = True
+        try:
+            self._queue.put_nowait(_CLOSED)
+        except asyncio.QueueFull:
+            pass
+
+    def _drain_tokens(self, buffer: list[str], size: int, flush_chars: int) -> tuple[int, Any]:
+        # 取走已就绪的连续 token；遇到非 token 事件或结束标记时返回给调用方处理。
+        while size < flush_chars:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return size, None
+            if item is _CLOSED or item.get("type") != "token":
+                return size, item
+            buffer.append(item["content"])
+            size += len(item["content"])
+        return size, None
+
+    async def events(self, flush_ms: float, flush_chars: int) -> AsyncIterator[dict[str, Any]]:
+        # 事件驱动：无事件时阻塞在 queue.get()，不做定时轮询；token 按时间窗或字符数合帧。
+        pending: Any = None
+        while True:
+            if pending is None and self._closed and self._queue.empty():
+                return
+            item = pending if pending is not None else await self._queue.get()
+            pending = None
+            if item is _CLOSED:
+                return
+            if item.get("type") != "token":
+                yield item
+                continue
+
+            buffer = [item["content"]]
+            size, pending = self._drain_tokens(buffer, len(item["content"]), flush_chars)
+            if pending is None and size < flush_chars and flush_ms > 0:
+                await asyncio.sleep(flush_ms / 1000)
+                size, pending = self._drain_tokens(buffer, size, flush_chars)
+            yield {"type": "token", "content": "".join(buffer)}
+
+
+async def watch_disconnect(request: Request, task: asyncio.Task) -> None:
+    # 后台等待 http.disconnect 消息（请求体已读完，receive 只会在断开时返回），断开即取消图任务。
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            task.cancel()
+            return
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+
+import anyio
+
+from app.rag.embedding import EmbeddingBatcher, get_embedder
+
+QUERIES = [
+    "复购率下降了，可能原因是什么",
+    "最近7天支付成功率为什么下降",
+    "给高价值老客做一个促复购活动",
+    "满减券门槛怎么设置",
+    "如何控制优惠券预算风险",
+    "外卖渠道占比变化对客单价的影响",
+]
+
+
+async def _run_direct(embedder, total: int, concurrency: int) -> float:
+    # 现状：每个请求单独 to_thread 做 batch=1 的 encode。
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with sem:
+            await anyio.to_thread.run_sync(embedder, [QUERIES[i % len(QUERIES)]])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - started
+
+
+async def _run_batched(batcher: EmbeddingBatcher, total: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with sem:
+            await batcher.embed(QUERIES[i % len(QUERIES)])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - started
+
+
+async def bench(total: int, concurrency: int, max_batch: int, max_delay_ms: float) -> None:
+    embedder = get_embedder()
+    embedder(QUERIES)
+
+    direct = await _run_direct(embedder, total, concurrency)
+    batcher = EmbeddingBatcher(embedder, max_batch=max_batch, max_delay_ms=max_delay_ms)
+    batched = await _run_batched(batcher, total, concurrency)
+
+    print(f"requests={total} concurrency={concurrency} max_batch={max_batch} max_delay_ms={max_delay_ms}")
+    print(f"direct : {direct:.3f}s, {total / direct:.1f} req/s")
+    print(f"batched: {batched:.3f}s, {total / batched:.1f} req/s, speedup x{direct / batched:.2f}")
+    print(f"batcher stats: {batcher.stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="query embedding 微批基准")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-delay-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(bench(args.requests, args.concurrency, args.max_batch, args.max_delay_ms))
+
+
+if __name__ == "__main__":
+    main()
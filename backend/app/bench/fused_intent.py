@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Any
+
+from app.graph.tools import (
+    SQL_INTENTS,
+    _build_sql_by_rule,
+    _draft_passes_guards,
+    _extract_select_sql,
+    _load_schema_hint_dynamic,
+    fused_intent_sql,
+)
+from app.llm.deepseek_client import deepseek_client
+from app.llm.prompts import build_route_intent_system, build_sql_system, build_sql_user_prompt
+
+QUERIES = [
+    "最近7天各门店GMV、客单价、订单数，按天趋势",
+    "最近30天各渠道订单数和GMV",
+    "最近14天门店3的支付失败率",
+    "去年12月GMV相比去年11月",
+    "这周复购率下降了，可能原因是什么？用数据验证",
+    "门店3最近一周支付成功率为什么下降",
+    "最近7天老客订单占比为什么变低",
+    "给高价值老客做一个促复购活动，预算3万，7天",
+    "把这个活动执行上架，直接发券",
+]
+
+
+async def _two_call(query: str, schema_hint: str) -> dict[str, Any]:
+    # 现状：先分类，report/diagnose 且无规则 SQL 时再单独生成 SQL。
+    started = time.perf_counter()
+    raw = (await deepseek_client.chat(system=build_route_intent_system(), user=query, temperature=0)).strip().lower()
+    intent = raw if raw in {"report", "diagnose", "plan", "execute"} else "report"
+    route_ms = (time.perf_counter() - started) * 1000
+    sql = None
+    if intent in SQL_INTENTS and _build_sql_by_rule(query, intent) is None:
+        raw_sql = await deepseek_client.chat(
+            system=build_sql_system(schema_hint), user=build_sql_user_prompt(query, intent=intent), temperature=0
+        )
+        sql = _extract_select_sql(raw_sql)
+    return {"intent": intent, "sql": sql, "route_ms": route_ms, "total_ms": (time.perf_counter() - started) * 1000}
+
+
+async def _fused(query: str) -> dict[str, Any]:
+    started = time.perf_counter()
+    intent, sql = await fused_intent_sql(query)
+    if intent in SQL_INTENTS and _build_sql_by_rule(query, intent) is not None:
+        # 命中规则 SQL 时线上不会采用草稿，这里同样忽略。
+        sql = None
+    return {"intent": intent, "sql": sql, "total_ms": (time.perf_counter() - started) * 1000}
+
+
+def _pct(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def bench(queries: list[str], rounds: int, out: str | None) -> None:
+    schema_hint = await _load_schema_hint_dynamic()
+    records: list[dict[str, Any]] = []
+    for _ in range(rounds):
+        for query in queries:
+            two = await _two_call(query, schema_hint)
+            fused = await _fused(query)
+            records.append(
+                {
+                    "query": query,
+                    "two_call": two,
+                    "fused": fused,
+                    "intent_agree": two["intent"] == fused["intent"],
+                    # 草稿是否会被线上采用：需通过与 sql_query_tool 相同的守卫。
+                    "draft_usable": bool(fused["sql"]) and _draft_passes_guards(query, fused["sql"]),
+                }
+            )
+
+    two_ms = [r["two_call"]["total_ms"] for r in records]
+    fused_ms = [r["fused"]["total_ms"] for r in records]
+    sql_records = [r for r in records if r["fused"]["intent"] in SQL_INTENTS and r["two_call"]["sql"] is not None]
+    agree = sum(r["intent_agree"] for r in records)
+    usable = sum(r["draft_usable"] for r in sql_records)
+
+    print(f"queries={len(queries)} rounds={rounds} samples={len(records)}")
+    for name, values in (("two_call", two_ms), ("fused", fused_ms)):
+        print(
+            f"{name:<9} mean={statistics.mean(values):8.1f}ms p50={_pct(values, 0.5):8.1f}ms "
+            f"p95={_pct(values, 0.95):8.1f}ms"
+        )
+    saved = statistics.mean(two_ms) - statistics.mean(fused_ms)
+    print(f"saved     mean={saved:8.1f}ms ({saved / statistics.mean(two_ms):.1%})")
+    print(f"intent agreement={agree}/{len(records)} ({agree / len(records):.1%})")
+    if sql_records:
+        print(f"fused SQL draft usable (passes guards)={usable}/{len(sql_records)} ({usable / len(sql_records):.1%})")
+    for r in records:
+        if not r["intent_agree"]:
+            print(f"  disagree: {r['query']} two_call={r['two_call']['intent']} fused={r['fused']['intent']}")
+
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        print(f"records written to {out}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="意图+SQL 合并调用 vs 两次调用：延迟与意图一致率")
+    parser.add_argument("--file", help="问题列表文件，每行一个；默认内置样例")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--out", help="逐条结果写入 JSONL")
+    args = parser.parse_args()
+    queries = QUERIES
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    asyncio.run(bench(queries, args.rounds, args.out))
+
+
+if __name__ == "__main__":
+    main()
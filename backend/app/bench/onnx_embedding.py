@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+PARITY_QUERIES = [
+    "复购率下降了，可能原因是什么",
+    "支付成功率怎么计算",
+    "给高价值老客做促复购活动",
+    "如何防止羊毛党薅券",
+    "满减券门槛怎么设",
+    "客单价口径",
+]
+
+
+def _build(backend: str):
+    if backend == "onnx":
+        from app.rag.onnx_embedding import OnnxEmbeddingFunction
+
+        return OnnxEmbeddingFunction(
+            settings.embed_onnx_dir_abs,
+            threads=settings.embed_onnx_threads,
+            quantized=settings.embed_onnx_quantized,
+        )
+    from app.rag.embedding import LocalEmbeddingFunction
+
+    return LocalEmbeddingFunction(settings.embed_model_abs)
+
+
+def _rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux 下 ru_maxrss 单位为 KB，macOS 为字节。
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def perf(backend: str, rounds: int, batch: int) -> dict:
+    from app.rag.kb_seed import KB_DOCS
+
+    started = time.perf_counter()
+    embedder = _build(backend)
+    load_s = time.perf_counter() - started
+    docs = [d["content"] for d in KB_DOCS]
+    embedder(PARITY_QUERIES)
+
+    latencies = []
+    for i in range(rounds):
+        t0 = time.perf_counter()
+        embedder([PARITY_QUERIES[i % len(PARITY_QUERIES)]])
+        latencies.append(time.perf_counter() - t0)
+
+    texts = (docs * (batch // len(docs) + 1))[:batch]
+    t0 = time.perf_counter()
+    for _ in range(max(1, rounds // 10)):
+        embedder(texts)
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+        "throughput_texts_per_s": round(batch * max(1, rounds // 10) / elapsed, 1),
+        "peak_rss_mb": _rss_mb(),
+    }
+
+
+def parity(top_k: int) -> None:
+    # 同一批文本分别走 torch/onnx，比较逐条余弦相似度与检索排序。
+    from app.rag.kb_seed import KB_DOCS
+
+    torch_fn = _build("torch")
+    onnx_fn = _build("onnx")
+    docs = [d["content"] for d in KB_DOCS]
+    texts = docs + PARITY_QUERIES
+
+    a = np.asarray(torch_fn(texts), dtype=np.float32)
+    b = np.asarray(onnx_fn(texts), dtype=np.float32)
+    cos = np.sum(a * b, axis=1)
+    print(f"cosine(torch, onnx): min={cos.min():.4f} mean={cos.mean():.4f}")
+
+    n_docs = len(docs)
+    same_top1 = 0
+    same_topk = 0
+    for qi, query in enumerate(PARITY_QUERIES):
+        rank_t = np.argsort(-(a[n_docs:][qi] @ a[:n_docs].T))[:top_k]
+        rank_o = np.argsort(-(b[n_docs:][qi] @ b[:n_docs].T))[:top_k]
+        same_top1 += int(rank_t[0] == rank_o[0])
+        same_topk += int(list(rank_t) == list(rank_o))
+        ids_t = [KB_DOCS[i]["id"] for i in rank_t]
+        ids_o = [KB_DOCS[i]["id"] for i in rank_o]
+        print(f"{query}: torch={ids_t} onnx={ids_o}")
+    total = len(PARITY_QUERIES)
+    print(f"top1 一致 {same_top1}/{total}，top{top_k} 顺序一致 {same_topk}/{total}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="torch 与 ONNX int8 embedding 一致性与性能对比")
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--perf", choices=["torch", "onnx"], help="内部使用：在独立进程中测单个后端")
+    args = parser.parse_args()
+
+    if args.perf:
+        print(json.dumps(perf(args.perf, args.rounds, args.batch)))
+        return
+
+    parity(args.top_k)
+    # 每个后端在独立子进程中测量，避免 RSS 相互叠加。
+    for backend in ["torch", "onnx"]:
+        out = subprocess.run(
+            [sys.executable, "-m", "app.bench.onnx_embedding", "--perf", backend,
+             "--rounds", str(args.rounds), "--batch", str(args.batch)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        print(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
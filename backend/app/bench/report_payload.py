@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.serialize import dumps
+
+COLUMNS = ["dt", "store_id", "store_name", "channel", "order_count", "gmv", "aov", "last_paid_at"]
+
+
+def _make_table(n_rows: int) -> dict[str, Any]:
+    # 模拟报表 SQL 的典型结果：日期、整数、字符串、DECIMAL 金额与 DATETIME 混合。
+    rnd = random.Random(42)
+    today = date.today()
+    data: list[list[Any]] = []
+    for i in range(n_rows):
+        orders = rnd.randint(10, 900)
+        gmv = Decimal(f"{rnd.uniform(1000, 90000):.2f}")
+        data.append(
+            [
+                today - timedelta(days=i % 90),
+                i % 50 + 1,
+                f"门店{i % 50 + 1}",
+                rnd.choice(["offline", "online", "delivery"]),
+                orders,
+                gmv,
+                (gmv / orders).quantize(Decimal("0.01")),
+                datetime.now() - timedelta(minutes=i),
+            ]
+        )
+    types = ["date", "int", "string", "string", "int", "decimal", "decimal", "datetime"]
+    return {"columns": COLUMNS, "types": types, "data": data}
+
+
+def _time(fn: Callable[[], bytes], rounds: int) -> tuple[float, int]:
+    fn()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        out = fn()
+    return (time.perf_counter() - started) / rounds, len(out)
+
+
+def bench(n_rows: int, rounds: int) -> None:
+    table = _make_table(n_rows)
+    rows = [dict(zip(table["columns"], r)) for r in table["data"]]
+    rows_report = {"columns": table["columns"], "rows": rows}
+    columnar_report = {"format": "columnar", **table}
+
+    cases: list[tuple[str, Callable[[], bytes]]] = [
+        # 现状：SSE 用 json.dumps(default=str)，/api/chat 先 jsonable_encoder 再 json 序列化。
+        ("rows     + json(default=str)", lambda: json.dumps(rows_report, ensure_ascii=False, default=str).encode()),
+        (
+            "rows     + jsonable_encoder",
+            lambda: json.dumps(jsonable_encoder(rows_report), ensure_ascii=False).encode(),
+        ),
+        ("rows     + orjson", lambda: dumps(rows_report)),
+        ("columnar + json(default=str)", lambda: json.dumps(columnar_report, ensure_ascii=False, default=str).encode()),
+        ("columnar + orjson", lambda: dumps(columnar_report)),
+    ]
+
+    print(f"rows={n_rows} rounds={rounds}")
+    baseline = None
+    for name, fn in cases:
+        seconds, size = _time(fn, rounds)
+        baseline = baseline or (seconds, size)
+        print(
+            f"{name:<30} size={size / 1024:8.1f}KB ({size / baseline[1]:5.2f}x)  "
+            f"time={seconds * 1000:8.3f}ms (x{baseline[0] / seconds:5.1f} faster)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="报表 payload 格式与 JSON 序列化基准")
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    bench(args.rows, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import numpy as np
+
+
+def _fmt_us(seconds: float) -> str:
+    return f"{seconds * 1_000_000:.1f}us"
+
+
+def bench_matrix(n_docs: int, dim: int, batch: int, rounds: int) -> None:
+    # 仅测检索核：mmap 加载的归一化矩阵上做点积 top-k，不含 query embedding。
+    from app.rag.numpy_store import NumpyVectorStore, _normalize
+
+    rng = np.random.default_rng(42)
+    tags = ["metric", "diagnosis", "campaign", "risk"]
+    docs = [
+        {"id": f"doc-{i}", "title": f"doc-{i}", "content": "", "tags": [tags[i % len(tags)]]}
+        for i in range(n_docs)
+    ]
+    matrix = _normalize(rng.standard_normal((n_docs, dim)).astype(np.float32))
+    queries = _normalize(rng.standard_normal((batch, dim)).astype(np.float32))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = NumpyVectorStore(tmp)
+        store._write_snapshot(docs, matrix)
+        store.reload()
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            store.search(queries[:1], top_k=5)
+        single = (time.perf_counter() - started) / rounds
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            store.search(queries[:1], top_k=5, tags=["diagnosis", "risk"])
+        filtered = (time.perf_counter() - started) / rounds
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            store.search(queries, top_k=5)
+        batched = (time.perf_counter() - started) / rounds
+
+    print(f"docs={n_docs} dim={dim}")
+    print(f"single query top5: {_fmt_us(single)}")
+    print(f"single query top5 + tag filter: {_fmt_us(filtered)}")
+    print(f"batch={batch} top5 (one matmul): {_fmt_us(batched)} total, {_fmt_us(batched / batch)} per query")
+
+
+async def bench_backends(rounds: int) -> None:
+    # 端到端对比：同一份 KB 分别走 Chroma 与 NumPy 后端（均包含 query embedding）。
+    from app.core.config import get_settings
+    from app.rag.chroma_store import ChromaStore
+    from app.rag.kb_seed import KB_DOCS
+    from app.rag.numpy_store import NumpyVectorStore
+
+    settings = get_settings()
+    chroma = ChromaStore()
+    numpy_store = NumpyVectorStore(settings.vector_index_dir_abs)
+    await chroma.upsert_docs(KB_DOCS)
+    await numpy_store.upsert_docs(KB_DOCS)
+
+    query = "复购率下降的原因"
+    for name, store in [("chroma", chroma), ("numpy", numpy_store)]:
+        await store.query(query)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            await store.query(query)
+        elapsed = (time.perf_counter() - started) / rounds
+        print(f"{name}: {elapsed * 1000:.2f}ms per query")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="NumPy 向量索引检索基准")
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--backends", action="store_true", help="额外对比 Chroma/NumPy 端到端耗时（需要本地模型）")
+    args = parser.parse_args()
+
+    bench_matrix(args.docs, args.dim, args.batch, args.rounds)
+    if args.backends:
+        asyncio.run(bench_backends(max(1, args.rounds // 10)))
+
+
+if __name__ == "__main__":
+    main()
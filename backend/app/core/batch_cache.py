@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+
+class BatchCache:
+    """单个批次内共享的结果缓存：相同 key 的并发调用只执行一次，其余等待同一个 future。"""
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, Hashable], asyncio.Future] = {}
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+
+    async def get_or_compute(self, namespace: str, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        entry_key = (namespace, key)
+        future = self._entries.get(entry_key)
+        if future is not None:
+            self.hits[namespace] = self.hits.get(namespace, 0) + 1
+            # shield：某个等待方被取消时不影响正在计算的结果与其他等待方。
+            return await asyncio.shield(future)
+
+        self.misses[namespace] = self.misses.get(namespace, 0) + 1
+        future = asyncio.get_running_loop().create_future()
+        self._entries[entry_key] = future
+        try:
+            value = await factory()
+        except BaseException as exc:
+            # 失败不缓存：移除条目，让后续调用重新计算；已在等待的调用方拿到同一个异常。
+            self._entries.pop(entry_key, None)
+            if not future.done():
+                if isinstance(exc, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(exc)
+                    future.exception()
+            raise
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict[str, Any]:
+        namespaces = sorted(set(self.hits) | set(self.misses))
+        return {ns: {"hits": self.hits.get(ns, 0), "misses": self.misses.get(ns, 0)} for ns in namespaces}
+
+
+_current: ContextVar[BatchCache | None] = ContextVar("batch_cache", default=None)
+
+
+@contextmanager
+def use_batch_cache(cache: BatchCache) -> Iterator[BatchCache]:
+    # LangGraph 节点任务会复制当前上下文，在调用 ainvoke 前设置即可贯穿整条链路。
+    token = _current.set(cache)
+    try:
+        yield cache
+    finally:
+        _current.reset(token)
+
+
+async def cached(namespace: str, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+    # 不在批次内时直接计算，单次请求行为不变。
+    cache = _current.get()
+    if cache is None:
+        return await factory()
+    return await cache.get_or_compute(namespace, key, factory)
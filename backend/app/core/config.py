@@ -20,9 +20,56 @@ class Settings(BaseSettings):
     chroma_dir: str = "./.chroma"
     embed_model_path: str = "./models/bge-base-zh-v1.5"
 
+    # Embedding runtime: torch | onnx
+    embed_backend: str = "torch"
+    embed_onnx_dir: str = "./models/bge-base-zh-v1.5-onnx"
+    embed_onnx_threads: int = 0
+    embed_onnx_quantized: bool = True
+
+    # Dedicated embedding executor (0 intra-op threads = cpu_count // workers)
+    embed_executor_workers: int = 2
+    embed_executor_max_queue: int = 64
+    embed_executor_queue_timeout_ms: float = 2000
+    embed_intra_op_threads: int = 0
+
+    # Query embedding micro-batching
+    embed_batch_enabled: bool = True
+    embed_batch_max_size: int = 32
+    embed_batch_max_delay_ms: float = 5.0
+
+    # Shared embedding sidecar (unix:/path.sock or host:port; empty = load the model in each worker)
+    embed_sidecar_address: str = ""
+    embed_sidecar_timeout_sec: float = 10.0
+
+    # RAG retrieval backend: chroma | numpy
+    rag_backend: str = "chroma"
+    vector_index_dir: str = "./.vector_index"
+
+    # KB retrieval: hybrid BM25 + vector fusion, tag filters per intent
+    rag_hybrid_enabled: bool = True
+    rag_hybrid_alpha: float = 0.7
+    rag_min_score: float = 0.3
+    rag_candidate_k: int = 20
+    kb_top_k: int = 3
+    kb_tags_report: str = "metric"
+    kb_tags_diagnose: str = "metric,diagnosis,risk"
+    kb_tags_plan: str = "campaign,risk"
+
+    # KB bulk ingestion
+    kb_ingest_chunk_size: int = 500
+    kb_ingest_chunk_overlap: int = 50
+    kb_ingest_embed_batch: int = 128
+    kb_ingest_upsert_batch: int = 256
+    kb_ingest_workers: int = 0
+
     sql_max_rows: int = 200
     sql_timeout_seconds: int = 5
 
+    # Per-request deadline budget (X-Deadline-Ms header overrides; 0 = unlimited)
+    request_deadline_ms: float = 30000
+    deadline_min_llm_ms: float = 1500
+    deadline_min_kb_ms: float = 300
+
     # SQL/schema customization for different environments
     sql_schema_hint: str = (
         "stores(id, name, city)\n"
@@ -38,6 +85,18 @@ class Settings(BaseSettings):
     order_amount_col: str = "amount"
     order_success_value: str = "1"
 
+    # Orders monthly RANGE partitioning on paid_at (python -m app.db.partitions migrate|maintain|verify)
+    # orders_partitioned=true: ORM matches the partitioned schema (PK (id, paid_at), no orders FKs), seeds partition the table
+    orders_partitioned: bool = False
+    orders_partition_months_ahead: int = 3
+    orders_partition_retention_months: int = 0
+    orders_partition_archive: bool = True
+    orders_partition_archive_batch: int = 5000
+    orders_partition_maintain_on_startup: bool = False
+
+    # Fused routing: one JSON-mode LLM call returns {intent, sql}; the SQL draft is used only if it passes the guards
+    intent_sql_fused: bool = False
+
     # Intent routing keywords
     intent_report_keywords: str = "报表,趋势,gmv,订单,客单价"
     intent_diagnose_keywords: str = "下降,原因,怎么回事,诊断,为什么"
@@ -66,6 +125,69 @@ class Settings(BaseSettings):
 
     crm_base_url: str = "http://127.0.0.1:8000/mock/crm"
 
+    # CRM HTTP client: pooled keep-alive connections, retries with jittered backoff
+    crm_timeout_sec: float = 10.0
+    crm_max_connections: int = 20
+    crm_max_keepalive: int = 10
+    crm_keepalive_expiry_sec: float = 30.0
+    crm_http2: bool = False
+    crm_max_retries: int = 2
+    crm_retry_backoff_ms: float = 100
+    crm_retry_backoff_max_ms: float = 2000
+
+    # Execute outbox: CRM calls are delivered by background dispatchers after the request commits
+    outbox_workers: int = 2
+    outbox_poll_interval_sec: float = 2.0
+    outbox_batch_size: int = 50
+    outbox_stale_after_sec: int = 300
+    outbox_crm_batch_size: int = 50
+    execute_batch_max_plans: int = 500
+
+    # SSE streaming: token frames are coalesced per window or char count
+    sse_flush_ms: float = 30
+    sse_flush_chars: int = 64
+    sse_queue_maxsize: int = 256
+
+    # Report payload format: rows (list of objects) | columnar ({columns, types, data})
+    report_format_default: str = "rows"
+
+    # Batch chat: concurrent ainvoke per batch with shared per-batch caches
+    chat_batch_max_concurrency: int = 4
+    chat_batch_max_queries: int = 500
+
+    # Session memory: last report per session_id, follow-ups answered from cached rows (memory | sqlite | off)
+    chat_memory_backend: str = "memory"
+    chat_memory_sqlite_path: str = "./.chat_memory.sqlite"
+    chat_memory_ttl_sec: int = 1800
+    chat_memory_max_sessions: int = 1000
+
+    # Async chat jobs: background worker pool, bounded queue, result reuse TTL, per-process heartbeat
+    chat_job_workers: int = 2
+    chat_job_max_queue: int = 100
+    chat_job_reuse_ttl_sec: int = 600
+    chat_job_heartbeat_sec: int = 10
+    chat_job_stale_sec: int = 60
+
+    # Admission control per intent lane (report/execute stay responsive; diagnose/plan shed first)
+    admission_enabled: bool = True
+    admission_report_limit: int = 16
+    admission_report_queue: int = 32
+    admission_diagnose_limit: int = 4
+    admission_diagnose_queue: int = 4
+    admission_plan_limit: int = 2
+    admission_plan_queue: int = 2
+    admission_execute_limit: int = 8
+    admission_execute_queue: int = 16
+    admission_chat_soft_limit: int = 16
+    admission_queue_timeout_ms: float = 1000
+    admission_retry_after_sec: int = 2
+
+    # Tracing: OpenTelemetry-compatible spans exported to a local file (off | jsonl | otlp), ratio sampling by trace id
+    trace_exporter: str = "off"
+    trace_file: str = "./logs/traces.jsonl"
+    trace_sample_ratio: float = 1.0
+    trace_service_name: str = "retail-ai-backend"
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -83,6 +205,28 @@ class Settings(BaseSettings):
     def chroma_dir_abs(self) -> str:
         return str((Path(__file__).resolve().parents[2] / self.chroma_dir).resolve())
 
+    @property
+    def kb_ingest_manifest_abs(self) -> str:
+        # 清单与向量数据放在同一目录，切换后端时不会误判“已导入”。
+        store_dir = self.vector_index_dir_abs if self.rag_backend == "numpy" else self.chroma_dir_abs
+        return str(Path(store_dir) / "ingest_manifest.json")
+
+    @property
+    def chat_memory_sqlite_abs(self) -> str:
+        return str((Path(__file__).resolve().parents[2] / self.chat_memory_sqlite_path).resolve())
+
+    @property
+    def trace_file_abs(self) -> str:
+        return str((Path(__file__).resolve().parents[2] / self.trace_file).resolve())
+
+    @property
+    def embed_onnx_dir_abs(self) -> str:
+        return str((Path(__file__).resolve().parents[2] / self.embed_onnx_dir).resolve())
+
+    @property
+    def vector_index_dir_abs(self) -> str:
+        return str((Path(__file__).resolve().parents[2] / self.vector_index_dir).resolve())
+
     @property
     def embed_model_abs(self) -> str:
         return str((Path(__file__).resolve().parents[2] / self.embed_model_path).resolve())
@@ -1,10 +1,15 @@
 ﻿import logging
 import sys
 
+from app.core.tracing import TraceContextFilter
+
 
 def setup_logging() -> None:
+    handler = logging.StreamHandler(sys.stdout)
+    # 每条日志带 trace_id/span_id（不在 trace 内时为 -），可按 ID 到导出的 span 文件中定位。
+    handler.addFilter(TraceContextFilter())
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-        handlers=[logging.StreamHandler(sys.stdout)],
+        format="%(asctime)s | %(levelname)s | %(name)s | trace=%(trace_id)s span=%(span_id)s | %(message)s",
+        handlers=[handler],
     )
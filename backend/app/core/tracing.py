@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# W3C traceparent: 00-<32 hex trace id>-<16 hex span id>-<2 hex flags>
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_KINDS = {"internal": 1, "server": 2, "client": 3}
+_MAX_ATTR_CHARS = 2000
+_EXPORT_BATCH = 512
+
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("trace_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    value = 0
+    while value == 0:
+        value = random.getrandbits(bits)
+    return f"{value:0{bits // 4}x}"
+
+
+def _attr(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= _MAX_ATTR_CHARS else text[:_MAX_ATTR_CHARS] + "..."
+
+
+class Span:
+    """一个计时区间；ID 与 W3C Trace Context / OTLP 格式一致（32 位 trace id、16 位 span id，十六进制）。"""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "kind",
+        "sampled",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "events",
+        "error",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, sampled: bool, kind: str) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.attributes: dict[str, Any] = {}
+        self.events: list[tuple[str, int, dict[str, Any]]] = []
+        self.error: str | None = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, **attributes: Any) -> None:
+        if self.sampled:
+            self.attributes.update({k: _attr(v) for k, v in attributes.items() if v is not None})
+
+    def event(self, name: str, **attributes: Any) -> None:
+        if self.sampled:
+            self.events.append((name, time.time_ns(), {k: _attr(v) for k, v in attributes.items()}))
+
+    def record_error(self, exc: BaseException) -> None:
+        self.error = f"{type(exc).__name__}: {exc}"
+        self.event("exception", type=type(exc).__name__, message=str(exc))
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            tracer.export(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_jsonl(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+            "events": [{"name": n, "time_unix_nano": t, "attributes": a} for n, t, a in self.events],
+        }
+
+    def to_otlp(self) -> dict[str, Any]:
+        status: dict[str, Any] = {"code": 2, "message": self.error} if self.error else {"code": 0}
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": _KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {"timeUnixNano": str(t), "name": n, "attributes": _otlp_attributes(a)} for n, t, a in self.events
+            ],
+            "status": status,
+        }
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": "" if value is None else str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()]
+
+
+class _FileExporter:
+    """后台线程批量写文件，请求路径上只做一次入队。"""
+
+    def __init__(self, path: str, fmt: str) -> None:
+        self.path = path
+        self.fmt = fmt
+        self._queue: queue.SimpleQueue[Span | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.exported = 0
+
+    def export(self, span: Span) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put(span)
+
+    def _encode(self, batch: list[Span]) -> bytes:
+        if self.fmt == "otlp":
+            # OTLP/JSON 文件格式：每行一个 ExportTraceServiceRequest，可被 collector 的 otlpjsonfile receiver 读取。
+            request = {
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": _otlp_attributes({"service.name": settings.trace_service_name})},
+                        "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": [s.to_otlp() for s in batch]}],
+                    }
+                ]
+            }
+            return orjson.dumps(request) + b"\n"
+        return b"".join(orjson.dumps(s.to_jsonl(), default=str) + b"\n" for s in batch)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch: list[Span] = []
+            item = self._queue.get()
+            while True:
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= _EXPORT_BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            try:
+                with open(self.path, "ab") as f:
+                    f.write(self._encode(batch))
+                self.exported += len(batch)
+            except OSError as exc:
+                logger.warning("trace export failed: %s", exc)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = settings.trace_exporter in {"jsonl", "otlp"}
+        self._exporter = _FileExporter(settings.trace_file_abs, settings.trace_exporter) if self.enabled else None
+
+    def _sampled(self, trace_id: str) -> bool:
+        # 与 OTel TraceIdRatioBased 一致：按 trace id 低 64 位判定，同一 trace 在各处结论相同。
+        ratio = settings.trace_sample_ratio
+        return ratio >= 1 or int(trace_id[16:], 16) < ratio * 2**64
+
+    def current(self) -> Span | None:
+        return _current.get()
+
+    def start_span(self, name: str, *, parent: Span | str | None = None, kind: str = "internal", **attributes: Any):
+        """创建并返回 span（不设为当前 span）；parent 可传 Span 或 traceparent 头，缺省取当前 span。"""
+        if not self.enabled:
+            return _NOOP
+        if isinstance(parent, str):
+            m = _TRACEPARENT.match(parent.strip().lower())
+            span = (
+                Span(name, m.group(1), m.group(2), m.group(3) == "01", kind)
+                if m
+                else self._root(name, kind)
+            )
+        else:
+            parent = parent if parent is not None else _current.get()
+            if parent is None or parent is _NOOP:
+                span = self._root(name, kind)
+            else:
+                span = Span(name, parent.trace_id, parent.span_id, parent.sampled, kind)
+        span.set(**attributes)
+        return span
+
+    def _root(self, name: str, kind: str) -> Span:
+        trace_id = _new_id(128)
+        return Span(name, trace_id, None, self._sampled(trace_id), kind)
+
+    @contextmanager
+    def span(
+        self, name: str, *, parent: Span | str | None = None, kind: str = "internal", **attributes: Any
+    ) -> Iterator[Span]:
+        """创建 span 并设为当前 span，退出时结束；异常记录到 span 后原样抛出。"""
+        span = self.start_span(name, parent=parent, kind=kind, **attributes)
+        if span is _NOOP:
+            yield span
+            return
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.record_error(exc)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    def inject(self, headers: dict[str, str] | None = None) -> dict[str, str]:
+        # 出站 HTTP 请求带上 traceparent，下游服务可接续同一条 trace。
+        headers = dict(headers or {})
+        span = _current.get()
+        if span is not None and span is not _NOOP:
+            headers["traceparent"] = span.traceparent
+        return headers
+
+    def export(self, span: Span) -> None:
+        if self._exporter is not None:
+            self._exporter.export(span)
+
+    def shutdown(self) -> None:
+        if self._exporter is not None:
+            self._exporter.shutdown()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "exporter": settings.trace_exporter,
+            "file": settings.trace_file_abs if self.enabled else None,
+            "sample_ratio": settings.trace_sample_ratio,
+            "exported": self._exporter.exported if self._exporter is not None else 0,
+        }
+
+
+class _NoopSpan:
+    trace_id = span_id = parent_id = None
+    sampled = False
+    traceparent = None
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def record_error(self, exc: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+_NOOP: Any = _NoopSpan()
+
+
+def traced_node(name: str, fn: Callable[..., Awaitable[dict]]) -> Callable[..., Awaitable[dict]]:
+    """包装图节点：父 span 从 config.configurable.trace_span 取（节点跑在 LangGraph 自己的任务里）。"""
+    wants_config = "config" in inspect.signature(fn).parameters
+
+    @functools.wraps(fn)
+    async def run(state: dict, config: dict) -> dict:
+        parent = (config.get("configurable") or {}).get("trace_span")
+        with tracer.span(f"node.{name}", parent=parent):
+            return await (fn(state, config) if wants_config else fn(state))
+
+    # LangGraph 按签名决定是否传 config；wraps 会让 inspect 看到原函数签名，这里显式声明。
+    run.__signature__ = inspect.signature(run, follow_wrapped=False)
+    return run
+
+
+class TraceMiddleware:
+    """纯 ASGI 中间件：server span 覆盖到响应体发送完毕（SSE/NDJSON 流式响应同样），客户端断开时随之结束。"""
+
+    def __init__(self, app: Callable[..., Awaitable[None]]) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers") or []}
+        method, path = scope["method"], scope["path"]
+        # 接续上游 traceparent（没有则新建 trace），响应头返回 X-Trace-Id 便于按 ID 查 span 与日志。
+        with tracer.span(
+            f"{method} {path}",
+            parent=headers.get("traceparent"),
+            kind="server",
+            http_method=method,
+            http_route=path,
+        ) as span:
+
+            async def traced_receive() -> dict[str, Any]:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    span.event("client_disconnect")
+                return message
+
+            async def traced_send(message: dict[str, Any]) -> None:
+                if message["type"] == "http.response.start":
+                    span.set(status_code=message["status"])
+                    if span.trace_id is not None:
+                        trace_header = (b"x-trace-id", span.trace_id.encode("latin-1"))
+                        message = {**message, "headers": [*(message.get("headers") or []), trace_header]}
+                await send(message)
+
+            await self.app(scope, traced_receive, traced_send)
+
+
+class TraceContextFilter(logging.Filter):
+    """给日志记录补上 trace_id / span_id，与导出的 span 对应。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = _current.get()
+        record.trace_id = (span.trace_id if span is not None else None) or "-"
+        record.span_id = (span.span_id if span is not None else None) or "-"
+        return True
+
+
+tracer = Tracer()
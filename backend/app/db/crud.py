@@ -5,10 +5,16 @@ import json
 from datetime import datetime, timedelta
 from decimal import Decimal
 
-from sqlalchemy import select
+from sqlalchemy import and_, func, insert, or_, select, text, update
+from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models import ActionLog, Campaign, Coupon
+from app.db.models import ActionLog, Campaign, ChatJob, Coupon
+
+
+def db_seconds_ago(seconds: int) -> ColumnElement:
+    # 超时判断统一用数据库时钟（NOW() - INTERVAL），与 server_default/onupdate 写入的时间可比，不受应用机时钟偏差影响。
+    return func.date_sub(func.now(), text(f"INTERVAL {int(seconds)} SECOND"))
 
 
 async def get_action_log_by_key(session: AsyncSession, key: str) -> ActionLog | None:
@@ -39,6 +45,85 @@ async def create_action_log(
     return log
 
 
+async def get_action_log(session: AsyncSession, log_id: int) -> ActionLog | None:
+    return await session.get(ActionLog, log_id)
+
+
+async def get_action_logs(session: AsyncSession, log_ids: list[int]) -> list[ActionLog]:
+    if not log_ids:
+        return []
+    result = await session.execute(select(ActionLog).where(ActionLog.id.in_(log_ids)).order_by(ActionLog.id))
+    return list(result.scalars().all())
+
+
+async def get_action_logs_by_keys(session: AsyncSession, keys: list[str]) -> list[ActionLog]:
+    # 批量幂等检查：一次 IN 查询走唯一索引，代替逐条 get_action_log_by_key。
+    if not keys:
+        return []
+    result = await session.execute(select(ActionLog).where(ActionLog.idempotency_key.in_(keys)))
+    return list(result.scalars().all())
+
+
+async def bulk_create_action_logs(session: AsyncSession, rows: list[dict]) -> None:
+    # executemany 形式的 INSERT，MySQL 驱动会改写为单条多值 INSERT。
+    if rows:
+        await session.execute(insert(ActionLog), rows)
+
+
+async def bulk_update_action_logs(session: AsyncSession, rows: list[dict]) -> None:
+    # 按主键批量更新：每行需带 id。
+    if rows:
+        # updated_at 由列的 onupdate=func.now() 内联到 SET 子句，使用数据库时钟。
+        await session.execute(update(ActionLog), rows)
+
+
+async def claim_action_log(session: AsyncSession, log_id: int) -> bool:
+    # 条件更新认领 pending 行：多个投递者并发时只有一个能拿到（rowcount == 1）。
+    result = await session.execute(
+        update(ActionLog)
+        .where(ActionLog.id == log_id, ActionLog.status == "pending")
+        .values(status="processing", updated_at=func.now())
+    )
+    return (result.rowcount or 0) == 1
+
+
+async def update_action_log(session: AsyncSession, log_id: int, **values) -> None:
+    await session.execute(update(ActionLog).where(ActionLog.id == log_id).values(updated_at=func.now(), **values))
+
+
+async def requeue_action_log(session: AsyncSession, log_id: int, *, stale_after_sec: int, response_json: str) -> bool:
+    # 失败的、或认领后超时未完成的预占记录重新置为 pending；条件更新保证并发重试只有一个生效，超时按数据库时钟判断。
+    result = await session.execute(
+        update(ActionLog)
+        .where(
+            ActionLog.id == log_id,
+            or_(
+                ActionLog.status == "failed",
+                and_(ActionLog.status == "processing", ActionLog.updated_at < db_seconds_ago(stale_after_sec)),
+            ),
+        )
+        .values(status="pending", response_json=response_json, error_message=None, updated_at=func.now())
+    )
+    return (result.rowcount or 0) == 1
+
+
+async def list_pending_action_log_ids(session: AsyncSession, limit: int) -> list[int]:
+    result = await session.execute(
+        select(ActionLog.id).where(ActionLog.status == "pending").order_by(ActionLog.id).limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def requeue_stale_action_logs(session: AsyncSession, stale_after_sec: int) -> int:
+    # 认领后长时间未完成的记录视为投递者已退出，放回 pending 重新投递；写入与比较都用数据库时钟。
+    result = await session.execute(
+        update(ActionLog)
+        .where(ActionLog.status == "processing", ActionLog.updated_at < db_seconds_ago(stale_after_sec))
+        .values(status="pending", updated_at=func.now())
+    )
+    return result.rowcount or 0
+
+
 async def create_campaign(session: AsyncSession, name: str, goal: str, budget: float, duration_days: int, plan: dict) -> Campaign:
     campaign = Campaign(
         name=name,
@@ -52,6 +137,23 @@ async def create_campaign(session: AsyncSession, name: str, goal: str, budget: f
     return campaign
 
 
+async def bulk_create_campaigns(session: AsyncSession, rows: list[dict]) -> None:
+    if rows:
+        await session.execute(
+            insert(Campaign),
+            [
+                {
+                    "name": row["name"],
+                    "goal": row["goal"],
+                    "budget": Decimal(str(row["budget"])),
+                    "duration_days": row["duration_days"],
+                    "plan_json": json.dumps(row["plan"], ensure_ascii=False),
+                }
+                for row in rows
+            ],
+        )
+
+
 async def create_coupon_from_offer(session: AsyncSession, name: str, offer: dict, duration_days: int) -> Coupon:
     now = datetime.now()
     coupon = Coupon(
@@ -71,3 +173,76 @@ async def create_coupon_from_offer(session: AsyncSession, name: str, offer: dict
 def make_idempotency_key(plan: dict) -> str:
     payload = json.dumps(plan, sort_keys=True, ensure_ascii=False)
     return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_query_hash(query: str) -> str:
+    return hashlib.sha256(query.strip().encode("utf-8")).hexdigest()
+
+
+async def create_chat_job(session: AsyncSession, *, job_id: str, query: str, owner_id: str) -> ChatJob:
+    job = ChatJob(
+        id=job_id,
+        query=query,
+        query_hash=make_query_hash(query),
+        status="queued",
+        progress_json="[]",
+        owner_id=owner_id,
+        heartbeat_at=func.now(),
+    )
+    session.add(job)
+    await session.flush()
+    return job
+
+
+async def get_chat_job(session: AsyncSession, job_id: str) -> ChatJob | None:
+    return await session.get(ChatJob, job_id)
+
+
+async def find_reusable_chat_job(session: AsyncSession, query: str, since: datetime) -> ChatJob | None:
+    # TTL 内已成功的任务，或仍在排队/执行中的同一问题，都直接复用。
+    result = await session.execute(
+        select(ChatJob)
+        .where(
+            ChatJob.query_hash == make_query_hash(query),
+            ChatJob.created_at >= since,
+            ChatJob.status.in_(["queued", "running", "succeeded"]),
+        )
+        .order_by(ChatJob.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def update_chat_job(session: AsyncSession, job_id: str, **values) -> None:
+    await session.execute(update(ChatJob).where(ChatJob.id == job_id).values(**values))
+
+
+async def heartbeat_chat_jobs(session: AsyncSession, owner_id: str) -> int:
+    result = await session.execute(
+        update(ChatJob)
+        .where(ChatJob.owner_id == owner_id, ChatJob.status.in_(["queued", "running"]))
+        .values(heartbeat_at=func.now())
+    )
+    return result.rowcount or 0
+
+
+async def fail_stale_chat_jobs(session: AsyncSession, stale_after_sec: int, reason: str) -> int:
+    # 只处理心跳超时（所属进程已退出）的未完成任务；其它 worker 仍在执行的任务不受影响。
+    result = await session.execute(
+        update(ChatJob)
+        .where(
+            ChatJob.status.in_(["queued", "running"]),
+            or_(ChatJob.heartbeat_at.is_(None), ChatJob.heartbeat_at < db_seconds_ago(stale_after_sec)),
+        )
+        .values(status="failed", error_message=reason, finished_at=func.now())
+    )
+    return result.rowcount or 0
+
+
+async def fail_owned_chat_jobs(session: AsyncSession, owner_id: str, reason: str) -> int:
+    result = await session.execute(
+        update(ChatJob)
+        .where(ChatJob.owner_id == owner_id, ChatJob.status.in_(["queued", "running"]))
+        .values(status="failed", error_message=reason, finished_at=func.now())
+    )
+    return result.rowcount or 0
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.engine import engine
+
+logger = logging.getLogger(__name__)
+
+# create_all 不会给已有表加列；按 (表, 列名, DDL) 幂等补齐，先于索引执行。
+COLUMNS: list[tuple[str, str, str]] = [
+    (
+        "action_logs",
+        "updated_at",
+        "ALTER TABLE action_logs ADD COLUMN updated_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP "
+        "COMMENT '最近一次状态变更时间（投递认领/完成）'",
+    ),
+    (
+        "chat_jobs",
+        "owner_id",
+        "ALTER TABLE chat_jobs ADD COLUMN owner_id VARCHAR(64) NULL "
+        "COMMENT '执行该任务的进程标识（主机名:pid:随机串）'",
+    ),
+    (
+        "chat_jobs",
+        "heartbeat_at",
+        "ALTER TABLE chat_jobs ADD COLUMN heartbeat_at DATETIME NULL "
+        "COMMENT '所属进程最近一次心跳时间（数据库时钟）；超时视为进程已退出'",
+    ),
+]
+
+# create_all 只建缺失的表，不会给已有表补索引；这里按 (表, 索引名, DDL) 幂等补齐。
+INDEXES: list[tuple[str, str, str]] = [
+    (
+        "action_logs",
+        "ix_action_logs_status_created",
+        "CREATE INDEX ix_action_logs_status_created ON action_logs (status, created_at)",
+    ),
+]
+
+# 订单大表上的 DDL 会长时间阻塞，不随应用启动执行（多 worker 还会重复执行）；只由命令行 python -m app.db.migrate 补齐。
+ORDERS_INDEXES: list[tuple[str, str, str]] = [
+    (
+        "orders",
+        "ix_orders_paid_at_status",
+        "CREATE INDEX ix_orders_paid_at_status ON orders (paid_at, pay_status)",
+    ),
+]
+
+
+async def _has_table(conn: AsyncConnection, table: str) -> bool:
+    count = await conn.scalar(
+        text(
+            """
+            SELECT COUNT(*) FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+            """
+        ),
+        {"table": table},
+    )
+    return bool(count)
+
+
+async def _has_column(conn: AsyncConnection, table: str, column: str) -> bool:
+    count = await conn.scalar(
+        text(
+            """
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column
+            """
+        ),
+        {"table": table, "column": column},
+    )
+    return bool(count)
+
+
+async def _has_index(conn: AsyncConnection, table: str, index: str) -> bool:
+    count = await conn.scalar(
+        text(
+            """
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index
+            """
+        ),
+        {"table": table, "index": index},
+    )
+    return bool(count)
+
+
+async def run_migrations(include_orders: bool = False) -> list[str]:
+    """补齐列与索引；应用启动时只做小表变更，include_orders=True（命令行）时才动订单表。"""
+    applied: list[str] = []
+    async with engine.begin() as conn:
+        for table, column, ddl in COLUMNS:
+            if not await _has_table(conn, table) or await _has_column(conn, table, column):
+                continue
+            await conn.execute(text(ddl))
+            applied.append(f"{table}.{column}")
+        for table, index, ddl in INDEXES + (ORDERS_INDEXES if include_orders else []):
+            if not await _has_table(conn, table) or await _has_index(conn, table, index):
+                continue
+            await conn.execute(text(ddl))
+            applied.append(f"{table}.{index}")
+    for name in applied:
+        logger.info("migration applied: %s", name)
+    return applied
+
+
+def main() -> None:
+    applied = asyncio.run(run_migrations(include_orders=True))
+    print(f"[migrate] applied={applied or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
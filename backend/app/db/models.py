@@ -2,8 +2,19 @@
 from decimal import Decimal
 
 from sqlalchemy import DateTime, ForeignKey, Index, Integer, Numeric, String, Text, func
+from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+from app.core.config import get_settings
+
+# 订单表按 paid_at 分区时（python -m app.db.partitions migrate），分区列必须在主键里，且 InnoDB 分区表
+# 不支持外键：ORM 同步声明 (id, paid_at) 主键、去掉 orders 相关外键，create_all 建出的表才能直接分区。
+ORDERS_PARTITIONED = get_settings().orders_partitioned
+
+
+def _orders_fk(target: str) -> tuple[ForeignKey, ...]:
+    return () if ORDERS_PARTITIONED else (ForeignKey(target),)
+
 
 class Base(DeclarativeBase):
     pass
@@ -36,16 +47,24 @@ class Member(Base):
 
 class Order(Base):
     __tablename__ = "orders"
-    __table_args__ = {"comment": "订单主表（含支付状态与订单金额）"}
+    __table_args__ = (
+        Index("ix_orders_paid_at_status", "paid_at", "pay_status"),
+        {"comment": "订单主表（含支付状态与订单金额）"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True, comment="订单ID，主键自增")
-    store_id: Mapped[int] = mapped_column(ForeignKey("stores.id"), nullable=False, comment="门店ID，关联 stores.id")
+    store_id: Mapped[int] = mapped_column(
+        Integer, *_orders_fk("stores.id"), nullable=False, comment="门店ID，关联 stores.id"
+    )
     member_id: Mapped[int | None] = mapped_column(
-        ForeignKey("members.id"),
+        Integer,
+        *_orders_fk("members.id"),
         nullable=True,
         comment="会员ID，关联 members.id；为空表示游客单",
     )
-    paid_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, comment="支付时间")
+    paid_at: Mapped[datetime] = mapped_column(
+        DateTime, primary_key=ORDERS_PARTITIONED, nullable=False, comment="支付时间"
+    )
     pay_status: Mapped[int] = mapped_column(Integer, nullable=False, comment="支付状态，示例：1=支付成功，0=支付失败")
     channel: Mapped[str] = mapped_column(
         String(20),
@@ -61,7 +80,9 @@ class OrderItem(Base):
     __table_args__ = {"comment": "订单明细表（按商品行）"}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True, comment="明细ID，主键自增")
-    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"), nullable=False, comment="订单ID，关联 orders.id")
+    order_id: Mapped[int] = mapped_column(
+        Integer, *_orders_fk("orders.id"), nullable=False, comment="订单ID，关联 orders.id"
+    )
     sku: Mapped[str] = mapped_column(String(50), nullable=False, comment="商品编码，例如：SKU-1024")
     category: Mapped[str] = mapped_column(String(50), nullable=False, comment="商品品类，例如：饮料、零食、生鲜")
     qty: Mapped[int] = mapped_column(Integer, nullable=False, comment="购买数量，例如：1、2、3")
@@ -119,7 +140,7 @@ class ActionLog(Base):
     status: Mapped[str] = mapped_column(
         String(20),
         nullable=False,
-        comment="执行状态，示例：success=成功，failed=失败",
+        comment="执行状态：pending=待投递，processing=投递中，success=成功，failed=失败",
     )
     error_message: Mapped[str | None] = mapped_column(
         Text,
@@ -127,8 +148,55 @@ class ActionLog(Base):
         comment="错误信息；成功时通常为空",
     )
     created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=func.now(), comment="创建时间")
+    updated_at: Mapped[datetime | None] = mapped_column(
+        DateTime,
+        nullable=True,
+        server_default=func.now(),
+        onupdate=func.now(),
+        comment="最近一次状态变更时间（投递认领/完成）",
+    )
 
     __table_args__ = (
         Index("uq_action_logs_idem_key", "idempotency_key", unique=True),
+        Index("ix_action_logs_status_created", "status", "created_at"),
         {"comment": "执行动作日志表（含幂等控制）"},
     )
+
+
+class ChatJob(Base):
+    __tablename__ = "chat_jobs"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True, comment="任务ID（uuid4 hex）")
+    query: Mapped[str] = mapped_column(Text, nullable=False, comment="用户问题原文")
+    query_hash: Mapped[str] = mapped_column(String(64), nullable=False, comment="问题哈希（sha256），用于 TTL 内复用结果")
+    status: Mapped[str] = mapped_column(
+        String(20),
+        nullable=False,
+        default="queued",
+        comment="任务状态，示例：queued=排队中，running=执行中，succeeded=成功，failed=失败",
+    )
+    progress_json: Mapped[str] = mapped_column(
+        Text().with_variant(LONGTEXT(), "mysql"),
+        nullable=False,
+        comment="节点级进度事件列表JSON（字符串）",
+    )
+    result_json: Mapped[str | None] = mapped_column(
+        Text().with_variant(LONGTEXT(), "mysql"),
+        nullable=True,
+        comment="最终结果JSON（字符串）；未完成时为空",
+    )
+    error_message: Mapped[str | None] = mapped_column(Text, nullable=True, comment="错误信息；成功时为空")
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=func.now(), comment="创建时间")
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, comment="开始执行时间")
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, comment="结束时间")
+    owner_id: Mapped[str | None] = mapped_column(
+        String(64), nullable=True, comment="执行该任务的进程标识（主机名:pid:随机串）"
+    )
+    heartbeat_at: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True, comment="所属进程最近一次心跳时间（数据库时钟）；超时视为进程已退出"
+    )
+
+    __table_args__ = (
+        Index("ix_chat_jobs_hash_status", "query_hash", "status", "finished_at"),
+        {"comment": "异步问答任务表（状态、进度与结果）"},
+    )
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import date
+from typing import Any
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.config import get_settings
+from app.db.engine import engine
+from app.db.models import OrderItem
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+MAX_PARTITION = "pmax"
+# 分区维护的 MySQL 命名锁：多个进程同时维护时只有一个执行 DDL，其余跳过。
+_MAINTENANCE_LOCK = "orders_partition_maintenance"
+# 用于 verify 的典型问题，覆盖规则化 SQL 的三种时间口径。
+VERIFY_QUERIES: list[tuple[str, str]] = [
+    ("最近7天GMV、订单数和客单价", "report"),
+    ("最近30天按天GMV趋势", "report"),
+    ("去年12月GMV相比去年11月", "report"),
+]
+
+
+def _month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def _add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"p{month:%Y%m}"
+
+
+def _partition_def(month: date) -> str:
+    # 分区 pYYYYMM 存放该月数据，上界为下月 1 日。
+    return f"PARTITION {_partition_name(month)} VALUES LESS THAN ('{_add_months(month, 1):%Y-%m-%d}')"
+
+
+async def list_partitions(conn: AsyncConnection) -> list[tuple[str, date | None]]:
+    """返回 [(分区名, 上界)]，MAXVALUE 分区上界为 None；未分区时返回空列表。"""
+    rows = (
+        await conn.execute(
+            text(
+                """
+                SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+                FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+                ORDER BY PARTITION_ORDINAL_POSITION
+                """
+            ),
+            {"table": settings.orders_table},
+        )
+    ).all()
+    result: list[tuple[str, date | None]] = []
+    for name, description in rows:
+        bound = (description or "").strip("'")
+        result.append((name, None if bound.upper() == "MAXVALUE" else date.fromisoformat(bound[:10])))
+    return result
+
+
+async def _foreign_keys(conn: AsyncConnection) -> list[tuple[str, str]]:
+    rows = await conn.execute(
+        text(
+            """
+            SELECT DISTINCT TABLE_NAME, CONSTRAINT_NAME
+            FROM information_schema.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+            AND (TABLE_NAME = :table OR REFERENCED_TABLE_NAME = :table)
+            """
+        ),
+        {"table": settings.orders_table},
+    )
+    return [(table, name) for table, name in rows.all()]
+
+
+async def migrate(months_ahead: int, since: date | None = None) -> list[str]:
+    """把订单表改为按支付时间的月度 RANGE 分区；已分区则跳过。since 为空表时的首个分区月份（灌数前调用）。"""
+    table = settings.orders_table
+    paid_at = settings.order_paid_at_col
+    applied: list[str] = []
+    if not settings.orders_partitioned:
+        logger.warning(
+            "ORDERS_PARTITIONED=false：ORM 仍声明单列主键与外键，create_all 重建的订单表不会分区，需重新 migrate"
+        )
+    async with engine.begin() as conn:
+        if await list_partitions(conn):
+            return applied
+
+        # InnoDB 分区表不支持外键（包括引用它的外键），完整性改由写入链路保证。
+        for fk_table, constraint in await _foreign_keys(conn):
+            await conn.execute(text(f"ALTER TABLE {fk_table} DROP FOREIGN KEY {constraint}"))
+            applied.append(f"drop fk {fk_table}.{constraint}")
+
+        earliest = await conn.scalar(text(f"SELECT MIN({paid_at}) FROM {table}"))
+        this_month = _month_start(date.today())
+        starts = [d for d in (earliest.date() if earliest else None, since) if d is not None]
+        month = _month_start(min(starts)) if starts else this_month
+        last = _add_months(this_month, months_ahead)
+        defs: list[str] = []
+        while month <= last:
+            defs.append(_partition_def(month))
+            month = _add_months(month, 1)
+        defs.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+
+        # 分区列必须包含在主键中；改主键与分区合并为一条 ALTER，只重建一次表。
+        await conn.execute(
+            text(
+                f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, {paid_at}) "
+                f"PARTITION BY RANGE COLUMNS({paid_at}) ({', '.join(defs)})"
+            )
+        )
+        applied.append(f"partition {table} into {len(defs)} partitions")
+    for name in applied:
+        logger.info("partition migration applied: %s", name)
+    return applied
+
+
+async def add_future_partitions(conn: AsyncConnection, months_ahead: int) -> list[str]:
+    partitions = await list_partitions(conn)
+    bounds = [bound for _, bound in partitions if bound is not None]
+    if not bounds:
+        return []
+    target = _add_months(_month_start(date.today()), months_ahead + 1)
+    month = max(bounds)
+    new_months: list[date] = []
+    while month < target:
+        new_months.append(month)
+        month = _add_months(month, 1)
+    if not new_months:
+        return []
+    # 从 pmax 中拆出新月份；pmax 正常为空，REORGANIZE 只改元数据。
+    defs = [_partition_def(m) for m in new_months] + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)"]
+    await conn.execute(
+        text(f"ALTER TABLE {settings.orders_table} REORGANIZE PARTITION {MAX_PARTITION} INTO ({', '.join(defs)})")
+    )
+    return [_partition_name(m) for m in new_months]
+
+
+async def _table_exists(conn: AsyncConnection, name: str) -> bool:
+    count = await conn.scalar(
+        text(
+            """
+            SELECT COUNT(*) FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+            """
+        ),
+        {"table": name},
+    )
+    return bool(count)
+
+
+async def _move_items(conn: AsyncConnection, partition: str, items_archive: str | None) -> int:
+    """把分区内订单的明细分批搬到归档表（items_archive 为空则只删除）；每批单独提交，中断后重跑从剩余行继续。"""
+    table = settings.orders_table
+    items = OrderItem.__tablename__
+    batch = max(1, settings.orders_partition_archive_batch)
+    by_ids = bindparam("ids", expanding=True)
+    moved = 0
+    while True:
+        ids = list(
+            (
+                await conn.execute(
+                    text(
+                        f"SELECT oi.id FROM {items} oi JOIN {table} PARTITION ({partition}) o ON o.id = oi.order_id "
+                        "ORDER BY oi.id LIMIT :batch"
+                    ),
+                    {"batch": batch},
+                )
+            ).scalars()
+        )
+        if not ids:
+            return moved
+        if items_archive is not None:
+            # INSERT IGNORE：同一批若已写入归档（上次在提交后中断），重跑不会因主键冲突失败。
+            await conn.execute(
+                text(f"INSERT IGNORE INTO {items_archive} SELECT * FROM {items} WHERE id IN :ids").bindparams(by_ids),
+                {"ids": ids},
+            )
+        await conn.execute(text(f"DELETE FROM {items} WHERE id IN :ids").bindparams(by_ids), {"ids": ids})
+        await conn.commit()
+        moved += len(ids)
+
+
+async def _retire_partition(conn: AsyncConnection, name: str, archive: bool) -> str:
+    table = settings.orders_table
+    items = OrderItem.__tablename__
+    if not archive:
+        deleted = await _move_items(conn, name, None)
+        await conn.execute(text(f"ALTER TABLE {table} DROP PARTITION {name}"))
+        return f"dropped {name} ({deleted} items)"
+
+    # 归档分三步，每步可重跑：
+    # 1) 明细逐行搬迁（order_items 未分区），归档表用 LIKE 建，保留主键与索引，按批提交；
+    # 2) 订单分区与同结构空表 EXCHANGE，只交换表空间，不逐行复制；
+    # 3) 删除已清空的分区。
+    orders_archive = f"{table}_archive_{name}"
+    items_archive = f"{items}_archive_{name}"
+    if not await _table_exists(conn, items_archive):
+        await conn.execute(text(f"CREATE TABLE {items_archive} LIKE {items}"))
+    moved = await _move_items(conn, name, items_archive)
+
+    if not await _table_exists(conn, orders_archive):
+        await conn.execute(text(f"CREATE TABLE {orders_archive} LIKE {table}"))
+        await conn.execute(text(f"ALTER TABLE {orders_archive} REMOVE PARTITIONING"))
+    # 归档表非空说明上次已交换过（在 DROP 前中断），再交换会把数据换回去。
+    if not await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {orders_archive})")):
+        await conn.execute(text(f"ALTER TABLE {table} EXCHANGE PARTITION {name} WITH TABLE {orders_archive}"))
+    await conn.execute(text(f"ALTER TABLE {table} DROP PARTITION {name}"))
+    return f"archived {name} -> {orders_archive}, {items_archive} ({moved} items)"
+
+
+async def _try_lock(conn: AsyncConnection) -> bool:
+    return bool(await conn.scalar(text("SELECT GET_LOCK(:name, 0)"), {"name": _MAINTENANCE_LOCK}))
+
+
+async def _unlock(conn: AsyncConnection) -> None:
+    await conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": _MAINTENANCE_LOCK})
+
+
+async def maintain(months_ahead: int, retention_months: int, archive: bool) -> list[str]:
+    """补齐未来分区；retention_months > 0 时归档或删除早于保留期的整月分区。"""
+    actions: list[str] = []
+    async with engine.connect() as conn:
+        if not await _try_lock(conn):
+            logger.warning("partition maintenance already running elsewhere, skipped")
+            return actions
+        try:
+            actions = await _maintain(conn, months_ahead, retention_months, archive)
+        finally:
+            await _unlock(conn)
+    for action in actions:
+        logger.info("partition maintenance: %s", action)
+    return actions
+
+
+async def _maintain(conn: AsyncConnection, months_ahead: int, retention_months: int, archive: bool) -> list[str]:
+    actions: list[str] = []
+    created = await add_future_partitions(conn, months_ahead)
+    actions.extend(f"created {name}" for name in created)
+    if retention_months > 0:
+        cutoff = _add_months(_month_start(date.today()), -retention_months)
+        for name, bound in await list_partitions(conn):
+            if bound is not None and bound <= cutoff:
+                actions.append(await _retire_partition(conn, name, archive))
+                await conn.commit()
+    return actions
+
+
+async def ensure_future_partitions() -> list[str]:
+    # 启动时调用（ORDERS_PARTITION_MAINTAIN_ON_STARTUP，默认关闭）：仅在已分区时补齐未来分区，不做任何删除。
+    async with engine.connect() as conn:
+        if not await _try_lock(conn):
+            return []
+        try:
+            return await add_future_partitions(conn, settings.orders_partition_months_ahead)
+        finally:
+            await _unlock(conn)
+
+
+async def explain_partitions(conn: AsyncConnection, sql: str) -> dict[str, Any]:
+    rows = (await conn.execute(text(f"EXPLAIN {sql}"))).mappings().all()
+    touched: list[str] = []
+    for row in rows:
+        if row.get("table") == settings.orders_table and row.get("partitions"):
+            touched.extend(row["partitions"].split(","))
+    return {"partitions": touched, "rows": [row.get("rows") for row in rows]}
+
+
+async def verify(extra_sql: list[str]) -> bool:
+    """对规则化 SQL（经过 SQL 守卫改写后的最终形态）执行 EXPLAIN，确认只命中少数分区。"""
+    from app.graph.tools import _build_sql_by_rule, _enforce_sql_guard
+
+    cases: list[tuple[str, str]] = []
+    for query, intent in VERIFY_QUERIES:
+        sql = _build_sql_by_rule(query, intent)
+        if sql is not None:
+            cases.append((query, _enforce_sql_guard(sql)[0]))
+    cases.extend((sql, _enforce_sql_guard(sql)[0]) for sql in extra_sql)
+
+    ok = True
+    async with engine.connect() as conn:
+        total = len(await list_partitions(conn))
+        if not total:
+            print(f"[partitions] {settings.orders_table} 未分区，先执行 migrate")
+            return False
+        for label, sql in cases:
+            plan = await explain_partitions(conn, sql)
+            pruned = len(plan["partitions"]) < total
+            ok = ok and pruned
+            print(f"[partitions] {'OK ' if pruned else 'ALL'} {len(plan['partitions'])}/{total} {label}")
+            print(f"             partitions={','.join(plan['partitions'])} rows={plan['rows']}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="订单表按支付时间月度分区：迁移、维护、裁剪验证")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_migrate = sub.add_parser("migrate", help="改为分区表（一次性，已分区则跳过）")
+    p_migrate.add_argument("--months-ahead", type=int, default=settings.orders_partition_months_ahead)
+    p_maintain = sub.add_parser("maintain", help="补齐未来分区，按保留期归档/删除旧分区（适合每日定时执行）")
+    p_maintain.add_argument("--months-ahead", type=int, default=settings.orders_partition_months_ahead)
+    p_maintain.add_argument("--retention-months", type=int, default=settings.orders_partition_retention_months)
+    p_maintain.add_argument("--drop", action="store_true", help="直接删除旧分区而不是归档")
+    p_verify = sub.add_parser("verify", help="EXPLAIN 规则化 SQL，确认分区裁剪生效")
+    p_verify.add_argument("--sql", action="append", default=[], help="额外验证的 SELECT，可重复")
+    args = parser.parse_args()
+
+    async def run() -> int:
+        try:
+            if args.command == "migrate":
+                applied = await migrate(args.months_ahead)
+                print(f"[partitions] applied={applied or 'none'}")
+            elif args.command == "maintain":
+                archive = settings.orders_partition_archive and not args.drop
+                actions = await maintain(args.months_ahead, args.retention_months, archive)
+                print(f"[partitions] actions={actions or 'none'}")
+            elif not await verify(args.sql):
+                return 1
+            return 0
+        finally:
+            await engine.dispose()
+
+    sys.exit(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
-﻿import asyncio
+﻿import argparse
+import asyncio
 import random
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 from faker import Faker
 from sqlalchemy import delete, func, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import get_settings
 from app.db.engine import AsyncSessionLocal, engine
-from app.db.models import ActionLog, Base, Campaign, Coupon, Member, Order, OrderItem, Store
+from app.db.models import ActionLog, Base, Campaign, ChatJob, Coupon, Member, Order, OrderItem, Store
+from app.db.partitions import migrate
+from app.db.seed_bulk import ScalePlan, describe, seed_scale
+
+settings = get_settings()
 
 SEED = 42
 faker = Faker("zh_CN")
@@ -22,7 +28,7 @@ def _rand_amount(min_v: float, max_v: float) -> Decimal:
 
 
 async def reset_tables(session: AsyncSession) -> None:
-    for model in [ActionLog, Campaign, Coupon, OrderItem, Order, Member, Store]:
+    for model in [ChatJob, ActionLog, Campaign, Coupon, OrderItem, Order, Member, Store]:
         await session.execute(delete(model))
     await session.commit()
 
@@ -30,6 +36,65 @@ async def reset_tables(session: AsyncSession) -> None:
 async def create_schema() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    if settings.orders_partitioned:
+        # 灌数前分区：空表改分区只改结构；分区从 90 天造数窗口的起始月开始。
+        await migrate(settings.orders_partition_months_ahead, since=date.today() - timedelta(days=90))
+
+
+async def print_metrics(session: AsyncSession) -> None:
+    total_orders = await session.scalar(text("SELECT COUNT(*) FROM orders"))
+    success_orders = await session.scalar(text("SELECT COUNT(*) FROM orders WHERE pay_status=1"))
+
+    metrics_sql = text(
+        """
+        SELECT
+            SUM(amount) AS gmv,
+            COUNT(*) AS order_cnt,
+            AVG(amount) AS aov
+        FROM orders
+        WHERE pay_status=1 AND paid_at >= NOW() - INTERVAL 7 DAY
+        """
+    )
+    metric_row = (await session.execute(metrics_sql)).mappings().first()
+
+    repurchase_sql = text(
+        """
+        WITH w1 AS (
+            SELECT member_id, COUNT(*) AS c
+            FROM orders
+            WHERE pay_status=1 AND member_id IS NOT NULL
+            AND paid_at >= NOW() - INTERVAL 7 DAY
+            GROUP BY member_id
+        ),
+        w2 AS (
+            SELECT member_id, COUNT(*) AS c
+            FROM orders
+            WHERE pay_status=1 AND member_id IS NOT NULL
+            AND paid_at >= NOW() - INTERVAL 14 DAY
+            AND paid_at < NOW() - INTERVAL 7 DAY
+            GROUP BY member_id
+        )
+        SELECT
+            COALESCE((SELECT AVG(CASE WHEN c>=2 THEN 1 ELSE 0 END) FROM w1), 0) AS r1,
+            COALESCE((SELECT AVG(CASE WHEN c>=2 THEN 1 ELSE 0 END) FROM w2), 0) AS r2
+        """
+    )
+    repurchase = (await session.execute(repurchase_sql)).mappings().first()
+
+    print(f"SEED={SEED}")
+    print(f"总订单数={int(total_orders or 0)}, 成功订单数={int(success_orders or 0)}")
+    print(
+        "最近7天 GMV={:.2f}, 订单数={}, 客单价={:.2f}".format(
+            float(metric_row["gmv"] or 0),
+            int(metric_row["order_cnt"] or 0),
+            float(metric_row["aov"] or 0),
+        )
+    )
+    print(
+        "最近7天复购率={:.4f}, 上一周期复购率={:.4f}".format(
+            float(repurchase["r1"] or 0), float(repurchase["r2"] or 0)
+        )
+    )
 
 
 async def seed() -> None:
@@ -134,61 +199,33 @@ async def seed() -> None:
         session.add_all(items)
         await session.commit()
 
-        total_orders = await session.scalar(text("SELECT COUNT(*) FROM orders"))
-        success_orders = await session.scalar(text("SELECT COUNT(*) FROM orders WHERE pay_status=1"))
+        await print_metrics(session)
+    await engine.dispose()
 
-        metrics_sql = text(
-            """
-            SELECT
-                SUM(amount) AS gmv,
-                COUNT(*) AS order_cnt,
-                AVG(amount) AS aov
-            FROM orders
-            WHERE pay_status=1 AND paid_at >= NOW() - INTERVAL 7 DAY
-            """
-        )
-        metric_row = (await session.execute(metrics_sql)).mappings().first()
-
-        repurchase_sql = text(
-            """
-            WITH w1 AS (
-                SELECT member_id, COUNT(*) AS c
-                FROM orders
-                WHERE pay_status=1 AND member_id IS NOT NULL
-                AND paid_at >= NOW() - INTERVAL 7 DAY
-                GROUP BY member_id
-            ),
-            w2 AS (
-                SELECT member_id, COUNT(*) AS c
-                FROM orders
-                WHERE pay_status=1 AND member_id IS NOT NULL
-                AND paid_at >= NOW() - INTERVAL 14 DAY
-                AND paid_at < NOW() - INTERVAL 7 DAY
-                GROUP BY member_id
-            )
-            SELECT
-                COALESCE((SELECT AVG(CASE WHEN c>=2 THEN 1 ELSE 0 END) FROM w1), 0) AS r1,
-                COALESCE((SELECT AVG(CASE WHEN c>=2 THEN 1 ELSE 0 END) FROM w2), 0) AS r2
-            """
-        )
-        repurchase = (await session.execute(repurchase_sql)).mappings().first()
-
-        print(f"SEED={SEED}")
-        print(f"总订单数={int(total_orders or 0)}, 成功订单数={int(success_orders or 0)}")
-        print(
-            "最近7天 GMV={:.2f}, 订单数={}, 客单价={:.2f}".format(
-                float(metric_row["gmv"] or 0),
-                int(metric_row["order_cnt"] or 0),
-                float(metric_row["aov"] or 0),
-            )
-        )
-        print(
-            "最近7天复购率={:.4f}, 上一周期复购率={:.4f}".format(
-                float(repurchase["r1"] or 0), float(repurchase["r2"] or 0)
-            )
-        )
+
+async def seed_at_scale(args: argparse.Namespace) -> None:
+    plan = ScalePlan.for_scale(args.scale, stores=args.stores, chunk_size=args.chunk_size)
+    print(f"[seed] scale: {describe(plan)} loader={args.loader}")
+    await seed_scale(plan, loader=args.loader, workers=args.workers)
+    async with AsyncSessionLocal() as session:
+        await print_metrics(session)
     await engine.dispose()
 
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="生成演示数据；--scale 指定订单量时走分块并行的批量装载")
+    parser.add_argument("--scale", type=int, default=0, help="订单数，例如 1000000；不指定则生成默认的 4 万单演示数据")
+    parser.add_argument("--loader", choices=["executemany", "infile"], default="executemany")
+    parser.add_argument("--workers", type=int, default=0, help="生成进程数，默认 CPU 核数")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="每块订单数")
+    parser.add_argument("--stores", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.scale > 0:
+        asyncio.run(seed_at_scale(args))
+    else:
+        asyncio.run(seed())
+
+
 if __name__ == "__main__":
-    asyncio.run(seed())
+    main()
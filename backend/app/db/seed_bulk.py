@@ -0,0 +1,375 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import Table, insert, text
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from app.core.config import get_settings
+from app.db.models import ActionLog, Base, Campaign, ChatJob, Coupon, Member, Order, OrderItem, Store
+from app.db.partitions import migrate
+
+settings = get_settings()
+
+SEED = 42
+CITIES = ["上海", "北京", "广州", "深圳", "杭州"]
+CHANNELS = ["offline", "online", "delivery"]
+CATEGORIES = ["饮料", "零食", "粮油", "日化", "生鲜", "速食"]
+# 与默认种子一致的预埋异常：门店3近7天支付失败率升高；老客近7天流失。
+ANOMALY_STORE_ID = 3
+MEMBER_COLUMNS = ["id", "store_id", "created_at", "level", "total_spent"]
+ORDER_COLUMNS = ["id", "store_id", "member_id", "paid_at", "pay_status", "channel", "amount", "original_amount"]
+ITEM_COLUMNS = ["order_id", "sku", "category", "qty", "price"]
+# 装载期间先删掉的二级索引（外键索引保留），装载完再统一建。
+DEFERRED_INDEX_TABLES = (Order.__table__, OrderItem.__table__)
+
+
+@dataclass(frozen=True)
+class ScalePlan:
+    orders: int
+    stores: int
+    members: int
+    chunk_size: int
+
+    @classmethod
+    def for_scale(cls, orders: int, stores: int = 10, chunk_size: int = 50_000) -> "ScalePlan":
+        # 会员数与默认种子同比例（4 万订单 : 3000 会员）。
+        return cls(orders=orders, stores=max(1, stores), members=max(3000, orders * 3 // 40), chunk_size=chunk_size)
+
+    def _split(self, total: int, store_id: int) -> tuple[int, int]:
+        # 按门店均分，返回 (该门店第一个编号, 数量)；编号区间互不重叠，生成无需回查数据库。
+        base, extra = divmod(total, self.stores)
+        idx = store_id - 1
+        first = idx * base + min(idx, extra) + 1
+        return first, base + (1 if idx < extra else 0)
+
+    def member_range(self, store_id: int) -> tuple[int, int]:
+        return self._split(self.members, store_id)
+
+    def order_range(self, store_id: int) -> tuple[int, int]:
+        return self._split(self.orders, store_id)
+
+
+@dataclass(frozen=True)
+class MemberTask:
+    store_id: int
+    first_id: int
+    count: int
+    now: datetime
+    out_dir: str | None
+
+
+@dataclass(frozen=True)
+class OrderTask:
+    store_id: int
+    chunk_index: int
+    first_id: int
+    count: int
+    member_first_id: int
+    member_count: int
+    old_members: bytes
+    now: datetime
+    out_dir: str | None
+
+
+@dataclass
+class ChunkResult:
+    table: str
+    rows: list[tuple] | None = None
+    path: str | None = None
+    count: int = 0
+    gen_sec: float = 0.0
+    # 订单任务附带明细；会员任务附带老客位图。
+    items: ChunkResult | None = None
+    old_members: bytes = b""
+
+
+def _rng(*parts: Any) -> random.Random:
+    # 每个 (门店, 分块) 独立播种：结果与进程数、调度顺序无关。
+    return random.Random(":".join(str(p) for p in (SEED, *parts)))
+
+
+def _fmt_dt(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _write_tsv(out_dir: str, name: str, rows: list[tuple]) -> str:
+    path = os.path.join(out_dir, f"{name}.tsv")
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        for row in rows:
+            f.write("\t".join("\\N" if v is None else str(v) for v in row))
+            f.write("\n")
+    return path
+
+
+def _emit(table: str, name: str, rows: list[tuple], out_dir: str | None, gen_sec: float) -> ChunkResult:
+    if out_dir is None:
+        return ChunkResult(table=table, rows=rows, count=len(rows), gen_sec=gen_sec)
+    return ChunkResult(table=table, path=_write_tsv(out_dir, name, rows), count=len(rows), gen_sec=gen_sec)
+
+
+def generate_members(task: MemberTask) -> ChunkResult:
+    started = time.perf_counter()
+    rng = _rng("members", task.store_id)
+    old = bytearray((task.count + 7) // 8)
+    rows: list[tuple] = []
+    span = (365 - 2) * 86400
+    for i in range(task.count):
+        created_at = task.now - timedelta(days=365) + timedelta(seconds=rng.random() * span)
+        level = rng.randint(1, 4)
+        total_spent = round(rng.uniform(100, 25000), 2)
+        if total_spent >= 3000 or level >= 3:
+            old[i >> 3] |= 1 << (i & 7)
+        rows.append((task.first_id + i, task.store_id, _fmt_dt(created_at), level, f"{total_spent:.2f}"))
+    result = _emit("members", f"members_{task.store_id}", rows, task.out_dir, time.perf_counter() - started)
+    result.old_members = bytes(old)
+    return result
+
+
+def generate_orders(task: OrderTask) -> ChunkResult:
+    started = time.perf_counter()
+    rng = _rng("orders", task.store_id, task.chunk_index)
+    window_start = task.now - timedelta(days=90)
+    recent_from = task.now - timedelta(days=7)
+    span = 90 * 86400
+    orders: list[tuple] = []
+    items: list[tuple] = []
+    for i in range(task.count):
+        paid_at = window_start + timedelta(seconds=rng.random() * span)
+        in_recent_week = paid_at >= recent_from
+
+        member_id = None
+        is_old_customer = False
+        if rng.random() >= 0.08 and task.member_count:
+            offset = rng.randrange(task.member_count)
+            member_id = task.member_first_id + offset
+            is_old_customer = bool(task.old_members[offset >> 3] & (1 << (offset & 7)))
+
+        fail_rate = 0.22 if task.store_id == ANOMALY_STORE_ID and in_recent_week else 0.06
+        pay_status = 0 if rng.random() < fail_rate else 1
+
+        if in_recent_week and is_old_customer and rng.random() < 0.30:
+            # 老客流失：跳过该单，订单 ID 留空洞，保证各分块 ID 区间固定。
+            continue
+
+        amount = rng.uniform(25, 320)
+        if in_recent_week:
+            if not is_old_customer:
+                if rng.random() < 0.35:
+                    amount *= 0.78
+            else:
+                amount *= 1.05
+        amount = round(amount, 2)
+        original_amount = round(amount * rng.uniform(1.05, 1.25), 2)
+
+        order_id = task.first_id + i
+        orders.append(
+            (
+                order_id,
+                task.store_id,
+                member_id,
+                _fmt_dt(paid_at),
+                pay_status,
+                rng.choice(CHANNELS),
+                f"{amount:.2f}",
+                f"{original_amount:.2f}",
+            )
+        )
+        for _ in range(rng.randint(1, 5)):
+            items.append(
+                (
+                    order_id,
+                    f"SKU-{rng.randint(1000, 9999)}",
+                    rng.choice(CATEGORIES),
+                    rng.randint(1, 3),
+                    f"{rng.uniform(5, 80):.2f}",
+                )
+            )
+    gen_sec = time.perf_counter() - started
+    name = f"{task.store_id}_{task.chunk_index}"
+    result = _emit("orders", f"orders_{name}", orders, task.out_dir, gen_sec)
+    result.items = _emit("order_items", f"order_items_{name}", items, task.out_dir, 0.0)
+    return result
+
+
+@dataclass
+class LoadStats:
+    rows: dict[str, int] = field(default_factory=dict)
+    load_sec: dict[str, float] = field(default_factory=dict)
+    gen_sec: float = 0.0
+
+    def add(self, table: str, count: int, seconds: float) -> None:
+        self.rows[table] = self.rows.get(table, 0) + count
+        self.load_sec[table] = self.load_sec.get(table, 0.0) + seconds
+
+
+class _Loader:
+    """executemany：Core insert() 多值批量写入；infile：LOAD DATA LOCAL INFILE 直接装载 TSV。"""
+
+    def __init__(self, conn: AsyncConnection, stats: LoadStats) -> None:
+        self.conn = conn
+        self.stats = stats
+        self._columns = {"members": MEMBER_COLUMNS, "orders": ORDER_COLUMNS, "order_items": ITEM_COLUMNS}
+        self._tables: dict[str, Table] = {
+            "members": Member.__table__,
+            "orders": Order.__table__,
+            "order_items": OrderItem.__table__,
+        }
+
+    async def load(self, chunk: ChunkResult) -> None:
+        started = time.perf_counter()
+        columns = self._columns[chunk.table]
+        if chunk.path is not None:
+            await self.conn.execute(
+                text(
+                    f"LOAD DATA LOCAL INFILE :path INTO TABLE {chunk.table} CHARACTER SET utf8mb4 "
+                    f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({', '.join(columns)})"
+                ),
+                {"path": chunk.path},
+            )
+            os.remove(chunk.path)
+        elif chunk.rows:
+            await self.conn.execute(insert(self._tables[chunk.table]), [dict(zip(columns, row)) for row in chunk.rows])
+        # 每块单独提交，避免单个大事务撑爆 undo log。
+        await self.conn.commit()
+        self.stats.add(chunk.table, chunk.count, time.perf_counter() - started)
+        self.stats.gen_sec += chunk.gen_sec
+
+
+async def _stream(
+    pool: ProcessPoolExecutor,
+    fn: Callable[[Any], ChunkResult],
+    tasks: Iterable[Any],
+    window: int,
+):
+    # 进程池并行生成，最多 window 块在途；按提交顺序产出，内存占用与总规模无关。
+    loop = asyncio.get_running_loop()
+    pending: deque[asyncio.Future] = deque()
+    for task in tasks:
+        pending.append(loop.run_in_executor(pool, fn, task))
+        if len(pending) >= window:
+            yield await pending.popleft()
+    while pending:
+        yield await pending.popleft()
+
+
+async def _prepare_tables(conn: AsyncConnection) -> None:
+    await conn.run_sync(Base.metadata.create_all)
+    await conn.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
+    for model in [ChatJob, ActionLog, Campaign, Coupon, OrderItem, Order, Member, Store]:
+        await conn.execute(text(f"TRUNCATE TABLE {model.__tablename__}"))
+    for table in DEFERRED_INDEX_TABLES:
+        for index in table.indexes:
+            await conn.run_sync(lambda sync_conn, idx=index: idx.drop(sync_conn, checkfirst=True))
+    await conn.commit()
+
+
+async def _build_indexes(conn: AsyncConnection) -> list[str]:
+    built: list[str] = []
+    for table in DEFERRED_INDEX_TABLES:
+        for index in table.indexes:
+            await conn.run_sync(lambda sync_conn, idx=index: idx.create(sync_conn, checkfirst=True))
+            built.append(f"{table.name}.{index.name}")
+        await conn.execute(text(f"ANALYZE TABLE {table.name}"))
+    await conn.commit()
+    return built
+
+
+def _order_tasks(plan: ScalePlan, old_members: dict[int, bytes], now: datetime, out_dir: str | None):
+    for store_id in range(1, plan.stores + 1):
+        first_id, count = plan.order_range(store_id)
+        member_first_id, member_count = plan.member_range(store_id)
+        for chunk_index, offset in enumerate(range(0, count, plan.chunk_size)):
+            yield OrderTask(
+                store_id=store_id,
+                chunk_index=chunk_index,
+                first_id=first_id + offset,
+                count=min(plan.chunk_size, count - offset),
+                member_first_id=member_first_id,
+                member_count=member_count,
+                old_members=old_members[store_id],
+                now=now,
+                out_dir=out_dir,
+            )
+
+
+async def seed_scale(plan: ScalePlan, loader: str = "executemany", workers: int = 0) -> LoadStats:
+    workers = workers or os.cpu_count() or 1
+    connect_args = {"local_infile": True} if loader == "infile" else {}
+    bulk_engine = create_async_engine(settings.mysql_url, connect_args=connect_args)
+    out_dir = tempfile.mkdtemp(prefix="seed_") if loader == "infile" else None
+    now = datetime.now().replace(microsecond=0)
+    stats = LoadStats()
+    started = time.perf_counter()
+    try:
+        async with bulk_engine.connect() as conn:
+            await _prepare_tables(conn)
+            if settings.orders_partitioned:
+                # 空表时分区，数据直接按月落入各分区；分区从 90 天订单窗口的起始月开始。
+                await migrate(settings.orders_partition_months_ahead, since=date.today() - timedelta(days=90))
+            # 本会话关闭外键/唯一性检查：ID 区间由生成器保证一致，逐行校验只会拖慢装载。
+            await conn.execute(text("SET FOREIGN_KEY_CHECKS = 0, UNIQUE_CHECKS = 0"))
+            await conn.execute(
+                insert(Store.__table__),
+                [{"id": i, "name": f"门店{i}", "city": _rng("store", i).choice(CITIES)} for i in range(1, plan.stores + 1)],
+            )
+            await conn.commit()
+            writer = _Loader(conn, stats)
+
+            old_members: dict[int, bytes] = {}
+            member_tasks = [
+                MemberTask(store_id=s, first_id=first, count=count, now=now, out_dir=out_dir)
+                for s in range(1, plan.stores + 1)
+                for first, count in [plan.member_range(s)]
+            ]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                store_id = 0
+                async for chunk in _stream(pool, generate_members, member_tasks, window=workers * 2):
+                    store_id += 1
+                    old_members[store_id] = chunk.old_members
+                    await writer.load(chunk)
+
+                order_tasks = _order_tasks(plan, old_members, now, out_dir)
+                async for chunk in _stream(pool, generate_orders, order_tasks, window=workers * 2):
+                    await writer.load(chunk)
+                    await writer.load(chunk.items)
+                    total = stats.rows.get("orders", 0)
+                    elapsed = time.perf_counter() - started
+                    print(f"[seed] orders={total} items={stats.rows.get('order_items', 0)} {total / elapsed:,.0f} orders/s")
+
+            await conn.execute(text("SET FOREIGN_KEY_CHECKS = 1, UNIQUE_CHECKS = 1"))
+            index_started = time.perf_counter()
+            built = await _build_indexes(conn)
+            stats.load_sec["indexes"] = time.perf_counter() - index_started
+            print(f"[seed] indexes built after load: {built or 'none'}")
+    finally:
+        await bulk_engine.dispose()
+        if out_dir is not None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    total_sec = time.perf_counter() - started
+    total_rows = sum(stats.rows.values())
+    for table, count in stats.rows.items():
+        seconds = stats.load_sec.get(table, 0.0)
+        print(f"[seed] {table:<12} rows={count:>12,} load={seconds:8.1f}s {count / seconds if seconds else 0:>12,.0f} rows/s")
+    print(
+        f"[seed] total rows={total_rows:,} in {total_sec:.1f}s = {total_rows / total_sec:,.0f} rows/s "
+        f"(loader={loader}, workers={workers}, generation cpu={stats.gen_sec:.1f}s)"
+    )
+    return stats
+
+
+def describe(plan: ScalePlan) -> str:
+    return f"orders={plan.orders:,} stores={plan.stores} members={plan.members:,} chunk={plan.chunk_size:,}"
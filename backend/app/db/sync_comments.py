@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+import argparse
 import asyncio
+import re
+from typing import Any
 
-from sqlalchemy import text
+from sqlalchemy import Table, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
 
 from app.db.engine import engine
 from app.db.models import Base
@@ -14,75 +19,135 @@ def _quote_str(value: str) -> str:
     return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
 
 
-async def sync_comments() -> None:
-    async with engine.begin() as conn:
+def _column_definition(meta: Any) -> str:
+    # MODIFY COLUMN 需要完整复述现有定义，只替换注释。
+    parts: list[str] = [meta["COLUMN_TYPE"]]
+    data_type = (meta["DATA_TYPE"] or "").lower()
+    if data_type in TEXT_TYPES:
+        if meta["CHARACTER_SET_NAME"]:
+            parts.append(f"CHARACTER SET {meta['CHARACTER_SET_NAME']}")
+        if meta["COLLATION_NAME"]:
+            parts.append(f"COLLATE {meta['COLLATION_NAME']}")
+
+    parts.append("NULL" if meta["IS_NULLABLE"] == "YES" else "NOT NULL")
+
+    default = meta["COLUMN_DEFAULT"]
+    if default is not None:
+        ds = str(default)
+        if ds.upper() in {"CURRENT_TIMESTAMP", "CURRENT_TIMESTAMP()", "NOW()"}:
+            parts.append("DEFAULT CURRENT_TIMESTAMP")
+        else:
+            try:
+                float(ds)
+                parts.append(f"DEFAULT {ds}")
+            except ValueError:
+                parts.append(f"DEFAULT {_quote_str(ds)}")
+
+    extra = (meta["EXTRA"] or "").strip()
+    if extra:
+        # MySQL 8 的 DEFAULT_GENERATED 不可直接放入 MODIFY COLUMN。
+        extra = " ".join([x for x in extra.split() if x.upper() != "DEFAULT_GENERATED"])
+        if extra:
+            parts.append(extra)
+    return " ".join(parts)
+
+
+def plan_table(table: Table, table_comment: str | None, columns: dict[str, Any]) -> tuple[list[str], dict[str, str]]:
+    """对比 ORM 与 information_schema，返回该表需要的 ALTER 子句及注释参数；已同步则为空。"""
+    clauses: list[str] = []
+    params: dict[str, str] = {}
+    if table_comment is not None and table_comment != (table.comment or ""):
+        clauses.append("COMMENT = :table_comment")
+        params["table_comment"] = table.comment or ""
+
+    for col in table.columns:
+        meta = columns.get(col.name)
+        if meta is None or (meta["COLUMN_COMMENT"] or "") == (col.comment or ""):
+            continue
+        key = f"c{len(params)}"
+        clauses.append(f"MODIFY COLUMN `{col.name}` {_column_definition(meta)} COMMENT :{key}")
+        params[key] = col.comment or ""
+    return clauses, params
+
+
+def _render(clause: str, params: dict[str, str]) -> str:
+    return re.sub(r":(\w+)\b", lambda m: _quote_str(params[m.group(1)]) if m.group(1) in params else m.group(0), clause)
+
+
+async def _load_schema(conn: AsyncConnection) -> tuple[dict[str, str], dict[str, dict[str, Any]]]:
+    # 整库各查一次表与列，无变更时的全部开销就是这两条 information_schema 查询。
+    tables = await conn.execute(
+        text("SELECT TABLE_NAME, TABLE_COMMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()")
+    )
+    table_comments = {name: comment or "" for name, comment in tables.all()}
+    rows = (
+        await conn.execute(
+            text(
+                """
+                SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, EXTRA,
+                       CHARACTER_SET_NAME, COLLATION_NAME, DATA_TYPE, COLUMN_COMMENT
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+                """
+            )
+        )
+    ).mappings().all()
+    columns: dict[str, dict[str, Any]] = {}
+    for r in rows:
+        columns.setdefault(r["TABLE_NAME"], {})[r["COLUMN_NAME"]] = r
+    return table_comments, columns
+
+
+async def _alter(conn: AsyncConnection, table_name: str, clauses: list[str], params: dict[str, str], instant: bool) -> str:
+    sql = f"ALTER TABLE `{table_name}` {', '.join(clauses)}"
+    if instant:
+        try:
+            await conn.execute(text(f"{sql}, ALGORITHM=INSTANT"), params)
+            return "INSTANT"
+        except DBAPIError as exc:
+            # 版本或列类型不支持 INSTANT 时 MySQL 直接拒绝，不会做任何修改；回退默认算法。
+            print(f"  INSTANT not supported for {table_name}: {exc.orig}")
+    await conn.execute(text(sql), params)
+    return "DEFAULT"
+
+
+async def sync_comments(dry_run: bool = False, instant: bool = False) -> int:
+    changed = 0
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
         db = await conn.scalar(text("SELECT DATABASE()"))
-        print(f"db={db}")
+        print(f"db={db}{' (dry-run)' if dry_run else ''}")
+        table_comments, columns = await _load_schema(conn)
 
         for table in Base.metadata.sorted_tables:
-            table_name = table.name
-            await conn.execute(
-                text(f"ALTER TABLE `{table_name}` COMMENT = :comment"),
-                {"comment": table.comment or ""},
-            )
-
-            rows = (
-                await conn.execute(
-                    text(
-                        """
-                        SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, EXTRA,
-                               CHARACTER_SET_NAME, COLLATION_NAME, DATA_TYPE
-                        FROM information_schema.COLUMNS
-                        WHERE TABLE_SCHEMA = :db AND TABLE_NAME = :tb
-                        ORDER BY ORDINAL_POSITION
-                        """
-                    ),
-                    {"db": db, "tb": table_name},
-                )
-            ).mappings().all()
-            by_name = {r["COLUMN_NAME"]: r for r in rows}
-
-            for col in table.columns:
-                meta = by_name.get(col.name)
-                if meta is None:
-                    continue
-
-                parts: list[str] = [meta["COLUMN_TYPE"]]
-                data_type = (meta["DATA_TYPE"] or "").lower()
-                if data_type in TEXT_TYPES:
-                    if meta["CHARACTER_SET_NAME"]:
-                        parts.append(f"CHARACTER SET {meta['CHARACTER_SET_NAME']}")
-                    if meta["COLLATION_NAME"]:
-                        parts.append(f"COLLATE {meta['COLLATION_NAME']}")
-
-                parts.append("NULL" if meta["IS_NULLABLE"] == "YES" else "NOT NULL")
-
-                default = meta["COLUMN_DEFAULT"]
-                if default is not None:
-                    ds = str(default)
-                    if ds.upper() in {"CURRENT_TIMESTAMP", "CURRENT_TIMESTAMP()", "NOW()"}:
-                        parts.append("DEFAULT CURRENT_TIMESTAMP")
-                    else:
-                        try:
-                            float(ds)
-                            parts.append(f"DEFAULT {ds}")
-                        except ValueError:
-                            parts.append(f"DEFAULT {_quote_str(ds)}")
-
-                extra = (meta["EXTRA"] or "").strip()
-                if extra:
-                    # MySQL 8 的 DEFAULT_GENERATED 不可直接放入 MODIFY COLUMN。
-                    extra = " ".join([x for x in extra.split() if x.upper() != "DEFAULT_GENERATED"])
-                    if extra:
-                        parts.append(extra)
-
-                sql = f"ALTER TABLE `{table_name}` MODIFY COLUMN `{col.name}` {' '.join(parts)} COMMENT :comment"
-                await conn.execute(text(sql), {"comment": col.comment or ""})
-
-            print(f"synced: {table_name}")
+            if table.name not in table_comments:
+                print(f"missing: {table.name}")
+                continue
+            clauses, params = plan_table(table, table_comments[table.name], columns.get(table.name, {}))
+            if not clauses:
+                print(f"in sync: {table.name}")
+                continue
+            changed += 1
+            print(f"{'plan' if dry_run else 'alter'}: {table.name} ({len(clauses)} change(s))")
+            for clause in clauses:
+                print(f"  {_render(clause, params)}")
+            if not dry_run:
+                algorithm = await _alter(conn, table.name, clauses, params, instant)
+                print(f"synced: {table.name} algorithm={algorithm}")
 
     await engine.dispose()
+    return changed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="把 ORM 中的表/列注释同步到 MySQL，只修改有差异的表")
+    parser.add_argument("--dry-run", action="store_true", help="只打印差异与将执行的 ALTER")
+    parser.add_argument("--instant", action="store_true", help="优先使用 ALGORITHM=INSTANT，不支持时回退")
+    args = parser.parse_args()
+    changed = asyncio.run(sync_comments(dry_run=args.dry_run, instant=args.instant))
+    print(f"tables changed={changed}")
 
 
 if __name__ == "__main__":
-    asyncio.run(sync_comments())
+    main()
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+
+def new_deadline(deadline_ms: float | None) -> tuple[float | None, float | None]:
+    # 返回 (单调时钟截止时刻, 预算毫秒)；None 用配置默认值，<=0 表示不限时。
+    ms = settings.request_deadline_ms if deadline_ms is None else deadline_ms
+    if not ms or ms <= 0:
+        return None, None
+    return time.monotonic() + ms / 1000, float(ms)
+
+
+def remaining_ms(deadline_at: float | None) -> float | None:
+    if deadline_at is None:
+        return None
+    return (deadline_at - time.monotonic()) * 1000
+
+
+def can_afford(deadline_at: float | None, need_ms: float) -> bool:
+    left = remaining_ms(deadline_at)
+    return left is None or left >= need_ms
+
+
+def timeout_for(deadline_at: float | None, cap_sec: float | None = None, reserve_ms: float = 0) -> float | None:
+    # 节点/工具的超时 = min(剩余预算 - 给下游预留, 自身上限)；不限时返回 cap。
+    left = remaining_ms(deadline_at)
+    if left is None:
+        return cap_sec
+    budget_sec = max(0.0, (left - reserve_ms) / 1000)
+    return budget_sec if cap_sec is None else min(budget_sec, cap_sec)
+
+
+def note_degraded(state: dict, stage: str, reason: str) -> None:
+    budget = state.setdefault("debug", {}).setdefault("budget", {})
+    budget.setdefault("degraded", []).append(
+        {"stage": stage, "reason": reason, "remaining_ms": _round(remaining_ms(state.get("deadline_at")))}
+    )
+
+
+def budget_report(result: dict[str, Any]) -> dict[str, Any]:
+    # 汇总到 debug.budget：总预算、结束时剩余、各阶段耗时与降级记录。
+    debug = result.get("debug") or {}
+    budget = dict(debug.get("budget") or {})
+    budget["deadline_ms"] = result.get("deadline_ms")
+    budget["remaining_ms"] = _round(remaining_ms(result.get("deadline_at")))
+    budget["spent_ms"] = dict(debug.get("timings_ms") or {})
+    budget.setdefault("degraded", [])
+    return budget
+
+
+def _round(value: float | None) -> int | None:
+    return None if value is None else int(value)
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from typing import Any
+
+from app.core.config import get_settings
+from app.graph.deadline import budget_report
+
+settings = get_settings()
+
+
+def chat_result(result: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "intent": result.get("intent"),
+        "answer": result.get("answer"),
+        "report": result.get("report"),
+        "plan": result.get("plan"),
+        "debug": {
+            **(result.get("debug") or {}),
+            "budget": budget_report(result),
+            "model": settings.deepseek_model,
+        },
+    }
+
+
+def progress_events(node: str, update: dict[str, Any]) -> list[dict[str, Any]]:
+    # 把节点状态增量映射为前端可渲染的类型化事件；answer 由 token 事件承载，不重复推送。
+    events: list[dict[str, Any]] = []
+    if "intent" in update:
+        events.append({"type": "intent", "node": node, "intent": update["intent"]})
+    if "sql" in update:
+        sql_error = (update.get("sql_error") or {}).get("message")
+        events.append({"type": "sql", "node": node, "sql": update["sql"], "error": sql_error})
+    if update.get("report") is not None:
+        events.append({"type": "report", "node": node, "report": update["report"]})
+    if "knowledge" in update:
+        events.append({"type": "knowledge", "node": node, "knowledge": update["knowledge"] or []})
+    if update.get("plan") is not None:
+        events.append({"type": "plan", "node": node, "plan": update["plan"]})
+    return events
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import re
+from typing import Any
+
+import numpy as np
+
+# 追问里的维度/指标说法 -> 结果集中可能的列名（按优先级）。
+DIM_ALIASES: dict[str, tuple[str, ...]] = {
+    "门店": ("store_id", "store", "store_name"),
+    "渠道": ("channel",),
+    "品类": ("category",),
+    "会员": ("member_id",),
+    "等级": ("level",),
+    "日期": ("dt", "date", "day", "paid_date"),
+    "天": ("dt", "date", "day", "paid_date"),
+    "城市": ("city",),
+}
+METRIC_ALIASES: dict[str, tuple[str, ...]] = {
+    "gmv": ("gmv",),
+    "交易额": ("gmv",),
+    "销售额": ("gmv", "amount"),
+    "订单": ("order_count", "order_cnt", "orders"),
+    "单量": ("order_count", "order_cnt", "orders"),
+    "客单价": ("aov",),
+    "金额": ("amount", "gmv"),
+}
+# 不带维度的筛选值：只看线上 -> channel = online。
+VALUE_ALIASES: dict[str, tuple[str, str]] = {
+    "线上": ("channel", "online"),
+    "线下": ("channel", "offline"),
+    "到店": ("channel", "offline"),
+    "外卖": ("channel", "delivery"),
+}
+# 比率类指标不能直接求和或取均值：客单价由汇总后的 GMV / 订单数重算，其它比率按分母列加权；都做不到时回库重查。
+_RATIO_COLUMN = re.compile(r"(aov|rate|ratio|avg|pct|率|均)", re.IGNORECASE)
+_AOV_COLUMN = re.compile(r"(aov|客单价)", re.IGNORECASE)
+_AOV_NUMERATORS = ("gmv", "amount")
+_COUNT_COLUMNS = ("order_count", "order_cnt", "orders")
+# 比率名中的关键字 -> 分母列候选（按优先级）。
+_RATE_DENOMINATORS: dict[str, tuple[str, ...]] = {
+    "repurchase": ("buyer_count", "member_count", "buyers", "members"),
+    "复购": ("buyer_count", "member_count", "buyers", "members"),
+    "conversion": ("visitor_count", "visitors", "uv"),
+    "转化": ("visitor_count", "visitors", "uv"),
+    "refund": _COUNT_COLUMNS,
+    "退款": _COUNT_COLUMNS,
+    "coupon_use": ("coupon_count", "issued_count"),
+    "核销": ("coupon_count", "issued_count"),
+}
+# 出现新的时间口径说明是新问题，不能用上一轮结果回答。
+_NEW_WINDOW = re.compile(r"(最近\s*\d+\s*(天|周|月)|去年|今年|本月|上月|本周|上周|\d{1,2}\s*月)")
+_DIM_WORDS = "|".join(DIM_ALIASES)
+
+_FILTER = re.compile(rf"(?:只看|仅看|只要|筛选|过滤)\s*({_DIM_WORDS})?\s*[=：:]?\s*([0-9A-Za-z一-龥_\-]+)")
+_GROUP = re.compile(rf"按\s*({_DIM_WORDS})\s*(?:再|重新)?\s*(?:拆|分|汇总|聚合|细分|看)")
+_SORT = re.compile(r"(?:按\s*([0-9A-Za-z一-龥_]+?)\s*)?(降序|升序|从高到低|从低到高|倒序|排序)")
+_TOP = re.compile(r"(?:前|top\s*|最高的?|最低的?)\s*(\d{1,4})", re.IGNORECASE)
+_VALUE_TAIL = re.compile(r"(的.*|数据|吧|呢|啊)$")
+# 明确针对上一轮结果的说法；没有这些标记的排序/TopN 只在没有引入新指标/维度时才算追问。
+_MARKER = re.compile(r"(只看|仅看|只要|筛选|过滤|再|其中|这些|上面|刚才)")
+_METRIC_WORDS = re.compile("|".join(map(re.escape, METRIC_ALIASES)), re.IGNORECASE)
+_DIM_WORD = re.compile(_DIM_WORDS)
+_MAX_FOLLOWUP_CHARS = 40
+
+
+def _introduces_new_terms(query: str, last_query: str) -> bool:
+    # 出现上一轮问题里没有的指标/维度词（如上一轮问 GMV、这次问销售额），视为新问题。
+    last = last_query.lower()
+    words = [w.lower() for w in _METRIC_WORDS.findall(query)] + _DIM_WORD.findall(query)
+    m = _SORT.search(query)
+    if m and m.group(1):
+        words.append(m.group(1).lower())
+    return any(w not in last for w in words)
+
+
+def parse_followup(query: str, last_query: str = "") -> list[dict[str, Any]] | None:
+    """把短追问解析为 筛选 -> 再聚合 -> 排序 -> TopN 操作序列；不像追问时返回 None。
+
+    没有“只看/再/按…拆”等明确标记时，只有不引入新指标、维度词（相对 last_query）的排序/TopN 才算追问，
+    “门店销售额排序前5”这类完整的新问题交给正常路由。
+    """
+    q = (query or "").strip()
+    if not q or len(q) > _MAX_FOLLOWUP_CHARS or _NEW_WINDOW.search(q):
+        return None
+    if not (_MARKER.search(q) or _GROUP.search(q)) and _introduces_new_terms(q, last_query or ""):
+        return None
+    ops: list[dict[str, Any]] = []
+
+    m = _FILTER.search(q)
+    if m:
+        dim, value = m.group(1), _VALUE_TAIL.sub("", m.group(2))
+        if dim is None:
+            for word, alias in VALUE_ALIASES.items():
+                if value.startswith(word):
+                    ops.append({"op": "filter", "dim": alias[0], "value": alias[1]})
+                    break
+            else:
+                # "只看门店3" 的维度与取值连写时拆开。
+                m_split = re.match(rf"({_DIM_WORDS})(.+)", value)
+                if m_split:
+                    ops.append({"op": "filter", "dim": m_split.group(1), "value": m_split.group(2)})
+        else:
+            ops.append({"op": "filter", "dim": dim, "value": VALUE_ALIASES.get(value, (None, value))[1]})
+
+    m = _GROUP.search(q)
+    if m:
+        ops.append({"op": "group", "dim": m.group(1)})
+
+    m = _SORT.search(q)
+    m_top = _TOP.search(q)
+    if m or m_top:
+        desc = not ((m and m.group(2) in {"升序", "从低到高"}) or "最低" in q)
+        metric = m.group(1) if m and m.group(1) not in (None, *DIM_ALIASES) else None
+        ops.append({"op": "sort", "metric": metric, "desc": desc})
+    if m_top:
+        ops.append({"op": "top", "n": int(m_top.group(1))})
+    return ops or None
+
+
+def _find_column(columns: list[str], word: str | None, aliases: dict[str, tuple[str, ...]]) -> str | None:
+    if word is None:
+        return None
+    if word in columns:
+        return word
+    candidates = aliases.get(word.lower(), aliases.get(word, ()))
+    for name in candidates:
+        if name in columns:
+            return name
+    return None
+
+
+def _numeric(values: np.ndarray) -> np.ndarray | None:
+    try:
+        return values.astype(float)
+    except (TypeError, ValueError):
+        return None
+
+
+def _ratio_plan(column: str, numeric_cols: list[str]) -> dict[str, str] | None:
+    """比率列的再聚合方式：{"num", "den"} 用汇总后的分子/分母重算，{"weight"} 按分母列加权；无法正确计算返回 None。"""
+    if _AOV_COLUMN.search(column):
+        num = next((c for c in _AOV_NUMERATORS if c in numeric_cols), None)
+        den = next((c for c in _COUNT_COLUMNS if c in numeric_cols), None)
+        return {"num": num, "den": den} if num and den else None
+    lowered = column.lower()
+    for word, candidates in _RATE_DENOMINATORS.items():
+        if word in lowered:
+            weight = next((c for c in candidates if c in numeric_cols), None)
+            return {"weight": weight} if weight else None
+    return None
+
+
+def resolve_ops(
+    ops: list[dict[str, Any]], columns: list[str], rows: list[dict[str, Any]]
+) -> list[dict[str, Any]] | None:
+    """把维度/指标说法映射到缓存结果的真实列；任一操作缺列（例如需要重新按渠道取数）返回 None。"""
+    if not rows:
+        return None
+    resolved: list[dict[str, Any]] = []
+    numeric_cols = [c for c in columns if _numeric(np.asarray([r.get(c) for r in rows], dtype=object)) is not None]
+    for op in ops:
+        if op["op"] in {"filter", "group"}:
+            column = op["dim"] if op["dim"] in columns else _find_column(columns, op["dim"], DIM_ALIASES)
+            if column is None:
+                return None
+            if op["op"] == "group":
+                ratios: dict[str, dict[str, str]] = {}
+                for c in numeric_cols:
+                    if c == column or c.endswith("_id") or not _RATIO_COLUMN.search(c):
+                        continue
+                    plan = _ratio_plan(c, numeric_cols)
+                    if plan is None:
+                        # 缺分子/分母列时算不出正确的比率，宁可回库重查也不返回错误数字。
+                        return None
+                    ratios[c] = plan
+                resolved.append({**op, "column": column, "ratios": ratios})
+                continue
+            resolved.append({**op, "column": column})
+        elif op["op"] == "sort":
+            column = _find_column(columns, op["metric"], METRIC_ALIASES) if op["metric"] else None
+            if column is None:
+                # 未指明指标：按第一个数值型指标列排序（跳过 ID 类维度）。
+                metrics = [c for c in numeric_cols if not c.endswith("_id") and c not in {"id", "level"}]
+                if not metrics:
+                    return None
+                column = metrics[0]
+            resolved.append({**op, "column": column})
+        else:
+            resolved.append(op)
+    return resolved
+
+
+def apply_ops(
+    ops: list[dict[str, Any]], columns: list[str], rows: list[dict[str, Any]]
+) -> tuple[list[str], list[dict[str, Any]]]:
+    # 按列转成 numpy 数组，筛选/分组/排序都以向量运算完成，不逐行循环计算。
+    frame = {c: np.asarray([r.get(c) for r in rows], dtype=object) for c in columns}
+    index = np.arange(len(rows))
+    for op in ops:
+        if op["op"] == "filter":
+            index = index[frame[op["column"]][index].astype(str) == str(op["value"])]
+        elif op["op"] == "group":
+            key = op["column"]
+            keys = frame[key][index]
+            uniq, inverse = np.unique(keys.astype(str), return_inverse=True)
+            first = np.zeros(len(uniq), dtype=int)
+            first[inverse[::-1]] = np.arange(len(inverse))[::-1]
+            ratios = op.get("ratios") or {}
+            grouped: dict[str, np.ndarray] = {key: keys[first]}
+            sums_of: dict[str, np.ndarray] = {}
+            for c in columns:
+                if c == key:
+                    continue
+                values = _numeric(frame[c][index])
+                if values is None or c.endswith("_id"):
+                    continue
+                sums_of[c] = np.bincount(inverse, weights=values, minlength=len(uniq))
+            for c in columns:
+                if c not in sums_of:
+                    continue
+                values = _numeric(frame[c][index])
+                sums = sums_of[c]
+                if c in ratios:
+                    plan = ratios[c]
+                    if "weight" in plan:
+                        weights = _numeric(frame[plan["weight"]][index])
+                        num = np.bincount(inverse, weights=values * weights, minlength=len(uniq))
+                        den = sums_of[plan["weight"]]
+                    else:
+                        num, den = sums_of[plan["num"]], sums_of[plan["den"]]
+                    safe = np.where(den != 0, den, 1)
+                    grouped[c] = np.round(np.where(den != 0, num / safe, 0.0), 2 if "num" in plan else 4)
+                elif np.all(values == np.floor(values)):
+                    # 计数类列保持整数。
+                    grouped[c] = sums.astype(np.int64)
+                else:
+                    grouped[c] = np.round(sums, 2)
+            columns = list(grouped)
+            frame = grouped
+            index = np.arange(len(uniq))
+        elif op["op"] == "sort":
+            column = frame[op["column"]][index]
+            values = _numeric(column)
+            order = np.argsort(values if values is not None else column.astype(str), kind="stable")
+            index = index[order[::-1] if op["desc"] else order]
+        elif op["op"] == "top":
+            index = index[: op["n"]]
+    result = [{c: _scalar(frame[c][i]) for c in columns} for i in index]
+    return columns, result
+
+
+def _scalar(value: Any) -> Any:
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def describe_ops(ops: list[dict[str, Any]]) -> str:
+    parts: list[str] = []
+    for op in ops:
+        if op["op"] == "filter":
+            parts.append(f"筛选 {op['column']}={op['value']}")
+        elif op["op"] == "group":
+            parts.append(f"按 {op['column']} 汇总")
+        elif op["op"] == "sort":
+            parts.append(f"按 {op['column']} {'降序' if op['desc'] else '升序'}")
+        elif op["op"] == "top":
+            parts.append(f"取前 {op['n']} 行")
+    return "，".join(parts)
@@ -1,68 +1,196 @@
 ﻿from __future__ import annotations
 
-from collections.abc import Awaitable, Callable
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
 
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import END, START, StateGraph
 
+from app.core.config import get_settings
+from app.core.tracing import Span, traced_node, tracer
+from app.graph.deadline import new_deadline
+from app.graph.memory import session_memory
 from app.graph.nodes import (
+    answer_followup,
     compose_diagnosis_answer,
     compose_report_answer,
     execute_campaign,
+    explain_campaign_plan,
+    gather_diagnosis_evidence,
     gen_campaign_plan,
+    query_report_data,
+    retrieve_plan_knowledge,
     route_intent,
 )
 from app.graph.state import GraphState
 
 
+settings = get_settings()
 _graph = None
+_memory_graphs: dict[int, Any] = {}
 
 
 def _intent_router(state: GraphState) -> str:
     return state.get("intent", "report")
 
 
-def get_graph():
-    global _graph
-    if _graph is not None:
-        return _graph
-
+def _build_workflow() -> StateGraph:
     workflow = StateGraph(GraphState)
-    workflow.add_node("route_intent", route_intent)
-    workflow.add_node("compose_report_answer", compose_report_answer)
-    workflow.add_node("compose_diagnosis_answer", compose_diagnosis_answer)
-    workflow.add_node("gen_campaign_plan", gen_campaign_plan)
-    workflow.add_node("execute_campaign", execute_campaign)
+    # 取数/检索与 LLM 生成拆成独立节点，流式接口可在每个节点完成时先推送中间结果；每个节点一个 span。
+    for node in (
+        route_intent,
+        query_report_data,
+        compose_report_answer,
+        answer_followup,
+        gather_diagnosis_evidence,
+        compose_diagnosis_answer,
+        retrieve_plan_knowledge,
+        gen_campaign_plan,
+        explain_campaign_plan,
+        execute_campaign,
+    ):
+        workflow.add_node(node.__name__, traced_node(node.__name__, node))
 
     workflow.add_edge(START, "route_intent")
     workflow.add_conditional_edges(
         "route_intent",
         _intent_router,
         {
-            "report": "compose_report_answer",
-            "diagnose": "compose_diagnosis_answer",
-            "plan": "gen_campaign_plan",
+            "report": "query_report_data",
+            "followup": "answer_followup",
+            "diagnose": "gather_diagnosis_evidence",
+            "plan": "retrieve_plan_knowledge",
             "execute": "execute_campaign",
         },
     )
+    workflow.add_edge("query_report_data", "compose_report_answer")
+    workflow.add_edge("gather_diagnosis_evidence", "compose_diagnosis_answer")
+    workflow.add_edge("retrieve_plan_knowledge", "gen_campaign_plan")
+    workflow.add_edge("gen_campaign_plan", "explain_campaign_plan")
     workflow.add_edge("compose_report_answer", END)
+    workflow.add_edge("answer_followup", END)
     workflow.add_edge("compose_diagnosis_answer", END)
-    workflow.add_edge("gen_campaign_plan", END)
+    workflow.add_edge("explain_campaign_plan", END)
     workflow.add_edge("execute_campaign", END)
+    return workflow
+
 
-    _graph = workflow.compile()
+def get_graph():
+    global _graph
+    if _graph is None:
+        _graph = _build_workflow().compile()
     return _graph
 
 
-async def ainvoke(
+def get_memory_graph(checkpointer: BaseCheckpointSaver):
+    # 带 checkpointer 的图按 thread_id 读写会话状态；checkpointer 重建（换事件循环）时重新编译。
+    graph = _memory_graphs.get(id(checkpointer))
+    if graph is None:
+        _memory_graphs.clear()
+        graph = _memory_graphs[id(checkpointer)] = _build_workflow().compile(checkpointer=checkpointer)
+    return graph
+
+
+def _initial_state(
     query: str,
-    plan: dict | None = None,
-    stream_cb: Callable[[str], Awaitable[None]] | None = None,
-) -> dict:
-    graph = get_graph()
-    initial_state: GraphState = {
+    plan: dict | None,
+    report_format: str | None = None,
+    deadline_ms: float | None = None,
+) -> GraphState:
+    deadline_at, budget_ms = new_deadline(deadline_ms)
+    # 有会话时 checkpointer 会带回上一轮状态：逐轮字段在这里显式清空，只有 last_result 跨轮保留。
+    return {
         "user_query": query,
         "plan": plan,
-        "stream_cb": stream_cb,
+        "sql": None,
+        "draft_sql": None,
+        "rows": None,
+        "sql_error": None,
+        "knowledge": None,
+        "answer": None,
+        "report": None,
+        "execution": None,
+        "followup": None,
+        "report_format": report_format or settings.report_format_default,
+        "deadline_at": deadline_at,
+        "deadline_ms": budget_ms,
         "debug": {},
     }
-    return await graph.ainvoke(initial_state)
+
+
+async def _prepare(
+    session_id: str | None,
+    stream_cb: Callable[[str], Awaitable[None]] | None,
+    span: Span,
+    admission_cb: Callable[[str], Awaitable[None]] | None = None,
+) -> tuple[Any, dict[str, Any], dict[str, Any]]:
+    # stream_cb、admission_cb、trace_span 放在运行配置而不是状态里：不可序列化，不能进入 checkpoint。
+    config: dict[str, Any] = {
+        "configurable": {"stream_cb": stream_cb, "admission_cb": admission_cb, "trace_span": span}
+    }
+    if not session_id or not session_memory.enabled:
+        return get_graph(), config, {}
+    await session_memory.touch(session_id)
+    config["configurable"]["thread_id"] = session_id
+    # 只在本轮结束时写一次 checkpoint，不逐节点落盘。
+    return get_memory_graph(await session_memory.checkpointer()), config, {"durability": "exit"}
+
+
+def _finish_trace(span: Span, result: dict[str, Any]) -> None:
+    span.set(intent=result.get("intent"))
+    if span.trace_id is not None:
+        # 响应 debug 带上 trace_id，便于从一次请求直接找到对应的 span。
+        result.setdefault("debug", {})["trace_id"] = span.trace_id
+
+
+async def ainvoke(
+    query: str,
+    plan: dict | None = None,
+    stream_cb: Callable[[str], Awaitable[None]] | None = None,
+    report_format: str | None = None,
+    deadline_ms: float | None = None,
+    session_id: str | None = None,
+    admission_cb: Callable[[str], Awaitable[None]] | None = None,
+) -> dict:
+    # deadline_ms: None 取配置默认预算，<=0 不限时；session_id 为空时无会话记忆。
+    # admission_cb: 意图确定后回调（准入按实际意图换道），不走准入的调用方不传。
+    with tracer.span("graph.ainvoke", session=bool(session_id), has_plan=plan is not None) as span:
+        graph, config, options = await _prepare(session_id, stream_cb, span, admission_cb)
+        result = await graph.ainvoke(_initial_state(query, plan, report_format, deadline_ms), config, **options)
+        _finish_trace(span, result)
+    return result
+
+
+async def astream(
+    query: str,
+    plan: dict | None = None,
+    stream_cb: Callable[[str], Awaitable[None]] | None = None,
+    report_format: str | None = None,
+    deadline_ms: float | None = None,
+    session_id: str | None = None,
+    admission_cb: Callable[[str], Awaitable[None]] | None = None,
+) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    # 逐节点产出 (节点名, 状态增量)；最后产出 ("__end__", 最终状态)，与 ainvoke 返回值一致。
+    # 生成器跨 yield 不能持有 contextvar，根 span 只经 config 传给节点，不设为当前 span。
+    span = tracer.start_span("graph.astream", session=bool(session_id), has_plan=plan is not None)
+    try:
+        graph, config, options = await _prepare(session_id, stream_cb, span, admission_cb)
+        final: dict[str, Any] = {}
+        async for mode, chunk in graph.astream(
+            _initial_state(query, plan, report_format, deadline_ms),
+            config,
+            stream_mode=["updates", "values"],
+            **options,
+        ):
+            if mode == "updates":
+                for node, update in chunk.items():
+                    yield node, update or {}
+            else:
+                final = chunk
+        _finish_trace(span, final)
+        yield "__end__", final
+    except Exception as exc:
+        span.record_error(exc)
+        raise
+    finally:
+        span.end()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def _load_sqlite_saver():
+    try:
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    except ImportError:
+        return None
+    return AsyncSqliteSaver
+
+
+class SessionMemory:
+    """按 session_id（即 LangGraph thread_id）保存会话状态；空闲超时或超出会话数上限时删除整条会话。"""
+
+    def __init__(self) -> None:
+        self.backend = settings.chat_memory_backend
+        self._saver: BaseCheckpointSaver | None = None
+        self._conn: Any = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._last_used: OrderedDict[str, float] = OrderedDict()
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend != "off"
+
+    async def checkpointer(self) -> BaseCheckpointSaver:
+        loop = asyncio.get_running_loop()
+        if self._saver is not None and (self.backend == "memory" or self._loop is loop):
+            return self._saver
+        if self.backend == "sqlite":
+            saver_cls = _load_sqlite_saver()
+            if saver_cls is None:
+                logger.warning(
+                    "CHAT_MEMORY_BACKEND=sqlite 但未安装 langgraph-checkpoint-sqlite，回退内存会话"
+                )
+                self.backend = "memory"
+            else:
+                import aiosqlite
+
+                # SQLite 连接与事件循环绑定；脚本多次 asyncio.run 时按新循环重建。
+                self._conn = await aiosqlite.connect(settings.chat_memory_sqlite_abs)
+                self._saver = saver_cls(self._conn)
+                await self._saver.setup()
+                self._loop = loop
+                return self._saver
+        self._saver = InMemorySaver()
+        return self._saver
+
+    async def touch(self, session_id: str) -> None:
+        now = time.monotonic()
+        self._last_used[session_id] = now
+        self._last_used.move_to_end(session_id)
+        expired: list[str] = []
+        for sid, used_at in self._last_used.items():
+            over_limit = len(self._last_used) - len(expired) > settings.chat_memory_max_sessions
+            if sid == session_id or not (over_limit or now - used_at > settings.chat_memory_ttl_sec):
+                break
+            expired.append(sid)
+        if not expired:
+            return
+        saver = await self.checkpointer()
+        for sid in expired:
+            self._last_used.pop(sid, None)
+            await saver.adelete_thread(sid)
+        self.evicted += len(expired)
+
+    async def aclose(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+            self._saver = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "sessions": len(self._last_used),
+            "max_sessions": settings.chat_memory_max_sessions,
+            "ttl_sec": settings.chat_memory_ttl_sec,
+            "evicted": self.evicted,
+        }
+
+
+session_memory = SessionMemory()
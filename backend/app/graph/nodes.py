@@ -1,14 +1,32 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import json
 import re
 import time
+import weakref
+from contextlib import asynccontextmanager
+from collections.abc import Awaitable, Callable
 from typing import Any
 
+from langchain_core.runnables import RunnableConfig
+from sqlalchemy.exc import IntegrityError
+
+from app.core.batch_cache import cached
 from app.core.config import get_settings
-from app.db.crud import create_action_log, create_campaign, get_action_log_by_key, make_idempotency_key
+from app.db.crud import (
+    bulk_create_action_logs,
+    bulk_create_campaigns,
+    create_action_log,
+    create_campaign,
+    get_action_log_by_key,
+    get_action_logs_by_keys,
+    make_idempotency_key,
+    requeue_action_log,
+)
 from app.db.engine import AsyncSessionLocal
-from app.llm.deepseek_client import deepseek_client
+from app.graph.deadline import can_afford, note_degraded, timeout_for
+from app.llm.deepseek_client import LLMTimeoutError, deepseek_client
 from app.llm.prompts import (
     DIAGNOSE_SYSTEM,
     PLAN_EXPLAIN_SYSTEM,
@@ -16,6 +34,7 @@ from app.llm.prompts import (
     REPORT_SUMMARY_SYSTEM,
     build_route_intent_system,
     build_diagnosis_fallback,
+    build_default_plan,
     build_diagnosis_user_prompt,
     build_plan_explain_user_prompt,
     build_plan_markdown,
@@ -23,10 +42,12 @@ from app.llm.prompts import (
     build_plan_user_prompt,
     build_report_summary_user_prompt,
 )
-from app.graph.tools import kb_query_tool, sql_query_tool
-from app.integrations.crm_client import crm_client
+from app.graph.followup import apply_ops, describe_ops, parse_followup, resolve_ops
+from app.graph.tools import _column_types, fused_intent_sql, kb_query_tool, sql_query_tool
+from app.jobs.outbox import outbox_dispatcher
 
 settings = get_settings()
+_execute_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
 
 
 def _timer() -> float:
@@ -81,100 +102,302 @@ def _extract_budget_duration(query: str) -> tuple[int, int]:
     return budget, duration
 
 
-async def route_intent(state: dict) -> dict:
+_DIAGNOSE_WORDS = ("为什么", "原因", "下降", "下滑", "异常", "诊断")
+_PLAN_WORDS = ("活动", "方案", "预算", "促", "营销", "券")
+_TRUNCATED_NOTE = "\n\n（已达到时间预算，回答被截断）"
+
+
+def keyword_intent(query: str) -> str:
+    # 关键词粗分类：预算不足以调用 LLM 时的兜底路由，也用于入口准入的意图预判。
+    if any(w in query for w in _PLAN_WORDS):
+        return "plan"
+    if any(w in query for w in _DIAGNOSE_WORDS):
+        return "diagnose"
+    return "report"
+
+
+def _stream_cb(config: RunnableConfig | None) -> Callable[[str], Awaitable[None]] | None:
+    # 流式回调随运行配置传入（不可序列化，不放进会话 checkpoint）。
+    return ((config or {}).get("configurable") or {}).get("stream_cb")
+
+
+def _admission_cb(config: RunnableConfig | None) -> Callable[[str], Awaitable[None]] | None:
+    return ((config or {}).get("configurable") or {}).get("admission_cb")
+
+
+async def _llm_with_budget(
+    state: dict,
+    stage: str,
+    *,
+    system: str,
+    user: str,
+    stream_cb: Callable[[str], Awaitable[None]] | None = None,
+) -> str | None:
+    # 剩余预算不足或调用超时返回 None，由调用方降级；流式超时保留已推送部分并追加截断提示。
+    deadline_at = state.get("deadline_at")
+    if not can_afford(deadline_at, settings.deadline_min_llm_ms):
+        note_degraded(state, stage, "skip_llm")
+        return None
+    try:
+        if stream_cb is not None:
+            return await deepseek_client.chat_stream(
+                system=system,
+                user=user,
+                temperature=0.2,
+                on_token=stream_cb,
+                timeout=timeout_for(deadline_at),
+            )
+        return await deepseek_client.chat(system=system, user=user, temperature=0.2, timeout=timeout_for(deadline_at))
+    except LLMTimeoutError as exc:
+        note_degraded(state, stage, "llm_timeout")
+        if not exc.partial:
+            return None
+        if stream_cb is not None:
+            await stream_cb(_TRUNCATED_NOTE)
+        return exc.partial + _TRUNCATED_NOTE
+
+
+def _build_report(tool_result: dict[str, Any], state: dict) -> dict[str, Any]:
+    # 默认 rows（对象数组）；columnar 为 {columns, types, data} 二维数组，体积更小、序列化更快。
+    table = tool_result.get("table") or {"columns": [], "types": [], "data": []}
+    if state.get("report_format") == "columnar":
+        return {"format": "columnar", **table}
+    return {"columns": table["columns"], "rows": tool_result.get("rows") or []}
+
+
+async def _fused_route(state: dict, query: str) -> tuple[str, str | None] | None:
+    # 合并调用失败（超时/JSON 不合法）返回 None，回退到单独的意图分类调用。
+    deadline_at = state.get("deadline_at")
+    try:
+        intent, draft_sql = await cached(
+            "intent_sql", query, lambda: fused_intent_sql(query, timeout=timeout_for(deadline_at))
+        )
+    except LLMTimeoutError:
+        note_degraded(state, "route", "fused_timeout")
+        return None
+    if intent is None:
+        note_degraded(state, "route", "fused_invalid")
+        return None
+    return intent, draft_sql
+
+
+async def route_intent(state: dict, config: RunnableConfig | None = None) -> dict:
     # 1) 读取输入上下文。
     start = _timer()
     query = state.get("user_query", "")
     plan = state.get("plan")
 
+    deadline_at = state.get("deadline_at")
+    # 会话内有上一轮报表时，先判断是否为针对它的追问（筛选/排序/TopN/再聚合）。
+    last = state.get("last_result")
+    followup = parse_followup(query, last["query"]) if last and not plan else None
+    ops = resolve_ops(followup, last["columns"], last["rows"]) if followup else None
+    update: dict[str, Any] = {}
+
     # 2) 若已有结构化 plan，则执行链路优先，避免分类歧义。
     if plan:
         intent = "execute"
         llm_result = "skipped_by_plan"
+    elif ops is not None:
+        # 缓存结果足以回答：进程内计算，不调 LLM、不查库。
+        intent = "followup"
+        llm_result = "skipped_by_followup"
+        update["followup"] = ops
+    elif followup is not None:
+        # 是追问但缓存里缺所需列（例如按渠道拆分聚合结果）：带上一轮问题重新取数。
+        intent = "report"
+        llm_result = "skipped_by_followup"
+        update["user_query"] = f"{last['query']}，{query}"
+    elif not can_afford(deadline_at, settings.deadline_min_llm_ms):
+        # 3) 预算不足以调用 LLM：关键词路由兜底。
+        intent = keyword_intent(query)
+        llm_result = "skipped_by_budget"
+        note_degraded(state, "route", "keyword_intent")
+    elif settings.intent_sql_fused and (fused := await _fused_route(state, query)) is not None:
+        # 4) 合并模式：一次调用同时得到意图与 SQL 草稿，草稿经 state.draft_sql 交给取数节点，守卫通过前不进入 sql（不会作为 sql 事件推送）。
+        intent, draft_sql = fused
+        llm_result = f"fused:{intent}"
+        if draft_sql:
+            update["draft_sql"] = draft_sql
     else:
-        # 3) 纯 LLM 分类：使用包含定义与示例的 few-shot 提示词。
-        llm_result = await deepseek_client.chat(system=build_route_intent_system(), user=query, temperature=0)
-        llm_result = llm_result.strip().lower()
-        intent = llm_result if llm_result in {"report", "diagnose", "plan", "execute"} else "report"
-
-    # 4) 写入调试信息，便于观察分类稳定性。
-    state.setdefault("debug", {})["route_intent"] = {"llm": llm_result, "final": intent, "has_plan": bool(plan)}
+        # 5) 纯 LLM 分类：使用包含定义与示例的 few-shot 提示词；超时同样走关键词兜底。
+        try:
+            llm_result = await cached(
+                "intent",
+                query,
+                lambda: deepseek_client.chat(
+                    system=build_route_intent_system(),
+                    user=query,
+                    temperature=0,
+                    timeout=timeout_for(deadline_at),
+                ),
+            )
+            llm_result = llm_result.strip().lower()
+            intent = llm_result if llm_result in {"report", "diagnose", "plan", "execute"} else "report"
+        except LLMTimeoutError:
+            intent = keyword_intent(query)
+            llm_result = "timeout"
+            note_degraded(state, "route", "keyword_intent")
+
+    # 6) 写入调试信息，便于观察分类稳定性。
+    state.setdefault("debug", {})["route_intent"] = {
+        "llm": llm_result,
+        "final": intent,
+        "has_plan": bool(plan),
+        "followup": followup is not None,
+        "mode": "fused" if llm_result.startswith("fused:") else "two_call",
+    }
 
     _add_timing(state, "route", start)
-    return {"intent": intent, "debug": state.get("debug", {})}
+    # 7) 准入按实际意图换道：关键词预判为 report、LLM 判为 diagnose/plan 的请求不能继续占 report 名额。
+    if (admission_cb := _admission_cb(config)) is not None:
+        await admission_cb(intent)
+    return {"intent": intent, "debug": state.get("debug", {}), **update}
 
 
-async def compose_report_answer(state: dict) -> dict:
-    # 1) 组装报表结构。
+async def query_report_data(state: dict) -> dict:
+    # 1) 先取数：SQL 与报表行单独成节点，流式接口可在总结生成前先推送表格。
     start = _timer()
     query = state.get("user_query", "")
     intent = state.get("intent", "report")
-    tool_result = await sql_query_tool.ainvoke({"query": query, "intent": intent})
+    tool_result = await sql_query_tool.ainvoke(
+        {"query": query, "intent": intent, "deadline_at": state.get("deadline_at"), "draft_sql": state.get("draft_sql")}
+    )
     rows = tool_result.get("rows") or []
-    columns = list(rows[0].keys()) if rows else []
-    stream_cb = state.get("stream_cb")
     debug = state.setdefault("debug", {})
     debug["tools"] = {
         **(debug.get("tools") or {}),
         "sql_query_tool": tool_result.get("debug", {}),
     }
 
-    # 2) 基于查询结果动态生成自然语言总结，避免固定模板口径。
     sql_error = tool_result.get("error")
+    update: dict[str, Any] = {}
+    if rows and not sql_error:
+        # 记住本轮报表，供同一会话的追问直接复用。
+        update["last_result"] = {
+            "query": query,
+            "sql": tool_result.get("sql"),
+            "columns": (tool_result.get("table") or {}).get("columns") or list(rows[0]),
+            "rows": rows,
+        }
+    _add_timing(state, "sql", start)
+    return {
+        "sql": tool_result.get("sql"),
+        "rows": rows,
+        "sql_error": {"message": sql_error} if sql_error else None,
+        "report": _build_report(tool_result, state),
+        "debug": debug,
+        **update,
+    }
+
+
+async def compose_report_answer(state: dict, config: RunnableConfig) -> dict:
+    # 1) 读取上游取数结果。
+    start = _timer()
+    rows = state.get("rows") or []
+    stream_cb = _stream_cb(config)
+    debug = state.setdefault("debug", {})
+
+    # 2) 基于查询结果动态生成自然语言总结，避免固定模板口径。
+    sql_error = (state.get("sql_error") or {}).get("message")
     if sql_error:
         answer = f"数据查询执行失败，已自动尝试修复但未成功：{sql_error}。请调整问题口径后重试。"
         if stream_cb is not None:
             await stream_cb(answer)
         _add_timing(state, "compose", start)
-        return {
-            "answer": answer,
-            "report": {"columns": columns, "rows": rows},
-            "debug": debug,
-        }
+        return {"answer": answer, "debug": debug}
 
     if rows:
         report_prompt = build_report_summary_user_prompt(state.get("user_query", ""), rows)
-        if stream_cb is not None:
-            answer = await deepseek_client.chat_stream(
-                system=REPORT_SUMMARY_SYSTEM,
-                user=report_prompt,
-                temperature=0.2,
-                on_token=stream_cb,
-            )
-        else:
-            answer = await deepseek_client.chat(system=REPORT_SUMMARY_SYSTEM, user=report_prompt, temperature=0.2)
-        if not answer.strip():
+        answer = await _llm_with_budget(
+            state, "compose", system=REPORT_SUMMARY_SYSTEM, user=report_prompt, stream_cb=stream_cb
+        )
+        if answer is None:
+            # 预算耗尽：只返回数据，不生成总结。
+            answer = f"已返回 {len(rows)} 条数据，请查看下方表格（时间预算不足，未生成文字总结）。"
+            if stream_cb is not None:
+                await stream_cb(answer)
+        elif not answer.strip():
             answer = f"已返回 {len(rows)} 条数据，请查看下方表格。"
     else:
         answer = "未查到匹配数据。建议调整时间范围、门店范围或指标口径后重试。"
         if stream_cb is not None:
             await stream_cb(answer)
 
-    # 3) 回传 answer + report。
+    # 3) 回传 answer（report 已由取数节点写入状态）。
     _add_timing(state, "compose", start)
+    return {"answer": answer, "debug": debug}
+
+
+async def answer_followup(state: dict, config: RunnableConfig) -> dict:
+    # 1) 在上一轮缓存结果上做筛选/再聚合/排序/TopN，全部为进程内向量运算。
+    start = _timer()
+    last = state.get("last_result") or {}
+    ops = state.get("followup") or []
+    source_rows = last.get("rows") or []
+    columns, rows = apply_ops(ops, last.get("columns") or [], source_rows)
+    data = [[row.get(c) for c in columns] for row in rows]
+    table = {"columns": columns, "types": _column_types(columns, data), "data": data}
+
+    # 2) 确定性模板回答，不再调用 LLM。
+    answer = f"基于上一轮查询结果（{len(source_rows)} 行，未重新查询数据库）：{describe_ops(ops)}，共 {len(rows)} 行。"
+    if len(rows) == 1:
+        answer += " " + "，".join(f"{k}={v}" for k, v in rows[0].items())
+    stream_cb = _stream_cb(config)
+    if stream_cb is not None:
+        await stream_cb(answer)
+
+    debug = state.setdefault("debug", {})
+    debug["followup"] = {
+        "ops": ops,
+        "source_rows": len(source_rows),
+        "result_rows": len(rows),
+        "source_sql": last.get("sql"),
+    }
+    _add_timing(state, "followup", start)
     return {
+        "sql": last.get("sql"),
+        "rows": rows,
+        "sql_error": None,
+        "report": _build_report({"table": table, "rows": rows}, state),
         "answer": answer,
-        "report": {"columns": columns, "rows": rows},
         "debug": debug,
+        # 追问结果作为新的上下文，连续追问可以逐步收窄。
+        "last_result": {
+            "query": f"{last.get('query', '')}，{state.get('user_query', '')}",
+            "sql": last.get("sql"),
+            "columns": columns,
+            "rows": rows,
+        },
     }
 
 
-async def compose_diagnosis_answer(state: dict) -> dict:
+async def gather_diagnosis_evidence(state: dict) -> dict:
     # 1) 准备数据证据与知识证据上下文。
     start = _timer()
     query = state.get("user_query", "")
     intent = state.get("intent", "diagnose")
-    sql_result = await sql_query_tool.ainvoke({"query": query, "intent": intent})
+    deadline_at = state.get("deadline_at")
+    sql_result = await sql_query_tool.ainvoke(
+        {"query": query, "intent": intent, "deadline_at": deadline_at, "draft_sql": state.get("draft_sql")}
+    )
     # 诊断口径查不到数据时，自动降级到报表口径再查一次，避免“样本为空”。
     if (not sql_result.get("error")) and not (sql_result.get("rows") or []):
-        fallback_sql_result = await sql_query_tool.ainvoke({"query": query, "intent": "report"})
+        fallback_sql_result = await sql_query_tool.ainvoke(
+            {"query": query, "intent": "report", "deadline_at": deadline_at}
+        )
         if fallback_sql_result.get("rows"):
             sql_result = fallback_sql_result
-    kb_result = await kb_query_tool.ainvoke({"query": query, "top_k": 5})
+    # 为后续诊断生成预留一次 LLM 调用的时间，不够就跳过知识检索。
+    if can_afford(deadline_at, settings.deadline_min_llm_ms + settings.deadline_min_kb_ms):
+        kb_result = await kb_query_tool.ainvoke(
+            {"query": query, "top_k": settings.kb_top_k, "intent": "diagnose", "deadline_at": deadline_at}
+        )
+    else:
+        note_degraded(state, "evidence", "skip_kb")
+        kb_result = {"knowledge": [], "debug": {"budget_skipped": True}}
     rows = sql_result.get("rows") or []
     knowledge = kb_result.get("knowledge") or []
-    stream_cb = state.get("stream_cb")
-    user_prompt = build_diagnosis_user_prompt(query, rows, knowledge)
     debug = state.setdefault("debug", {})
     debug["tools"] = {
         **(debug.get("tools") or {}),
@@ -182,16 +405,34 @@ async def compose_diagnosis_answer(state: dict) -> dict:
         "kb_query_tool": kb_result.get("debug", {}),
     }
 
-    # 2) 根据是否需要流式，选择普通/流式 LLM 调用。
-    if stream_cb is not None:
-        answer = await deepseek_client.chat_stream(
-            system=DIAGNOSE_SYSTEM,
-            user=user_prompt,
-            temperature=0.2,
-            on_token=stream_cb,
-        )
-    else:
-        answer = await deepseek_client.chat(system=DIAGNOSE_SYSTEM, user=user_prompt, temperature=0.2)
+    sql_error = sql_result.get("error")
+    _add_timing(state, "evidence", start)
+    return {
+        "sql": sql_result.get("sql"),
+        "rows": rows,
+        "sql_error": {"message": sql_error} if sql_error else None,
+        "report": _build_report(sql_result, state),
+        "knowledge": knowledge,
+        "debug": debug,
+    }
+
+
+async def compose_diagnosis_answer(state: dict, config: RunnableConfig) -> dict:
+    # 1) 读取上游证据，组装诊断提示词。
+    start = _timer()
+    query = state.get("user_query", "")
+    rows = state.get("rows") or []
+    knowledge = state.get("knowledge") or []
+    stream_cb = _stream_cb(config)
+    user_prompt = build_diagnosis_user_prompt(query, rows, knowledge)
+    debug = state.setdefault("debug", {})
+
+    # 2) 根据是否需要流式，选择普通/流式 LLM 调用；预算不足时直接用兜底模板。
+    answer = await _llm_with_budget(state, "compose", system=DIAGNOSE_SYSTEM, user=user_prompt, stream_cb=stream_cb)
+    if answer is None:
+        answer = build_diagnosis_fallback()
+        if stream_cb is not None:
+            await stream_cb(answer)
 
     # 3) 若未满足“来源标注”约束，降级为兜底诊断模板。
     if "(data)" not in answer or "(kb)" not in answer:
@@ -201,42 +442,66 @@ async def compose_diagnosis_answer(state: dict) -> dict:
     return {"answer": answer, "debug": debug}
 
 
-async def gen_campaign_plan(state: dict) -> dict:
-    # 1) 解析预算/周期并准备知识上下文。
+async def retrieve_plan_knowledge(state: dict) -> dict:
+    # 1) 检索活动玩法与风控知识，作为方案生成上下文。
     start = _timer()
     query = state.get("user_query", "")
-    kb_result = await kb_query_tool.ainvoke({"query": query, "top_k": 5})
-    knowledge = kb_result.get("knowledge") or []
-    budget, duration = _extract_budget_duration(query)
-    kb_text = "\n".join([f"- {k['title']}: {k['content']}" for k in knowledge])
+    kb_result = await kb_query_tool.ainvoke(
+        {"query": query, "top_k": settings.kb_top_k, "intent": "plan", "deadline_at": state.get("deadline_at")}
+    )
     debug = state.setdefault("debug", {})
     debug["tools"] = {
         **(debug.get("tools") or {}),
         "kb_query_tool": kb_result.get("debug", {}),
     }
+    _add_timing(state, "kb", start)
+    return {"knowledge": kb_result.get("knowledge") or [], "debug": debug}
+
+
+async def gen_campaign_plan(state: dict) -> dict:
+    # 1) 解析预算/周期并准备知识上下文。
+    start = _timer()
+    query = state.get("user_query", "")
+    knowledge = state.get("knowledge") or []
+    budget, duration = _extract_budget_duration(query)
+    kb_text = "\n".join([f"- {k['title']}: {k['content']}" for k in knowledge])
+    debug = state.setdefault("debug", {})
 
     # 2) 生成 schema 约束与用户提示，调用 LLM 产出结构化 plan。
     schema_tip = build_plan_schema_tip(settings, budget=budget, duration=duration)
     user_prompt = build_plan_user_prompt(query, budget, duration, kb_text, schema_tip)
-    raw = await deepseek_client.chat(system=PLAN_SYSTEM, user=user_prompt, temperature=0.2)
-    plan = _extract_json_block(raw)
+    raw = await _llm_with_budget(state, "plan", system=PLAN_SYSTEM, user=user_prompt)
+    # 预算不足时使用配置中的默认方案，保证仍可执行。
+    plan = _extract_json_block(raw) if raw is not None else build_default_plan(settings, budget, duration)
 
     # 3) 兜底补齐关键字段，确保后续可执行。
     plan.setdefault("budget", budget)
     plan.setdefault("duration_days", duration)
 
-    # 4) 基于“用户需求 + 知识 + 结构化 plan”由 LLM 动态生成方案说明。
+    _add_timing(state, "plan", start)
+    return {"plan": plan, "debug": debug}
+
+
+async def explain_campaign_plan(state: dict, config: RunnableConfig) -> dict:
+    # 1) 基于“用户需求 + 知识 + 结构化 plan”由 LLM 动态生成方案说明。
+    start = _timer()
+    query = state.get("user_query", "")
+    knowledge = state.get("knowledge") or []
+    plan = state.get("plan") or {}
+    budget, duration = _extract_budget_duration(query)
+    debug = state.setdefault("debug", {})
+
     explain_user = build_plan_explain_user_prompt(query, knowledge, plan)
-    answer = await deepseek_client.chat(system=PLAN_EXPLAIN_SYSTEM, user=explain_user, temperature=0.2)
-    if not answer.strip():
-        # 5) 若生成异常，退回通用兜底文案（不写死具体促销参数）。
+    answer = await _llm_with_budget(state, "compose", system=PLAN_EXPLAIN_SYSTEM, user=explain_user)
+    if not (answer or "").strip():
+        # 2) 若生成异常，退回通用兜底文案（不写死具体促销参数）。
         answer = build_plan_markdown(plan, settings, budget=budget, duration=duration)
-    stream_cb = state.get("stream_cb")
+    stream_cb = _stream_cb(config)
     if stream_cb is not None:
         await stream_cb(answer)
 
     _add_timing(state, "compose", start)
-    return {"plan": plan, "answer": answer, "debug": debug}
+    return {"answer": answer, "debug": debug}
 
 
 async def execute_campaign(state: dict) -> dict:
@@ -244,8 +509,26 @@ async def execute_campaign(state: dict) -> dict:
     start = _timer()
     plan = state.get("plan") or {}
     debug = state.setdefault("debug", {})
-    debug.setdefault("plan_fixed", False)
+    debug["plan_fixed"] = _complete_plan(plan)
+
+    # 2) 生成幂等键，防止重复执行。
+    idem_key = make_idempotency_key(plan)
+
+    # 3) 同进程内同一幂等键串行；跨进程由唯一索引兜底。
+    async with _idempotency_lock(idem_key):
+        async with AsyncSessionLocal() as session:
+            log_id, execution, outcome = await _reserve_execution(session, idem_key, plan)
+    debug["idempotency"] = outcome
+
+    # 4) 提交后再唤醒投递者，保证它一定能读到这条记录。
+    if log_id is not None:
+        outbox_dispatcher.notify(log_id)
+    _add_timing(state, "execute", start)
+    return {"execution": execution, "debug": debug}
+
 
+def _complete_plan(plan: dict) -> bool:
+    # offer 不完整时按默认配置补齐执行所需字段；返回是否做过修复。
     required_offer_keys = {"type", "threshold", "value", "max_redemptions"}
     if "offer" not in plan or not required_offer_keys.issubset(set(plan.get("offer", {}).keys())):
         plan.setdefault("offer", {})
@@ -266,76 +549,166 @@ async def execute_campaign(state: dict) -> dict:
             {"primary": settings.plan_default_kpi_primary, "targets": settings.plan_kpi_targets},
         )
         plan.setdefault("risk_controls", settings.plan_risk_controls)
-        debug["plan_fixed"] = True
+        return True
+    return False
 
-    # 2) 生成幂等键，防止重复执行。
-    idem_key = make_idempotency_key(plan)
 
-    async with AsyncSessionLocal() as session:
-        # 3) 已成功执行过则直接返回历史结果。
-        existing = await get_action_log_by_key(session, idem_key)
-        if existing and existing.status == "success":
-            execution = json.loads(existing.response_json)
-            _add_timing(state, "execute", start)
-            return {"execution": execution, "debug": debug}
+def _pending_execution(idem_key: str, campaign_name: str) -> dict:
+    return {
+        "idempotency_key": idem_key,
+        "campaign_name": campaign_name,
+        "coupon_id": None,
+        "publish_status": "pending",
+        "error": None,
+    }
 
-        try:
-            # 4) 先落库 campaign，再调用 CRM 创建并发布券。
-            campaign_name = f"campaign-{int(time.time())}"
-            await create_campaign(
-                session,
-                name=campaign_name,
-                goal=plan.get("goal", settings.plan_default_goal),
-                budget=float(plan.get("budget", settings.plan_default_budget)),
-                duration_days=int(plan.get("duration_days", settings.plan_default_duration_days)),
-                plan=plan,
-            )
 
-            create_payload = {
-                "name": campaign_name,
-                "offer": plan["offer"],
-                "duration_days": int(plan.get("duration_days", settings.plan_default_duration_days)),
-            }
-            created = await crm_client.create_coupon(create_payload)
-            coupon_id = int(created["coupon_id"])
-            published = await crm_client.publish_coupon(coupon_id)
-
-            # 5) 记录成功日志并提交事务。
-            execution = {
-                "idempotency_key": idem_key,
-                "coupon_id": coupon_id,
-                "publish_status": published.get("status", "unknown"),
-                "error": None,
-            }
-            await create_action_log(
+@asynccontextmanager
+async def _idempotency_lock(key: str):
+    # 弱引用字典：没有请求持有或等待时锁自动回收，不随幂等键无限增长。
+    lock = _execute_locks.get(key)
+    if lock is None:
+        lock = _execute_locks[key] = asyncio.Lock()
+    async with lock:
+        yield
+
+
+async def _reserve_execution(session, idem_key: str, plan: dict) -> tuple[int | None, dict, str]:
+    # 返回 (需要投递的 outbox 记录 ID, 当前执行结果, 处理方式)；记录 ID 为 None 表示复用已有执行。
+    existing = await get_action_log_by_key(session, idem_key)
+    if existing is None:
+        campaign_name = f"campaign-{int(time.time())}"
+        execution = _pending_execution(idem_key, campaign_name)
+        try:
+            # 先插入 pending 记录预占幂等键，再写 campaign；并发重复请求在唯一索引上冲突，不会各建一份。
+            log = await create_action_log(
                 session,
                 idempotency_key=idem_key,
                 action_type="publish_coupon",
                 request_json=json.dumps(plan, ensure_ascii=False),
                 response_json=json.dumps(execution, ensure_ascii=False),
-                status="success",
+                status="pending",
                 error_message=None,
             )
-            await session.commit()
-            _add_timing(state, "execute", start)
-            return {"execution": execution, "debug": debug}
-        except Exception as exc:
-            # 6) 记录失败日志，返回失败结构，保证调用方可感知错误。
-            execution = {
-                "idempotency_key": idem_key,
-                "coupon_id": None,
-                "publish_status": "failed",
-                "error": str(exc),
-            }
-            await create_action_log(
+            await create_campaign(
                 session,
-                idempotency_key=idem_key,
-                action_type="publish_coupon",
-                request_json=json.dumps(plan, ensure_ascii=False),
-                response_json=json.dumps(execution, ensure_ascii=False),
-                status="failed",
-                error_message=str(exc),
+                name=campaign_name,
+                goal=plan.get("goal", settings.plan_default_goal),
+                budget=float(plan.get("budget", settings.plan_default_budget)),
+                duration_days=int(plan.get("duration_days", settings.plan_default_duration_days)),
+                plan=plan,
             )
             await session.commit()
-            _add_timing(state, "execute", start)
-            return {"execution": execution, "debug": debug}
+            return log.id, execution, "reserved"
+        except IntegrityError:
+            await session.rollback()
+            existing = await get_action_log_by_key(session, idem_key)
+            if existing is None:
+                raise
+
+    requeued = await _requeue_execution(session, existing)
+    if requeued is not None:
+        await session.commit()
+        return existing.id, requeued, "requeued"
+    # 成功、待投递或投递中：直接返回首个执行的当前状态，客户端按幂等键轮询或等待最终结果。
+    return None, json.loads(existing.response_json), "existing"
+
+
+async def _requeue_execution(session, existing) -> dict | None:
+    # 上次投递失败、或认领后超时未完成（投递者已退出）：置回 pending 重投，已建的券不会重复创建。
+    execution = {**json.loads(existing.response_json), "publish_status": "pending", "error": None}
+    response_json = json.dumps(execution, ensure_ascii=False)
+    requeued = await requeue_action_log(
+        session, existing.id, stale_after_sec=settings.outbox_stale_after_sec, response_json=response_json
+    )
+    return execution if requeued else None
+
+
+async def execute_campaign_batch(plans: list[dict]) -> dict[str, Any]:
+    """多门店批量上架：一次 IN 查询做幂等检查，缺失的键批量预占，投递交给 outbox 按批调用 CRM。"""
+    start = _timer()
+    keys: list[str] = []
+    unique: dict[str, dict] = {}
+    plans_fixed = 0
+    for plan in plans:
+        plans_fixed += _complete_plan(plan)
+        key = make_idempotency_key(plan)
+        keys.append(key)
+        unique.setdefault(key, plan)
+
+    outcomes: dict[str, str] = {}
+    deliver_ids: list[int] = []
+    async with AsyncSessionLocal() as session:
+        existing = {log.idempotency_key: log for log in await get_action_logs_by_keys(session, list(unique))}
+        missing = [key for key in unique if key not in existing]
+        if missing:
+            stamp = int(time.time())
+            names = {key: f"campaign-{stamp}-{i + 1}" for i, key in enumerate(missing)}
+            try:
+                # action_logs 先于 campaigns 写入，与单条预占顺序一致；两张表各一条多值 INSERT，同一事务提交。
+                await bulk_create_action_logs(
+                    session,
+                    [
+                        {
+                            "idempotency_key": key,
+                            "action_type": "publish_coupon",
+                            "request_json": json.dumps(unique[key], ensure_ascii=False),
+                            "response_json": json.dumps(_pending_execution(key, names[key]), ensure_ascii=False),
+                            "status": "pending",
+                            "error_message": None,
+                        }
+                        for key in missing
+                    ],
+                )
+                await bulk_create_campaigns(
+                    session,
+                    [
+                        {
+                            "name": names[key],
+                            "goal": unique[key].get("goal", settings.plan_default_goal),
+                            "budget": float(unique[key].get("budget", settings.plan_default_budget)),
+                            "duration_days": int(unique[key].get("duration_days", settings.plan_default_duration_days)),
+                            "plan": unique[key],
+                        }
+                        for key in missing
+                    ],
+                )
+                await session.commit()
+                outcomes.update({key: "reserved" for key in missing})
+            except IntegrityError:
+                # 部分键被并发请求抢先预占：回滚后逐条走单条预占，冲突的键复用已有执行。
+                await session.rollback()
+                for key in missing:
+                    async with _idempotency_lock(key):
+                        log_id, _, outcome = await _reserve_execution(session, key, unique[key])
+                    outcomes[key] = outcome
+                    if log_id is not None:
+                        deliver_ids.append(log_id)
+                # rollback（包括单条预占里冲突时的 rollback）会让会话中所有对象过期，
+                # 直接读 existing 里的旧对象会触发异步懒加载（MissingGreenlet）；这里重新查一次。
+                existing = {
+                    log.idempotency_key: log
+                    for log in await get_action_logs_by_keys(session, list(existing))
+                }
+
+        for key, log in existing.items():
+            outcomes[key] = "existing" if await _requeue_execution(session, log) is None else "requeued"
+        await session.commit()
+
+        # 回读最终状态；先让会话里缓存的旧对象失效。
+        session.expire_all()
+        logs = {log.idempotency_key: log for log in await get_action_logs_by_keys(session, list(unique))}
+
+    for key, outcome in outcomes.items():
+        if outcome in {"reserved", "requeued"} and logs[key].id not in deliver_ids:
+            deliver_ids.append(logs[key].id)
+    for log_id in deliver_ids:
+        outbox_dispatcher.notify(log_id)
+
+    return {
+        "keys": keys,
+        "executions": {key: json.loads(log.response_json) for key, log in logs.items()},
+        "outcomes": outcomes,
+        "plans_fixed": plans_fixed,
+        "reserve_ms": int((time.perf_counter() - start) * 1000),
+    }
@@ -1,17 +1,23 @@
-﻿from collections.abc import Awaitable, Callable
-from typing import Literal, TypedDict
+﻿from typing import Literal, TypedDict
 
 
 class GraphState(TypedDict, total=False):
     user_query: str
-    intent: Literal["report", "diagnose", "plan", "execute"]
+    intent: Literal["report", "diagnose", "plan", "execute", "followup"]
     sql: str | None
+    # 合并路由产出的 SQL 草稿：只作为取数节点的输入，守卫通过后才以 sql 对外可见。
+    draft_sql: str | None
     rows: list[dict] | None
     sql_error: dict | None
     knowledge: list[dict] | None
     answer: str | None
     report: dict | None
+    report_format: Literal["rows", "columnar"]
     plan: dict | None
     execution: dict | None
-    stream_cb: Callable[[str], Awaitable[None]] | None
+    # 会话记忆：上一轮报表 {query, sql, columns, rows}，跨轮保留；followup 为本轮解析出的追问操作。
+    last_result: dict | None
+    followup: list[dict] | None
+    deadline_at: float | None
+    deadline_ms: float | None
     debug: dict
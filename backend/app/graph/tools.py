@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
 import re
 import time
+from datetime import date, datetime
+from decimal import Decimal
 from typing import Any
 
 import sqlglot
@@ -11,21 +14,29 @@ from langchain_core.tools import tool
 from sqlalchemy import text
 from sqlglot import exp
 
+from app.core.batch_cache import cached
 from app.core.config import get_settings
+from app.core.tracing import tracer
+from app.graph.deadline import can_afford, timeout_for
 from app.db.engine import AsyncSessionLocal
-from app.llm.deepseek_client import deepseek_client
+from app.llm.deepseek_client import LLMTimeoutError, deepseek_client
 from app.llm.prompts import (
+    build_fused_intent_sql_system,
+    build_fused_intent_sql_user_prompt,
     build_sql_repair_system,
     build_sql_repair_user_prompt,
     build_sql_system,
     build_sql_user_prompt,
 )
 from app.rag.chroma_store import chroma_store
+from app.rag.hybrid import hybrid_retriever, tags_for_intent
 
 settings = get_settings()
 _SCHEMA_CACHE_TEXT = ""
 _SCHEMA_CACHE_AT = 0.0
 _SCHEMA_CACHE_TTL_SEC = 60.0
+INTENTS = {"report", "diagnose", "plan", "execute"}
+SQL_INTENTS = {"report", "diagnose"}
 
 
 def _extract_select_sql(raw: str) -> str:
@@ -87,6 +98,9 @@ def _build_sql_by_rule(query: str, intent: str) -> str | None:
         m1 = int(m_compare_last_year.group(1))
         m2 = int(m_compare_last_year.group(2))
         if 1 <= m1 <= 12 and 1 <= m2 <= 12:
+            # 显式限定去年两个月的 paid_at 区间：走 paid_at 索引，分区表上只命中对应月份分区。
+            year_start = "MAKEDATE(YEAR(CURDATE()) - 1, 1)"
+            lo, hi = min(m1, m2), max(m1, m2)
             return (
                 "SELECT "
                 f"SUM(CASE WHEN YEAR({paid_at}) = YEAR(CURDATE()) - 1 AND MONTH({paid_at}) = {m1} THEN {amount} ELSE 0 END) AS month_{m1}_gmv, "
@@ -103,7 +117,9 @@ def _build_sql_by_rule(query: str, intent: str) -> str | None:
                 f"SUM(CASE WHEN YEAR({paid_at}) = YEAR(CURDATE()) - 1 AND MONTH({paid_at}) = {m2} THEN {amount} ELSE 0 END), 0"
                 ") END AS change_rate "
                 f"FROM {table} "
-                f"WHERE {success_pred}"
+                f"WHERE {success_pred} "
+                f"AND {paid_at} >= {year_start} + INTERVAL {lo - 1} MONTH "
+                f"AND {paid_at} < {year_start} + INTERVAL {hi} MONTH"
             )
 
     return None
@@ -249,44 +265,161 @@ def _enforce_semantic_guard(query: str, sql: str) -> None:
             raise ValueError("SQL 与问题语义不一致：按天趋势必须按日期分组")
 
 
-@tool("sql_query_tool")
-async def sql_query_tool(query: str, intent: str = "report") -> dict[str, Any]:
-    """根据自然语言查询生成并执行 MySQL SELECT，失败时自动修复 SQL 后重试。"""
+_TYPE_NAMES: dict[type, str] = {
+    bool: "bool",
+    int: "int",
+    float: "float",
+    Decimal: "decimal",
+    str: "string",
+    datetime: "datetime",
+    date: "date",
+}
+
+
+def _column_types(columns: list[str], data: list[list[Any]]) -> list[str]:
+    # 取每列首个非空值的 Python 类型，前端据此决定数值/日期格式化。
+    types: list[str] = []
+    for i in range(len(columns)):
+        value = next((row[i] for row in data if row[i] is not None), None)
+        types.append("null" if value is None else _TYPE_NAMES.get(type(value), "string"))
+    return types
+
+
+def table_to_rows(table: dict[str, Any]) -> list[dict[str, Any]]:
+    columns = table["columns"]
+    return [dict(zip(columns, row)) for row in table["data"]]
+
+
+async def _execute_sql(sql: str, timeout: float | None = None) -> dict[str, Any]:
+    # 直接从游标取列名与行元组，列式结构不重复携带列名。
+    async with AsyncSessionLocal() as session:
+        result = await asyncio.wait_for(
+            session.execute(text(sql)),
+            timeout=settings.sql_timeout_seconds if timeout is None else timeout,
+        )
+        columns = list(result.keys())
+        data = [list(row) for row in result.all()]
+    return {"columns": columns, "types": _column_types(columns, data), "data": data}
+
+
+def _sql_failed(
+    sql: str | None,
+    error_text: str,
+    attempts: list[dict[str, Any]],
+    attempt: int,
+    started: float,
+    **extra: Any,
+) -> dict[str, Any]:
+    return {
+        "ok": False,
+        "sql": sql,
+        "table": {"columns": [], "types": [], "data": []},
+        "rows": [],
+        "error": error_text,
+        "debug": {
+            "attempts": attempts,
+            "final_attempt": attempt,
+            "recovered": False,
+            "timing_ms": int((time.perf_counter() - started) * 1000),
+            **extra,
+        },
+    }
+
+
+def parse_fused_output(raw: str) -> tuple[str | None, str | None]:
+    # 返回 (意图, SQL 草稿)；JSON 不合法或意图不在四类内时意图为 None，由调用方回退两次调用。
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return None, None
+    if not isinstance(data, dict):
+        return None, None
+    intent = str(data.get("intent") or "").strip().lower()
+    if intent not in INTENTS:
+        return None, None
+    sql = str(data.get("sql") or "").strip()
+    return intent, (_extract_select_sql(sql) if sql and intent in SQL_INTENTS else None)
+
+
+async def fused_intent_sql(query: str, timeout: float | None = None) -> tuple[str | None, str | None]:
+    """一次 JSON 模式调用同时得到意图与 SQL 草稿；草稿仍需在 sql_query_tool 中通过守卫才会被采用。"""
+    schema_hint = await cached("schema", "hint", _load_schema_hint_dynamic)
+    raw = await deepseek_client.chat(
+        system=build_fused_intent_sql_system(schema_hint),
+        user=build_fused_intent_sql_user_prompt(query),
+        temperature=0,
+        timeout=timeout,
+        json_mode=True,
+    )
+    return parse_fused_output(raw)
+
+
+def _draft_passes_guards(query: str, draft_sql: str) -> bool:
+    try:
+        guarded_sql, _ = _enforce_sql_guard(draft_sql)
+        _enforce_semantic_guard(query, guarded_sql)
+    except Exception:
+        return False
+    return True
+
+
+async def _run_sql_query(
+    query: str,
+    intent: str,
+    deadline_at: float | None = None,
+    draft_sql: str | None = None,
+) -> dict[str, Any]:
     started = time.perf_counter()
     max_retries = 2
     attempts: list[dict[str, Any]] = []
-    schema_hint = await _load_schema_hint_dynamic()
+    schema_hint = await cached("schema", "hint", _load_schema_hint_dynamic)
 
     rule_sql = _build_sql_by_rule(query, intent)
     if rule_sql:
-        sql = rule_sql
+        sql, sql_source = rule_sql, "rule"
+    elif draft_sql and _draft_passes_guards(query, draft_sql):
+        # 合并调用已给出 SQL 且通过守卫：省掉一次生成调用；未通过则照常生成，不拿草稿去修复。
+        sql, sql_source = draft_sql, "fused"
     else:
-        raw_sql = await deepseek_client.chat(
-            system=build_sql_system(schema_hint),
-            user=build_sql_user_prompt(query, intent=intent),
-            temperature=0,
-        )
+        sql_source = "llm"
+        if not can_afford(deadline_at, settings.deadline_min_llm_ms):
+            return _sql_failed(None, "时间预算不足，未生成 SQL", attempts, 0, started, budget_skipped="generate")
+        try:
+            raw_sql = await deepseek_client.chat(
+                system=build_sql_system(schema_hint),
+                user=build_sql_user_prompt(query, intent=intent),
+                temperature=0,
+                timeout=timeout_for(deadline_at),
+            )
+        except LLMTimeoutError:
+            return _sql_failed(None, "SQL 生成超出时间预算", attempts, 0, started, budget_skipped="generate")
         sql = _extract_select_sql(raw_sql)
+        if draft_sql:
+            attempts.append({"attempt": -1, "sql": draft_sql, "error": "合并调用的 SQL 未通过守卫，已重新生成"})
 
     for attempt in range(max_retries + 1):
+        attempt_span = tracer.start_span("sql.attempt", attempt=attempt, sql_source=sql_source)
         try:
-            guarded_sql, guard = _enforce_sql_guard(sql)
-            _enforce_semantic_guard(query, guarded_sql)
+            with tracer.span("sql.guard", parent=attempt_span):
+                guarded_sql, guard = _enforce_sql_guard(sql)
+                _enforce_semantic_guard(query, guarded_sql)
             logging.info(f"Guard result: {guard}, SQL after guard: {guarded_sql}")
 
-            async with AsyncSessionLocal() as session:
-                result = await asyncio.wait_for(
-                    session.execute(text(guarded_sql)),
-                    timeout=settings.sql_timeout_seconds,
-                )
-                rows = [dict(r) for r in result.mappings().all()]
+            # 批次内不同问题生成了同一条 SQL 时只查一次库；查询超时取剩余预算与配置上限的较小值。
+            sql_timeout = timeout_for(deadline_at, cap_sec=settings.sql_timeout_seconds)
+            with tracer.span("db.execute", parent=attempt_span, kind="client", db_statement=guarded_sql) as db_span:
+                table = await cached("rows", guarded_sql, lambda: _execute_sql(guarded_sql, sql_timeout))
+                db_span.set(rows=len(table["data"]))
+            attempt_span.end()
             return {
                 "ok": True,
                 "sql": guarded_sql,
-                "rows": rows,
+                "table": table,
+                "rows": table_to_rows(table),
                 "error": None,
                 "debug": {
                     "guard": guard,
+                    "sql_source": sql_source,
                     "attempts": attempts,
                     "final_attempt": attempt,
                     "recovered": attempt > 0,
@@ -294,36 +427,71 @@ async def sql_query_tool(query: str, intent: str = "report") -> dict[str, Any]:
                 },
             }
         except Exception as exc:
-            error_text = str(exc)
+            error_text = str(exc) or type(exc).__name__
             attempts.append({"attempt": attempt, "sql": sql, "error": error_text})
+            attempt_span.record_error(exc)
+            attempt_span.end()
             if attempt >= max_retries:
-                return {
-                    "ok": False,
-                    "sql": sql,
-                    "rows": [],
-                    "error": error_text,
-                    "debug": {
-                        "attempts": attempts,
-                        "final_attempt": attempt,
-                        "recovered": False,
-                        "timing_ms": int((time.perf_counter() - started) * 1000),
-                    },
-                }
-
-            repaired_raw = await deepseek_client.chat(
-                system=build_sql_repair_system(schema_hint),
-                user=build_sql_repair_user_prompt(query, intent, sql, error_text),
-                temperature=0,
-            )
+                return _sql_failed(sql, error_text, attempts, attempt, started, sql_source=sql_source)
+            # 修复需要再调一次 LLM，剩余预算不够就不再尝试，直接返回本次错误。
+            if not can_afford(deadline_at, settings.deadline_min_llm_ms):
+                return _sql_failed(
+                    sql, error_text, attempts, attempt, started, budget_skipped="repair", sql_source=sql_source
+                )
+
+            try:
+                repaired_raw = await deepseek_client.chat(
+                    system=build_sql_repair_system(schema_hint),
+                    user=build_sql_repair_user_prompt(query, intent, sql, error_text),
+                    temperature=0,
+                    timeout=timeout_for(deadline_at),
+                )
+            except LLMTimeoutError:
+                return _sql_failed(
+                    sql, error_text, attempts, attempt, started, budget_skipped="repair", sql_source=sql_source
+                )
             sql = _extract_select_sql(repaired_raw)
 
 
+@tool("sql_query_tool")
+async def sql_query_tool(
+    query: str,
+    intent: str = "report",
+    deadline_at: float | None = None,
+    draft_sql: str | None = None,
+) -> dict[str, Any]:
+    """根据自然语言查询生成并执行 MySQL SELECT，失败时自动修复 SQL 后重试；draft_sql 通过守卫时跳过生成。"""
+    with tracer.span("tool.sql_query_tool", intent=intent):
+        return await cached("sql", (intent, query), lambda: _run_sql_query(query, intent, deadline_at, draft_sql))
+
+
+async def _kb_query(query: str, top_k: int, tags: list[str] | None) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+    with tracer.span("tool.kb_query_tool", hybrid=settings.rag_hybrid_enabled, top_k=top_k, tags=",".join(tags or [])):
+        if settings.rag_hybrid_enabled:
+            return await hybrid_retriever.query(query, top_k=top_k, tags=tags)
+        knowledge = await chroma_store.query(query, top_k=top_k, tags=tags)
+        return knowledge, {"mode": "vector", "tags": tags}
+
+
 @tool("kb_query_tool")
-async def kb_query_tool(query: str, top_k: int = 5) -> dict[str, Any]:
-    """向量检索知识库，返回知识片段列表。"""
+async def kb_query_tool(
+    query: str,
+    top_k: int = 5,
+    intent: str | None = None,
+    deadline_at: float | None = None,
+) -> dict[str, Any]:
+    """检索知识库（BM25 + 向量混合，按意图过滤 tags），返回知识片段列表。"""
     started = time.perf_counter()
+    tags = tags_for_intent(intent)
+    if not can_afford(deadline_at, settings.deadline_min_kb_ms):
+        return {
+            "ok": False,
+            "knowledge": [],
+            "error": "时间预算不足，跳过知识检索",
+            "debug": {"top_k": top_k, "count": 0, "budget_skipped": True, "timing_ms": 0},
+        }
     try:
-        knowledge = await chroma_store.query(query, top_k=top_k)
+        knowledge, retrieval = await asyncio.wait_for(_kb_query(query, top_k, tags), timeout=timeout_for(deadline_at))
         return {
             "ok": True,
             "knowledge": knowledge,
@@ -331,6 +499,7 @@ async def kb_query_tool(query: str, top_k: int = 5) -> dict[str, Any]:
             "debug": {
                 "top_k": top_k,
                 "count": len(knowledge),
+                "retrieval": retrieval,
                 "timing_ms": int((time.perf_counter() - started) * 1000),
             },
         }
@@ -338,7 +507,7 @@ async def kb_query_tool(query: str, top_k: int = 5) -> dict[str, Any]:
         return {
             "ok": False,
             "knowledge": [],
-            "error": str(exc),
+            "error": str(exc) or type(exc).__name__,
             "debug": {
                 "top_k": top_k,
                 "count": 0,
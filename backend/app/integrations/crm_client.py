@@ -1,31 +1,162 @@
 ﻿from __future__ import annotations
 
+import asyncio
+import logging
+import random
+import time
+from collections import deque
 from typing import Any
 
 import httpx
 
 from app.core.config import get_settings
+from app.core.tracing import tracer
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_RETRY_STATUS = {429, 502, 503, 504}
+# 请求确定未发出（连不上或拿不到连接）时，非幂等接口也可以安全重试。
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+_LATENCY_WINDOW = 512
+
+
+class _EndpointMetrics:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self._recent: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    def observe(self, seconds: float, ok: bool) -> None:
+        self.calls += 1
+        self.errors += 0 if ok else 1
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        self._recent.append(seconds)
+
+    def stats(self) -> dict[str, Any]:
+        recent = sorted(self._recent)
+
+        def pct(p: float) -> float | None:
+            if not recent:
+                return None
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))] * 1000, 2)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_ms": round(self.latency_sum / self.calls * 1000, 2) if self.calls else None,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.latency_max * 1000, 2),
+        }
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
 
 
 class CRMClient:
+    """进程内共享一个带连接池的 httpx 客户端：keep-alive 复用连接，按接口幂等性重试，并记录各接口耗时。"""
+
     def __init__(self) -> None:
         self.base_url = settings.crm_base_url
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._metrics: dict[str, _EndpointMetrics] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # 客户端与事件循环绑定；脚本多次 asyncio.run 时按新循环重建。
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            http2 = settings.crm_http2
+            if http2 and not _http2_available():
+                logger.warning("CRM_HTTP2=true 但未安装 h2（pip install 'httpx[http2]'），回退 HTTP/1.1")
+                http2 = False
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(settings.crm_timeout_sec),
+                limits=httpx.Limits(
+                    max_connections=settings.crm_max_connections,
+                    max_keepalive_connections=settings.crm_max_keepalive,
+                    keepalive_expiry=settings.crm_keepalive_expiry_sec,
+                ),
+                http2=http2,
+            )
+        return self._client
+
+    def _backoff(self, attempt: int) -> float:
+        # 指数退避 + full jitter，避免大量请求在同一时刻重试。
+        cap = min(settings.crm_retry_backoff_max_ms, settings.crm_retry_backoff_ms * (2**attempt))
+        return random.uniform(0, cap) / 1000
+
+    async def _request(self, endpoint: str, path: str, payload: dict[str, Any], idempotent: bool) -> dict[str, Any]:
+        metrics = self._metrics.setdefault(endpoint, _EndpointMetrics())
+        client = self._get_client()
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            # 每次 HTTP 尝试一个 span，并通过 traceparent 头把 trace 传给 CRM。
+            with tracer.span("crm.request", kind="client", endpoint=endpoint, attempt=attempt) as span:
+                try:
+                    resp = await client.post(path, json=payload, headers=tracer.inject())
+                    span.set(status_code=resp.status_code)
+                    retryable = idempotent and resp.status_code in _RETRY_STATUS
+                    if not retryable or attempt >= settings.crm_max_retries:
+                        metrics.observe(time.perf_counter() - started, resp.is_success)
+                        resp.raise_for_status()
+                        return resp.json()
+                except httpx.TransportError as exc:
+                    retryable = idempotent or isinstance(exc, _NOT_SENT_ERRORS)
+                    if not retryable or attempt >= settings.crm_max_retries:
+                        metrics.observe(time.perf_counter() - started, False)
+                        raise
+                    span.record_error(exc)
+            metrics.observe(time.perf_counter() - started, False)
+            metrics.retries += 1
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
 
     async def create_coupon(self, payload: dict[str, Any]) -> dict[str, Any]:
-        timeout = httpx.Timeout(10.0)
-        async with httpx.AsyncClient(base_url=self.base_url, timeout=timeout) as client:
-            resp = await client.post("/coupons", json=payload)
-            resp.raise_for_status()
-            return resp.json()
+        # 创建券不幂等：只在请求确定未送达时重试，避免重复建券。
+        return await self._request("create_coupon", "/coupons", payload, idempotent=False)
 
     async def publish_coupon(self, coupon_id: int) -> dict[str, Any]:
-        timeout = httpx.Timeout(10.0)
-        async with httpx.AsyncClient(base_url=self.base_url, timeout=timeout) as client:
-            resp = await client.post(f"/coupons/{coupon_id}/publish", json={})
-            resp.raise_for_status()
-            return resp.json()
+        return await self._request("publish_coupon", f"/coupons/{coupon_id}/publish", {}, idempotent=True)
+
+    async def create_coupons(self, items: list[dict[str, Any]]) -> list[int]:
+        # 批量建券同样不幂等，返回的券 ID 与 items 顺序一致。
+        data = await self._request("create_coupons", "/coupons:batch", {"items": items}, idempotent=False)
+        return [int(coupon_id) for coupon_id in data["coupon_ids"]]
+
+    async def publish_coupons(self, coupon_ids: list[int]) -> dict[int, str]:
+        data = await self._request(
+            "publish_coupons", "/coupons:publish-batch", {"coupon_ids": coupon_ids}, idempotent=True
+        )
+        return {int(item["coupon_id"]): item["status"] for item in data["results"]}
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict[str, Any]:
+        pool = None
+        if self._client is not None and not self._client.is_closed:
+            pool = {
+                "max_connections": settings.crm_max_connections,
+                "max_keepalive": settings.crm_max_keepalive,
+            }
+        return {"pool": pool, "endpoints": {name: m.stats() for name, m in self._metrics.items()}}
 
 
 crm_client = CRMClient()
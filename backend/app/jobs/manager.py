@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any
+
+from app.core.config import get_settings
+from app.core.serialize import dumps_str
+from app.db.crud import (
+    create_chat_job,
+    fail_owned_chat_jobs,
+    fail_stale_chat_jobs,
+    find_reusable_chat_job,
+    get_chat_job,
+    heartbeat_chat_jobs,
+    update_chat_job,
+)
+from app.db.engine import AsyncSessionLocal, engine
+from app.db.models import ChatJob
+from app.graph.events import chat_result, progress_events
+from app.graph.graph import astream
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"succeeded", "failed"}
+_POLL_INTERVAL_SEC = 1.0
+_INTERRUPTED = "服务重启，任务已中断，请重新提交"
+
+
+class JobQueueFullError(RuntimeError):
+    pass
+
+
+@dataclass
+class _LiveJob:
+    # 本进程内执行中任务的进度快照与 SSE 订阅者；落库之外的低延迟推送通道。
+    status: str = "queued"
+    events: list[dict[str, Any]] = field(default_factory=list)
+    subscribers: set[asyncio.Queue] = field(default_factory=set)
+
+    def publish(self, event: dict[str, Any]) -> None:
+        self.events.append(event)
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+
+def job_payload(job: ChatJob) -> dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "query": job.query,
+        "status": job.status,
+        "progress": json.loads(job.progress_json or "[]"),
+        "result": json.loads(job.result_json) if job.result_json else None,
+        "error": job.error_message,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+class JobManager:
+    """异步问答任务：入库后立即返回 job_id，由固定数量的后台 worker 执行图并持久化进度与结果。"""
+
+    def __init__(
+        self, workers: int, max_queue: int, reuse_ttl_sec: int, heartbeat_sec: int, stale_sec: int
+    ) -> None:
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.reuse_ttl_sec = max(0, reuse_ttl_sec)
+        self.heartbeat_sec = max(1, heartbeat_sec)
+        # 判定超时至少留出两个心跳周期，避免一次心跳稍慢就误杀存活进程的任务。
+        self.stale_sec = max(stale_sec, self.heartbeat_sec * 2)
+        # 多 worker（uvicorn --workers N）共用任务表：每行记录所属进程，只回收心跳超时的任务。
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: asyncio.Queue[str] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._heartbeat: asyncio.Task | None = None
+        self._live: dict[str, _LiveJob] = {}
+        self._submit_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(ChatJob.__table__.create, checkfirst=True)
+        # 已退出进程留下的未完成任务无法续跑，标记失败，避免客户端一直等待；其它存活 worker 的任务心跳新鲜，不受影响。
+        await self._fail_stale()
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self) -> None:
+        tasks = [*self._tasks, *([self._heartbeat] if self._heartbeat is not None else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._heartbeat = None
+        # 正常退出时本进程的未完成任务立即标记失败，不必等心跳超时。
+        try:
+            async with AsyncSessionLocal() as session:
+                interrupted = await fail_owned_chat_jobs(session, self.owner_id, _INTERRUPTED)
+                await session.commit()
+        except Exception:
+            logger.exception("failed to mark unfinished chat jobs on shutdown")
+            return
+        if interrupted:
+            logger.warning("marked %s unfinished chat jobs of this process as failed", interrupted)
+
+    async def _fail_stale(self) -> None:
+        async with AsyncSessionLocal() as session:
+            interrupted = await fail_stale_chat_jobs(session, self.stale_sec, _INTERRUPTED)
+            await session.commit()
+        if interrupted:
+            logger.warning("marked %s stale chat jobs as failed", interrupted)
+
+    async def _heartbeat_loop(self) -> None:
+        # 刷新本进程任务的心跳，并顺带回收其它已退出进程遗留的任务（不依赖重启触发）。
+        while True:
+            await asyncio.sleep(self.heartbeat_sec)
+            try:
+                async with AsyncSessionLocal() as session:
+                    await heartbeat_chat_jobs(session, self.owner_id)
+                    await session.commit()
+                await self._fail_stale()
+            except Exception:
+                logger.exception("chat job heartbeat failed")
+
+    async def submit(self, query: str) -> tuple[ChatJob, bool]:
+        if self._queue is None:
+            raise RuntimeError("任务服务未启动")
+        # 加锁保证“查复用 -> 入库 -> 入队”原子，同一问题并发提交只会生成一个任务。
+        async with self._submit_lock:
+            async with AsyncSessionLocal() as session:
+                if self.reuse_ttl_sec > 0:
+                    since = datetime.now() - timedelta(seconds=self.reuse_ttl_sec)
+                    existing = await find_reusable_chat_job(session, query, since)
+                    if existing is not None:
+                        return existing, True
+
+                if self._queue.full():
+                    raise JobQueueFullError("任务队列已满，请稍后重试")
+                job = await create_chat_job(session, job_id=uuid.uuid4().hex, query=query, owner_id=self.owner_id)
+                await session.commit()
+
+            self._live[job.id] = _LiveJob()
+            self._queue.put_nowait(job.id)
+            return job, False
+
+    async def get(self, job_id: str) -> ChatJob | None:
+        async with AsyncSessionLocal() as session:
+            return await get_chat_job(session, job_id)
+
+    async def events(self, job_id: str) -> AsyncIterator[dict[str, Any]]:
+        # 先回放已有进度，再推送增量；最后一条为 done 或 error。
+        live = self._live.get(job_id)
+        if live is not None:
+            queue: asyncio.Queue = asyncio.Queue()
+            # 回放与订阅之间没有 await，不会漏掉或重复事件。
+            backlog = list(live.events)
+            live.subscribers.add(queue)
+            try:
+                yield {"type": "status", "status": live.status}
+                for event in backlog:
+                    yield event
+                    if event["type"] in {"done", "error"}:
+                        return
+                while True:
+                    event = await queue.get()
+                    yield event
+                    if event["type"] in {"done", "error"}:
+                        return
+            finally:
+                live.subscribers.discard(queue)
+
+        # 非本进程执行（或已结束并清理）的任务：以库中状态为准，未结束时轮询。
+        sent = 0
+        last_status = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                yield {"type": "error", "message": "任务不存在"}
+                return
+            if job.status != last_status:
+                last_status = job.status
+                yield {"type": "status", "status": job.status}
+            progress = json.loads(job.progress_json or "[]")
+            for event in progress[sent:]:
+                yield event
+            sent = len(progress)
+            if job.status == "succeeded":
+                yield {"type": "done", "result": json.loads(job.result_json or "{}")}
+                return
+            if job.status == "failed":
+                yield {"type": "error", "message": job.error_message or "任务失败"}
+                return
+            await asyncio.sleep(_POLL_INTERVAL_SEC)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("chat job %s crashed", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        live = self._live.setdefault(job_id, _LiveJob())
+        job = await self.get(job_id)
+        if job is None:
+            self._live.pop(job_id, None)
+            return
+
+        progress: list[dict[str, Any]] = []
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as session:
+            await update_chat_job(session, job_id, status="running", started_at=datetime.now())
+            await session.commit()
+        live.status = "running"
+        live.publish({"type": "status", "status": "running"})
+
+        try:
+            result: dict[str, Any] = {}
+            # 异步任务本就用于长耗时问题，不设请求级预算。
+            async for node, update in astream(job.query, deadline_ms=0):
+                if node == "__end__":
+                    result = update
+                    continue
+                node_events = [
+                    {"type": "node", "node": node, "elapsed_ms": int((time.perf_counter() - started) * 1000)},
+                    *progress_events(node, update),
+                ]
+                progress.extend(node_events)
+                for event in node_events:
+                    live.publish(event)
+                # 每个节点完成即落库，进程外的轮询方也能看到进度。
+                async with AsyncSessionLocal() as session:
+                    await update_chat_job(
+                        session,
+                        job_id,
+                        progress_json=dumps_str(progress),
+                    )
+                    await session.commit()
+
+            payload = chat_result(result)
+            async with AsyncSessionLocal() as session:
+                await update_chat_job(
+                    session,
+                    job_id,
+                    status="succeeded",
+                    result_json=dumps_str(payload),
+                    finished_at=datetime.now(),
+                )
+                await session.commit()
+            live.status = "succeeded"
+            live.publish({"type": "done", "result": payload})
+        except Exception as exc:
+            async with AsyncSessionLocal() as session:
+                await update_chat_job(
+                    session,
+                    job_id,
+                    status="failed",
+                    error_message=str(exc),
+                    finished_at=datetime.now(),
+                )
+                await session.commit()
+            live.status = "failed"
+            live.publish({"type": "error", "message": str(exc)})
+        finally:
+            # 结果已落库，内存快照只需服务当前订阅者。
+            self._live.pop(job_id, None)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "owner_id": self.owner_id,
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "running": sum(1 for job in self._live.values() if job.status == "running"),
+        }
+
+
+job_manager = JobManager(
+    workers=settings.chat_job_workers,
+    max_queue=settings.chat_job_max_queue,
+    reuse_ttl_sec=settings.chat_job_reuse_ttl_sec,
+    heartbeat_sec=settings.chat_job_heartbeat_sec,
+    stale_sec=settings.chat_job_stale_sec,
+)
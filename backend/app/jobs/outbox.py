@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import weakref
+from typing import Any
+
+from app.core.config import get_settings
+from app.db.crud import (
+    bulk_update_action_logs,
+    claim_action_log,
+    get_action_log,
+    get_action_log_by_key,
+    get_action_logs,
+    get_action_logs_by_keys,
+    list_pending_action_log_ids,
+    requeue_stale_action_logs,
+    update_action_log,
+)
+from app.db.engine import AsyncSessionLocal
+from app.db.models import ActionLog
+from app.integrations.crm_client import crm_client
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_TERMINAL = {"success", "failed"}
+
+
+def _coupon_payload(log_id: int, plan: dict[str, Any], execution: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "name": execution.get("campaign_name") or f"campaign-{log_id}",
+        "offer": plan["offer"],
+        "duration_days": int(plan.get("duration_days", settings.plan_default_duration_days)),
+    }
+
+
+class OutboxDispatcher:
+    """action_logs 即 outbox：请求事务只写 campaign + pending 记录，CRM 建券/发布由后台投递者完成并回写结果。"""
+
+    def __init__(
+        self,
+        workers: int,
+        poll_interval_sec: float,
+        batch_size: int,
+        stale_after_sec: int,
+        crm_batch_size: int,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.poll_interval = max(0.1, poll_interval_sec)
+        self.batch_size = max(1, batch_size)
+        self.stale_after_sec = max(1, stale_after_sec)
+        self.crm_batch_size = max(1, crm_batch_size)
+        self._queue: asyncio.Queue[int] | None = None
+        self._queued: set[int] = set()
+        self._tasks: list[asyncio.Task] = []
+        # 按幂等键登记等待者；投递完成时弹出并唤醒，没有等待者时自动回收。
+        self._done: weakref.WeakValueDictionary[str, asyncio.Event] = weakref.WeakValueDictionary()
+        # 任意一批投递完成都会置位并替换，供批量等待者统一回查。
+        self._progress = asyncio.Event()
+        self._delivered = 0
+        self._failed = 0
+        self._delivery_sum = 0.0
+        self._batches = 0
+        self._batch_items = 0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poller()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+
+    def notify(self, log_id: int) -> None:
+        # 提交后立即唤醒投递；未启动（脚本直接调用图）时由下次轮询或启动后的扫描兜底。
+        if self._queue is None or log_id in self._queued:
+            return
+        self._queued.add(log_id)
+        self._queue.put_nowait(log_id)
+
+    async def wait_result(self, idempotency_key: str, timeout: float) -> ActionLog | None:
+        # 本进程投递完成时立即唤醒；其他进程投递的记录按轮询间隔回查，最多等到超时。
+        deadline = time.monotonic() + max(0.0, timeout)
+        event = self._done.get(idempotency_key)
+        if event is None:
+            event = self._done[idempotency_key] = asyncio.Event()
+        while True:
+            async with AsyncSessionLocal() as session:
+                log = await get_action_log_by_key(session, idempotency_key)
+            remaining = deadline - time.monotonic()
+            if log is None or log.status in _TERMINAL or remaining <= 0:
+                return log
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(remaining, self.poll_interval))
+            except TimeoutError:
+                pass
+
+    async def wait_results(self, keys: list[str], timeout: float) -> dict[str, ActionLog]:
+        # 批量等待：每轮一次 IN 查询回查全部键，直到都结束或超时。
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            progress = self._progress
+            async with AsyncSessionLocal() as session:
+                logs = {log.idempotency_key: log for log in await get_action_logs_by_keys(session, keys)}
+            remaining = deadline - time.monotonic()
+            if all(log.status in _TERMINAL for log in logs.values()) or remaining <= 0:
+                return logs
+            try:
+                await asyncio.wait_for(progress.wait(), timeout=min(remaining, self.poll_interval))
+            except TimeoutError:
+                pass
+
+    async def _poller(self) -> None:
+        # 兜底扫描：其他进程写入的、通知丢失的、以及投递者中途退出而卡在 processing 的记录。
+        while True:
+            try:
+                async with AsyncSessionLocal() as session:
+                    requeued = await requeue_stale_action_logs(session, self.stale_after_sec)
+                    ids = await list_pending_action_log_ids(session, self.batch_size)
+                    await session.commit()
+                if requeued:
+                    logger.warning("requeued %s stale outbox records", requeued)
+                for log_id in ids:
+                    self.notify(log_id)
+            except Exception:
+                logger.exception("outbox poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _worker(self) -> None:
+        while True:
+            # 取一条，再顺带取走队列里已就绪的记录，凑成一批调用 CRM 批量接口。
+            log_ids = [await self._queue.get()]
+            while len(log_ids) < self.crm_batch_size and not self._queue.empty():
+                log_ids.append(self._queue.get_nowait())
+            self._queued.difference_update(log_ids)
+            try:
+                if len(log_ids) == 1:
+                    await self._deliver(log_ids[0])
+                else:
+                    await self._deliver_batch(log_ids)
+            except Exception:
+                logger.exception("outbox delivery %s crashed", log_ids)
+            finally:
+                for _ in log_ids:
+                    self._queue.task_done()
+
+    async def _deliver(self, log_id: int) -> None:
+        # 每一步只在写库时短暂持有连接，CRM 网络调用期间不占用连接与事务。
+        async with AsyncSessionLocal() as session:
+            if not await claim_action_log(session, log_id):
+                return
+            log = await get_action_log(session, log_id)
+            await session.commit()
+            plan = json.loads(log.request_json)
+            execution: dict[str, Any] = json.loads(log.response_json)
+
+        started = time.perf_counter()
+        try:
+            coupon_id = execution.get("coupon_id")
+            if coupon_id is None:
+                created = await crm_client.create_coupon(_coupon_payload(log_id, plan, execution))
+                coupon_id = int(created["coupon_id"])
+                execution["coupon_id"] = coupon_id
+                # 先记下券 ID：发布失败或进程中断后重投只需再发布，不会重复建券。
+                async with AsyncSessionLocal() as session:
+                    await update_action_log(session, log_id, response_json=json.dumps(execution, ensure_ascii=False))
+                    await session.commit()
+
+            published = await crm_client.publish_coupon(coupon_id)
+            execution.update(publish_status=published.get("status", "unknown"), error=None)
+            status, error_message = "success", None
+            self._delivered += 1
+        except Exception as exc:
+            execution.update(publish_status="failed", error=str(exc))
+            status, error_message = "failed", str(exc)
+            self._failed += 1
+        self._delivery_sum += time.perf_counter() - started
+
+        async with AsyncSessionLocal() as session:
+            await update_action_log(
+                session,
+                log_id,
+                status=status,
+                response_json=json.dumps(execution, ensure_ascii=False),
+                error_message=error_message,
+            )
+            await session.commit()
+        self._batches += 1
+        self._batch_items += 1
+        self._finished([log.idempotency_key])
+
+    async def _deliver_batch(self, log_ids: list[int]) -> None:
+        async with AsyncSessionLocal() as session:
+            claimed = [log_id for log_id in log_ids if await claim_action_log(session, log_id)]
+            logs = await get_action_logs(session, claimed)
+            await session.commit()
+        if not logs:
+            return
+
+        plans = {log.id: json.loads(log.request_json) for log in logs}
+        executions: dict[int, dict[str, Any]] = {log.id: json.loads(log.response_json) for log in logs}
+        statuses: dict[int, tuple[str, str | None]] = {}
+        started = time.perf_counter()
+        try:
+            to_create = [log.id for log in logs if executions[log.id].get("coupon_id") is None]
+            if to_create:
+                coupon_ids = await crm_client.create_coupons(
+                    [_coupon_payload(log_id, plans[log_id], executions[log_id]) for log_id in to_create]
+                )
+                for log_id, coupon_id in zip(to_create, coupon_ids):
+                    executions[log_id]["coupon_id"] = coupon_id
+                # 与单条投递相同：先落券 ID，重投时只需再发布。
+                async with AsyncSessionLocal() as session:
+                    await bulk_update_action_logs(
+                        session,
+                        [
+                            {"id": log_id, "response_json": json.dumps(executions[log_id], ensure_ascii=False)}
+                            for log_id in to_create
+                        ],
+                    )
+                    await session.commit()
+
+            published = await crm_client.publish_coupons([executions[log.id]["coupon_id"] for log in logs])
+            for log in logs:
+                status = published.get(executions[log.id]["coupon_id"], "unknown")
+                if status == "published":
+                    executions[log.id].update(publish_status=status, error=None)
+                    statuses[log.id] = ("success", None)
+                else:
+                    error = f"CRM 发布失败：{status}"
+                    executions[log.id].update(publish_status="failed", error=error)
+                    statuses[log.id] = ("failed", error)
+        except Exception as exc:
+            for log in logs:
+                executions[log.id].update(publish_status="failed", error=str(exc))
+                statuses[log.id] = ("failed", str(exc))
+        self._delivery_sum += time.perf_counter() - started
+
+        async with AsyncSessionLocal() as session:
+            await bulk_update_action_logs(
+                session,
+                [
+                    {
+                        "id": log.id,
+                        "status": statuses[log.id][0],
+                        "response_json": json.dumps(executions[log.id], ensure_ascii=False),
+                        "error_message": statuses[log.id][1],
+                    }
+                    for log in logs
+                ],
+            )
+            await session.commit()
+        succeeded = sum(1 for status, _ in statuses.values() if status == "success")
+        self._delivered += succeeded
+        self._failed += len(logs) - succeeded
+        self._batches += 1
+        self._batch_items += len(logs)
+        self._finished([log.idempotency_key for log in logs])
+
+    def _finished(self, keys: list[str]) -> None:
+        for key in keys:
+            event = self._done.pop(key, None)
+            if event is not None:
+                event.set()
+        progress, self._progress = self._progress, asyncio.Event()
+        progress.set()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "delivered": self._delivered,
+            "failed": self._failed,
+            "batches": self._batches,
+            "avg_batch_size": round(self._batch_items / self._batches, 2) if self._batches else None,
+            "avg_batch_ms": round(self._delivery_sum / self._batches * 1000, 2) if self._batches else None,
+        }
+
+
+outbox_dispatcher = OutboxDispatcher(
+    workers=settings.outbox_workers,
+    poll_interval_sec=settings.outbox_poll_interval_sec,
+    batch_size=settings.outbox_batch_size,
+    stale_after_sec=settings.outbox_stale_after_sec,
+    crm_batch_size=settings.outbox_crm_batch_size,
+)
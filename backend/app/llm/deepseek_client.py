@@ -1,26 +1,58 @@
-﻿from collections.abc import Awaitable, Callable
+﻿import asyncio
+import time
+from collections.abc import Awaitable, Callable
 
 from openai import AsyncOpenAI
 
 from app.core.config import get_settings
+from app.core.tracing import tracer
 
 settings = get_settings()
 
 
+class LLMTimeoutError(TimeoutError):
+    """调用超出时间预算；流式调用时 partial 为已产出的文本。"""
+
+    def __init__(self, partial: str = "") -> None:
+        super().__init__("LLM 调用超出时间预算")
+        self.partial = partial
+
+
 class DeepSeekClient:
     def __init__(self) -> None:
         self.client = AsyncOpenAI(api_key=settings.deepseek_api_key, base_url=settings.deepseek_base_url)
         self.model = settings.deepseek_model
 
-    async def chat(self, *, system: str, user: str, temperature: float = 0.1) -> str:
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            temperature=temperature,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
-        )
+    async def chat(
+        self,
+        *,
+        system: str,
+        user: str,
+        temperature: float = 0.1,
+        timeout: float | None = None,
+        json_mode: bool = False,
+    ) -> str:
+        # json_mode：要求模型输出 JSON 对象（DeepSeek 兼容 OpenAI response_format=json_object）。
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        with tracer.span("llm.chat", kind="client", model=self.model, json_mode=json_mode, timeout=timeout) as span:
+            try:
+                response = await asyncio.wait_for(
+                    self.client.chat.completions.create(
+                        model=self.model,
+                        temperature=temperature,
+                        messages=[
+                            {"role": "system", "content": system},
+                            {"role": "user", "content": user},
+                        ],
+                        **extra,
+                    ),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError as exc:
+                raise LLMTimeoutError() from exc
+            usage = response.usage
+            if usage is not None:
+                span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
         content = response.choices[0].message.content or ""
         return content.strip()
 
@@ -31,28 +63,43 @@ class DeepSeekClient:
         user: str,
         temperature: float = 0.1,
         on_token: Callable[[str], Awaitable[None]] | None = None,
+        timeout: float | None = None,
     ) -> str:
-        stream = await self.client.chat.completions.create(
-            model=self.model,
-            temperature=temperature,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
-            stream=True,
-        )
-
         chunks: list[str] = []
-        async for chunk in stream:
-            if not chunk.choices:
-                continue
-            token = chunk.choices[0].delta.content or ""
-            if not token:
-                continue
-            chunks.append(token)
-            if on_token is not None:
-                await on_token(token)
+        started = time.perf_counter()
+
+        async def _consume() -> None:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                temperature=temperature,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user},
+                ],
+                stream=True,
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content or ""
+                if not token:
+                    continue
+                if not chunks:
+                    # 首 token 时间（TTFT）：排队 + 模型预填充，流式场景下用户感知的主要延迟。
+                    span.set(ttft_ms=round((time.perf_counter() - started) * 1000, 1))
+                    span.event("first_token")
+                chunks.append(token)
+                if on_token is not None:
+                    await on_token(token)
 
+        # 超时覆盖整个流（含首 token 等待）；已推送给前端的部分通过异常带回。
+        with tracer.span("llm.chat_stream", kind="client", model=self.model, timeout=timeout) as span:
+            try:
+                await asyncio.wait_for(_consume(), timeout=timeout)
+            except asyncio.TimeoutError as exc:
+                raise LLMTimeoutError("".join(chunks)) from exc
+            finally:
+                span.set(chunks=len(chunks))
         return "".join(chunks).strip()
 
 
@@ -99,6 +99,30 @@ def build_sql_system(schema_hint: str) -> str:
 """
 
 
+def build_fused_intent_sql_system(schema_hint: str) -> str:
+    # 意图分类与 SQL 生成合并为一次调用：分类规则沿用四分类提示词，SQL 约束沿用 SQL_SYSTEM。
+    return f"""你同时完成两件事：意图分类，以及在需要取数时生成 MySQL 查询。
+只输出一个 JSON 对象：{{"intent": "report|diagnose|plan|execute", "sql": "..."}}，不要输出其他内容。
+- intent 为 report 或 diagnose 时，sql 为回答该问题所需的一条 MySQL SELECT；
+- intent 为 plan 或 execute 时，sql 为空字符串。
+
+【意图分类】
+{build_route_intent_system()}
+（上面“只输出一个单词”的要求在此改为：把标签写入 JSON 的 intent 字段。）
+
+【SQL 生成】
+{SQL_SYSTEM}
+（上面“只输出 SQL 本体”的要求在此改为：把 SQL 写入 JSON 的 sql 字段。）
+可用 schema:
+{schema_hint}
+"""
+
+
+def build_fused_intent_sql_user_prompt(query: str) -> str:
+    compare_hint = build_sql_compare_hint(query)
+    return f"用户问题：{query}\n{compare_hint}\n请输出 JSON。"
+
+
 def build_sql_repair_system(schema_hint: str) -> str:
     return f"""{SQL_REPAIR_SYSTEM}
 可用 schema:
@@ -201,6 +225,24 @@ def build_plan_schema_tip(settings: Settings, budget: int, duration: int) -> dic
     }
 
 
+def build_default_plan(settings: Settings, budget: int, duration: int) -> dict[str, Any]:
+    return {
+        "goal": settings.plan_default_goal,
+        "duration_days": duration,
+        "budget": budget,
+        "target_segment": {"definition": settings.plan_default_target_definition, "rules": settings.plan_target_rules},
+        "offer": {
+            "type": settings.plan_default_offer_type,
+            "threshold": settings.plan_default_offer_threshold,
+            "value": settings.plan_default_offer_value,
+            "max_redemptions": settings.plan_default_offer_max_redemptions,
+        },
+        "channels": settings.plan_channels,
+        "kpi": {"primary": settings.plan_default_kpi_primary, "targets": settings.plan_kpi_targets},
+        "risk_controls": settings.plan_risk_controls,
+    }
+
+
 def build_plan_user_prompt(query: str, budget: int, duration: int, kb_text: str, schema_tip: dict[str, Any]) -> str:
     return (
         f"用户需求：{query}\n"
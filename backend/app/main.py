@@ -1,13 +1,42 @@
-﻿from fastapi import FastAPI
+﻿from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.mock_crm_routes import router as mock_crm_router
 from app.api.routes import router as api_router
+from app.core.config import get_settings
 from app.core.logging import setup_logging
+from app.core.tracing import TraceMiddleware, tracer
+from app.db.migrate import run_migrations
+from app.db.partitions import ensure_future_partitions
+from app.graph.memory import session_memory
+from app.integrations.crm_client import crm_client
+from app.jobs.manager import job_manager
+from app.jobs.outbox import outbox_dispatcher
 
+settings = get_settings()
 setup_logging()
 
-app = FastAPI(title="Retail AI MVP", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await run_migrations()
+    if settings.orders_partition_maintain_on_startup:
+        await ensure_future_partitions()
+    await job_manager.start()
+    await outbox_dispatcher.start()
+    try:
+        yield
+    finally:
+        await outbox_dispatcher.stop()
+        await job_manager.stop()
+        await crm_client.aclose()
+        await session_memory.aclose()
+        tracer.shutdown()
+
+
+app = FastAPI(title="Retail AI MVP", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,7 +44,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
+
+if tracer.enabled:
+    # 纯 ASGI 中间件而不是 @app.middleware("http")：后者在响应头返回时就结束 span，流式响应体还没发完。
+    app.add_middleware(TraceMiddleware)
+
+
 app.include_router(api_router)
 app.include_router(mock_crm_router)
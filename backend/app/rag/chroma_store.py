@@ -1,41 +1,35 @@
 ﻿from __future__ import annotations
 
+import hashlib
+import time
 from typing import Any
 
-import anyio
 import chromadb
-from sentence_transformers import SentenceTransformer
 
 from app.core.config import get_settings
+from app.core.tracing import tracer
+from app.rag.embedding import embed_query, get_embedder
+from app.rag.executor import embedding_executor
 
 settings = get_settings()
-
-
-class LocalEmbeddingFunction:
-    def __init__(self, model_path: str):
-        self.model = SentenceTransformer(model_path)
-
-    def __call__(self, input: list[str]) -> list[list[float]]:
-        vectors = self.model.encode(input, normalize_embeddings=True)
-        return [v.tolist() for v in vectors]
-
-    def name(self) -> str:
-        return "local-bge-base-zh-v1.5"
-
-    def embed_documents(self, input: list[str]) -> list[list[float]]:
-        return self.__call__(input)
-
-    def embed_query(self, input: list[str] | str) -> list[list[float]]:
-        texts = input if isinstance(input, list) else [input]
-        return self.__call__(texts)
+_DOCS_CACHE_TTL_SEC = 60.0
 
 
 class ChromaStore:
     def __init__(self) -> None:
         self._client = chromadb.PersistentClient(path=settings.chroma_dir_abs)
-        self._embedder = LocalEmbeddingFunction(settings.embed_model_abs)
+        self._embedder = get_embedder()
+        self._collection = None
+        self._docs_cache: tuple[str, list[dict[str, Any]]] | None = None
+        self._docs_cache_at = 0.0
 
     def _get_collection(self):
+        # collection 句柄进程内缓存，避免每次查询都走 get_or_create_collection。
+        if self._collection is None:
+            self._collection = self._open_collection()
+        return self._collection
+
+    def _open_collection(self):
         try:
             return self._client.get_or_create_collection(
                 name="retail_kb",
@@ -51,35 +45,112 @@ class ChromaStore:
                 embedding_function=self._embedder,
             )
 
-    async def upsert_docs(self, docs: list[dict[str, Any]]) -> None:
+    async def upsert_docs(self, docs: list[dict[str, Any]], embeddings: list[list[float]] | None = None) -> None:
         def _upsert() -> None:
             collection = self._get_collection()
             collection.upsert(
                 ids=[d["id"] for d in docs],
                 documents=[d["content"] for d in docs],
                 metadatas=[{"title": d["title"], "tags": ",".join(d["tags"])} for d in docs],
+                embeddings=embeddings,
             )
 
-        await anyio.to_thread.run_sync(_upsert)
-
-    async def query(self, query: str, top_k: int = 5) -> list[dict[str, Any]]:
-        def _query():
-            collection = self._get_collection()
-            return collection.query(query_texts=[query], n_results=top_k)
-
-        result = await anyio.to_thread.run_sync(_query)
-        docs = result.get("documents", [[]])[0]
-        metadatas = result.get("metadatas", [[]])[0]
-        output: list[dict[str, Any]] = []
-        for doc, meta in zip(docs, metadatas):
-            output.append(
+        await embedding_executor.run(_upsert)
+        self._docs_cache = None
+
+    async def delete_docs(self, ids: list[str]) -> None:
+        if not ids:
+            return
+        await embedding_executor.run(lambda: self._get_collection().delete(ids=ids))
+        self._docs_cache = None
+
+    async def all_docs(self) -> tuple[str, list[dict[str, Any]]]:
+        # 全量文档供词法索引使用；返回 (版本号, 文档)，版本变化时调用方重建索引。
+        now = time.monotonic()
+        if self._docs_cache is not None and now - self._docs_cache_at < _DOCS_CACHE_TTL_SEC:
+            return self._docs_cache
+
+        def _get():
+            return self._get_collection().get(include=["documents", "metadatas"])
+
+        result = await embedding_executor.run(_get)
+        docs: list[dict[str, Any]] = []
+        digest = hashlib.blake2b(digest_size=16)
+        for doc_id, doc, meta in zip(result.get("ids") or [], result.get("documents") or [], result.get("metadatas") or []):
+            meta = meta or {}
+            docs.append(
                 {
+                    "id": doc_id,
                     "title": meta.get("title", ""),
                     "content": doc,
                     "tags": (meta.get("tags") or "").split(",") if meta.get("tags") else [],
                 }
             )
+            for part in (doc_id, meta.get("title", ""), meta.get("tags") or "", doc or ""):
+                digest.update(part.encode("utf-8"))
+                digest.update(b"\0")
+        # 版本由内容决定：TTL 到期重新拉取但集合未变时版本不变，调用方不会重复分词、重建 BM25。
+        self._docs_cache = (f"chroma-{len(docs)}-{digest.hexdigest()}", docs)
+        self._docs_cache_at = now
+        return self._docs_cache
+
+    async def query(self, query: str, top_k: int = 5, tags: list[str] | None = None) -> list[dict[str, Any]]:
+        # tags 存为逗号拼接字符串，Chroma where 无法做包含匹配，因此多取候选后在本地过滤；
+        # 命中不足 top_k 时按 4 倍扩大候选，直到凑够或取完整个集合，稀有标签也不会少返回。
+        query_vector = await embed_query(query)
+        wanted = set(tags or [])
+
+        def _query() -> tuple[list[dict[str, Any]], int]:
+            collection = self._get_collection()
+            total = collection.count()
+            n_results = min(top_k * 4 if wanted else top_k, total)
+            while True:
+                if n_results <= 0:
+                    return [], 0
+                result = collection.query(query_embeddings=[query_vector], n_results=n_results)
+                hits = _collect_hits(result, wanted, top_k)
+                if not wanted or len(hits) >= top_k or n_results >= total:
+                    return hits, n_results
+                n_results = min(n_results * 4, total)
+
+        with tracer.span("vector.query", kind="client", backend="chroma", top_k=top_k) as span:
+            output, n_results = await embedding_executor.run(_query)
+            span.set(n_results=n_results)
         return output
 
 
-chroma_store = ChromaStore()
+def _collect_hits(result: dict[str, Any], wanted: set[str], top_k: int) -> list[dict[str, Any]]:
+    ids = result.get("ids", [[]])[0]
+    docs = result.get("documents", [[]])[0]
+    metadatas = result.get("metadatas", [[]])[0]
+    distances = (result.get("distances") or [[]])[0] or [None] * len(docs)
+    output: list[dict[str, Any]] = []
+    for doc_id, doc, meta, distance in zip(ids, docs, metadatas, distances):
+        meta = meta or {}
+        doc_tags = (meta.get("tags") or "").split(",") if meta.get("tags") else []
+        if wanted and not wanted.intersection(doc_tags):
+            continue
+        output.append(
+            {
+                "id": doc_id,
+                "title": meta.get("title", ""),
+                "content": doc,
+                "tags": doc_tags,
+                # 默认 l2 空间下，归一化向量的平方距离 d 与余弦相似度满足 cos = 1 - d / 2。
+                "score": 1.0 - float(distance) / 2 if distance is not None else None,
+            }
+        )
+        if len(output) >= top_k:
+            break
+    return output
+
+
+def _build_store():
+    if settings.rag_backend == "numpy":
+        from app.rag.numpy_store import NumpyVectorStore
+
+        return NumpyVectorStore(settings.vector_index_dir_abs)
+    return ChromaStore()
+
+
+chroma_store = _build_store()
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import struct
+import threading
+from typing import Any
+
+import numpy as np
+import orjson
+
+from app.core.config import get_settings
+from app.core.logging import setup_logging
+from app.core.serialize import dumps
+from app.rag.embedding import EmbeddingBatcher, load_local_embedder
+from app.rag.executor import embedding_executor
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# 帧格式：4 字节大端长度 + 内容。请求为一个 JSON 帧；响应为一个 JSON 头帧，embed 成功时再跟一个 float32 向量帧。
+_LEN = struct.Struct(">I")
+_MAX_FRAME = 64 * 1024 * 1024
+
+
+class EmbeddingSidecarError(RuntimeError):
+    pass
+
+
+def parse_address(address: str) -> tuple[str, Any]:
+    # unix:/path/to.sock 或 host:port
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:") :]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"无效的 sidecar 地址：{address}，应为 unix:/path 或 host:port")
+    return "tcp", (host, int(port))
+
+
+class SidecarEmbeddingFunction:
+    """把编码请求转发给共享的 embedding sidecar 进程；worker 进程内不加载 torch/模型。"""
+
+    def __init__(self, address: str, timeout: float = 10.0) -> None:
+        self.family, self.target = parse_address(address)
+        self.timeout = timeout
+        # 每个执行器线程一条长连接，线程间无需加锁，并发请求在 sidecar 侧合批。
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        if self.family == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.target)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _recv_exact(self, sock: socket.socket, size: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = sock.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError("embedding sidecar 连接已关闭")
+            buf.extend(chunk)
+        return bytes(buf)
+
+    def _recv_frame(self, sock: socket.socket) -> bytes:
+        (size,) = _LEN.unpack(self._recv_exact(sock, _LEN.size))
+        return self._recv_exact(sock, size)
+
+    def _request(self, texts: list[str]) -> list[list[float]]:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = self._connect()
+        body = dumps({"op": "embed", "texts": texts})
+        sock.sendall(_LEN.pack(len(body)) + body)
+        header = orjson.loads(self._recv_frame(sock))
+        if not header.get("ok"):
+            raise EmbeddingSidecarError(header.get("error") or "embedding sidecar 返回错误")
+        vectors = np.frombuffer(self._recv_frame(sock), dtype="<f4")
+        return vectors.reshape(header["n"], header["dim"]).tolist()
+
+    def _drop_connection(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        if not input:
+            return []
+        try:
+            return self._request(list(input))
+        except (OSError, ConnectionError):
+            # sidecar 重启后旧连接失效：重连重试一次。
+            self._drop_connection()
+        try:
+            return self._request(list(input))
+        except (OSError, ConnectionError) as exc:
+            self._drop_connection()
+            raise EmbeddingSidecarError(f"embedding sidecar 不可用：{exc}") from exc
+
+    def name(self) -> str:
+        # 与本地后端同名，已有 Chroma collection 可直接复用。
+        return "local-bge-base-zh-v1.5"
+
+    def embed_documents(self, input: list[str]) -> list[list[float]]:
+        return self.__call__(input)
+
+    def embed_query(self, input: list[str] | str) -> list[list[float]]:
+        texts = input if isinstance(input, list) else [input]
+        return self.__call__(texts)
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes | None:
+    try:
+        (size,) = _LEN.unpack(await reader.readexactly(_LEN.size))
+    except asyncio.IncompleteReadError:
+        return None
+    if size > _MAX_FRAME:
+        raise EmbeddingSidecarError(f"请求过大：{size} bytes")
+    return await reader.readexactly(size)
+
+
+def _write_frame(writer: asyncio.StreamWriter, body: bytes) -> None:
+    writer.write(_LEN.pack(len(body)) + body)
+
+
+class EmbeddingServer:
+    """单进程持有模型；来自所有 worker、所有连接的请求进入同一个微批队列合并编码。"""
+
+    def __init__(self, address: str) -> None:
+        self.address = address
+        self.family, self.target = parse_address(address)
+        self.embedder = load_local_embedder()
+        self.batcher = EmbeddingBatcher(
+            self.embedder,
+            max_batch=settings.embed_batch_max_size,
+            max_delay_ms=settings.embed_batch_max_delay_ms,
+        )
+        self.connections = 0
+        self.requests = 0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                if frame is None:
+                    return
+                self.requests += 1
+                try:
+                    request = orjson.loads(frame)
+                    if request.get("op") == "stats":
+                        _write_frame(writer, dumps({"ok": True, "stats": self.stats()}))
+                    else:
+                        vectors = await self.batcher.embed_many(list(request.get("texts") or []))
+                        matrix = np.asarray(vectors, dtype="<f4").reshape(len(vectors), -1)
+                        _write_frame(writer, dumps({"ok": True, "n": matrix.shape[0], "dim": matrix.shape[1]}))
+                        _write_frame(writer, matrix.tobytes())
+                except Exception as exc:
+                    logger.exception("embedding request failed")
+                    _write_frame(writer, dumps({"ok": False, "error": str(exc) or type(exc).__name__}))
+                await writer.drain()
+        except (ConnectionError, EmbeddingSidecarError):
+            return
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self) -> None:
+        # 预热：首个请求不承担模型初始化耗时。
+        self.embedder(["预热"])
+        if self.family == "unix":
+            if os.path.exists(self.target):
+                os.unlink(self.target)
+            server = await asyncio.start_unix_server(self._handle, path=self.target)
+            os.chmod(self.target, 0o660)
+        else:
+            host, port = self.target
+            server = await asyncio.start_server(self._handle, host=host, port=port)
+        logger.info("embedding sidecar listening on %s", self.address)
+        async with server:
+            await server.serve_forever()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "connections": self.connections,
+            "requests": self.requests,
+            "batcher": self.batcher.stats(),
+            "executor": embedding_executor.stats(),
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="embedding sidecar：多个 uvicorn worker 共享一份模型")
+    parser.add_argument("--address", default=settings.embed_sidecar_address or "unix:/tmp/retail-embed.sock")
+    args = parser.parse_args()
+
+    setup_logging()
+    asyncio.run(EmbeddingServer(args.address).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import Callable
+from functools import lru_cache
+from typing import Any
+
+from app.core.batch_cache import cached
+from app.core.config import get_settings
+from app.core.tracing import tracer
+from app.rag.executor import embedding_executor, intra_op_threads
+
+settings = get_settings()
+
+
+class LocalEmbeddingFunction:
+    def __init__(self, model_path: str):
+        # torch 体积大，延迟到真正需要模型时再导入。
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(intra_op_threads())
+        self.model = SentenceTransformer(model_path)
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        vectors = self.model.encode(input, normalize_embeddings=True)
+        return [v.tolist() for v in vectors]
+
+    def name(self) -> str:
+        return "local-bge-base-zh-v1.5"
+
+    def embed_documents(self, input: list[str]) -> list[list[float]]:
+        return self.__call__(input)
+
+    def embed_query(self, input: list[str] | str) -> list[list[float]]:
+        texts = input if isinstance(input, list) else [input]
+        return self.__call__(texts)
+
+
+@lru_cache(maxsize=1)
+def get_embedder():
+    # 进程内共享一份编码器，Chroma 与 NumPy 后端都复用它；配置了 sidecar 时 worker 不加载模型。
+    if settings.embed_sidecar_address:
+        from app.rag.embed_server import SidecarEmbeddingFunction
+
+        return SidecarEmbeddingFunction(settings.embed_sidecar_address, timeout=settings.embed_sidecar_timeout_sec)
+    return load_local_embedder()
+
+
+@lru_cache(maxsize=1)
+def load_local_embedder():
+    if settings.embed_backend == "onnx":
+        from app.rag.onnx_embedding import OnnxEmbeddingFunction
+
+        return OnnxEmbeddingFunction(
+            settings.embed_onnx_dir_abs,
+            threads=settings.embed_onnx_threads or intra_op_threads(),
+            quantized=settings.embed_onnx_quantized,
+        )
+    return LocalEmbeddingFunction(settings.embed_model_abs)
+
+
+class EmbeddingBatcher:
+    """把并发的单条 query 编码请求合并成一次批量 encode，每个调用方拿回自己的向量。"""
+
+    def __init__(self, embedder: Callable[[list[str]], list[list[float]]], max_batch: int, max_delay_ms: float) -> None:
+        self._embedder = embedder
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay_ms) / 1000
+        self._queue: asyncio.Queue[tuple[str, asyncio.Future, float]] | None = None
+        self._worker: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._batches = 0
+        self._items = 0
+        self._max_batch_seen = 0
+        self._queue_delay_sum = 0.0
+        self._encode_sum = 0.0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        # worker 与事件循环绑定；脚本多次 asyncio.run 时按新循环重建。
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        return self._queue
+
+    async def embed(self, text: str) -> list[float]:
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def embed_many(self, texts: list[str]) -> list[list[float]]:
+        return list(await asyncio.gather(*(self.embed(t) for t in texts)))
+
+    async def _collect(self, queue: asyncio.Queue) -> list[tuple[str, asyncio.Future, float]]:
+        batch = [await queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.max_batch or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        # 每个批次作为独立任务投给执行器，在途批次数以执行器 worker 数为上限：
+        # 多个 worker 可同时编码；所有 worker 都忙时先等空位再收集，下一批借机攒得更大。
+        queue = self._queue
+        slots = asyncio.Semaphore(embedding_executor.workers)
+        in_flight: set[asyncio.Task] = set()
+        while True:
+            await slots.acquire()
+            batch = [item for item in await self._collect(queue) if not item[1].done()]
+            if not batch:
+                slots.release()
+                continue
+            task = asyncio.create_task(self._encode(batch))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _encode(self, batch: list[tuple[str, asyncio.Future, float]]) -> None:
+        started = time.perf_counter()
+        texts = [text for text, _, _ in batch]
+        try:
+            vectors = await embedding_executor.run(self._embedder, texts)
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finished = time.perf_counter()
+
+        self._batches += 1
+        self._items += len(batch)
+        self._max_batch_seen = max(self._max_batch_seen, len(batch))
+        self._queue_delay_sum += sum(started - enqueued for _, _, enqueued in batch)
+        self._encode_sum += finished - started
+        for (_, future, _), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> dict[str, Any]:
+        batches = self._batches or 1
+        items = self._items or 1
+        return {
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": round(self._items / batches, 2),
+            "max_batch_size": self._max_batch_seen,
+            "avg_queue_delay_ms": round(self._queue_delay_sum / items * 1000, 3),
+            "avg_encode_ms": round(self._encode_sum / batches * 1000, 3),
+        }
+
+
+@lru_cache(maxsize=1)
+def get_batcher() -> EmbeddingBatcher:
+    return EmbeddingBatcher(
+        get_embedder(),
+        max_batch=settings.embed_batch_max_size,
+        max_delay_ms=settings.embed_batch_max_delay_ms,
+    )
+
+
+async def _embed_query(text: str) -> list[float]:
+    # span 只在实际编码时产生，批量对话内的缓存命中不计。
+    with tracer.span("embedding.encode", batched=settings.embed_batch_enabled, chars=len(text)):
+        if settings.embed_batch_enabled:
+            return await get_batcher().embed(text)
+        vectors = await embedding_executor.run(get_embedder(), [text])
+        return vectors[0]
+
+
+async def embed_query(text: str) -> list[float]:
+    # 在线 query 编码统一入口：开启微批时合并并发请求，否则直接在线程池里单条编码；批量对话内同文本只编码一次。
+    return await cached("embedding", text, lambda: _embed_query(text))
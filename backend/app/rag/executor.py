@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+import anyio
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+
+class EmbeddingOverloadedError(RuntimeError):
+    pass
+
+
+def intra_op_threads() -> int:
+    # 并发 worker 数 × 单次推理线程数 ≈ CPU 核数，避免 torch/onnx 线程超订。
+    if settings.embed_intra_op_threads > 0:
+        return settings.embed_intra_op_threads
+    return max(1, (os.cpu_count() or 1) // max(1, settings.embed_executor_workers))
+
+
+class EmbeddingExecutor:
+    """CPU 密集的 embedding/向量库调用专用执行器：独立并发上限、有界排队、排队超时即拒绝。"""
+
+    def __init__(self, workers: int, max_queue: int, queue_timeout_ms: float) -> None:
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = max(0.0, queue_timeout_ms) / 1000
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._gate: anyio.CapacityLimiter | None = None
+        self._threads: anyio.CapacityLimiter | None = None
+        self._running = 0
+        self._completed = 0
+        self._shed = 0
+        self._timeouts = 0
+
+    def _limiters(self) -> tuple[anyio.CapacityLimiter, anyio.CapacityLimiter]:
+        # _gate 负责准入排队；_threads 作为 to_thread 的专属 limiter，不再占用默认共享线程池配额。
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._gate is None or self._threads is None:
+            self._loop = loop
+            self._gate = anyio.CapacityLimiter(self.workers)
+            self._threads = anyio.CapacityLimiter(self.workers)
+        return self._gate, self._threads
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        gate, threads = self._limiters()
+        if gate.available_tokens == 0 and gate.statistics().tasks_waiting >= self.max_queue:
+            self._shed += 1
+            raise EmbeddingOverloadedError("embedding 执行器已满载，请稍后重试")
+
+        try:
+            with anyio.fail_after(self.queue_timeout):
+                await gate.acquire()
+        except TimeoutError as exc:
+            self._timeouts += 1
+            raise EmbeddingOverloadedError("embedding 排队超时，请稍后重试") from exc
+
+        self._running += 1
+        try:
+            return await anyio.to_thread.run_sync(fn, *args, limiter=threads)
+        finally:
+            self._running -= 1
+            self._completed += 1
+            gate.release()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "waiting": self._gate.statistics().tasks_waiting if self._gate is not None else 0,
+            "max_queue": self.max_queue,
+            "completed": self._completed,
+            "shed": self._shed,
+            "queue_timeouts": self._timeouts,
+            "intra_op_threads": intra_op_threads(),
+        }
+
+
+embedding_executor = EmbeddingExecutor(
+    workers=settings.embed_executor_workers,
+    max_queue=settings.embed_executor_max_queue,
+    queue_timeout_ms=settings.embed_executor_queue_timeout_ms,
+)
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import Any
+
+import jieba
+
+from app.core.config import get_settings
+from app.rag.chroma_store import chroma_store
+
+settings = get_settings()
+
+_TOKEN_RE = re.compile(r"\w+")
+_DOMAIN_WORDS = [
+    "复购率", "复购", "客单价", "支付成功率", "支付失败", "老客", "新客", "满减券", "折扣券",
+    "积分券", "会员日", "羊毛党", "核销", "触达", "外卖", "gmv",
+]
+_dict_loaded = False
+
+
+def _load_domain_words() -> None:
+    global _dict_loaded
+    if _dict_loaded:
+        return
+    for word in _DOMAIN_WORDS:
+        jieba.add_word(word)
+    _dict_loaded = True
+
+
+def tokenize(text: str) -> list[str]:
+    _load_domain_words()
+    # 搜索引擎模式切词，长词再细分出子词，提升“复购率/复购”这类口径词的召回。
+    tokens: list[str] = []
+    for piece in jieba.lcut_for_search((text or "").lower()):
+        piece = piece.strip()
+        if piece and _TOKEN_RE.fullmatch(piece):
+            tokens.append(piece)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, docs: list[dict[str, Any]], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.ids = [d["id"] for d in docs]
+        self.term_freqs: list[Counter[str]] = []
+        self.doc_lens: list[int] = []
+        df: Counter[str] = Counter()
+        for doc in docs:
+            tokens = tokenize(f"{doc.get('title', '')} {doc.get('content', '')}")
+            tf = Counter(tokens)
+            self.term_freqs.append(tf)
+            self.doc_lens.append(len(tokens))
+            df.update(tf.keys())
+        n = len(docs)
+        self.avg_len = (sum(self.doc_lens) / n) if n else 0.0
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query: str, allowed: set[int] | None = None) -> dict[int, float]:
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        if not terms:
+            return {}
+        out: dict[int, float] = {}
+        for i, tf in enumerate(self.term_freqs):
+            if allowed is not None and i not in allowed:
+                continue
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lens[i] / (self.avg_len or 1.0))
+            score = 0.0
+            for term in terms:
+                f = tf.get(term)
+                if f:
+                    score += self.idf[term] * f * (self.k1 + 1) / (f + norm)
+            if score > 0:
+                out[i] = score
+        return out
+
+
+def tags_for_intent(intent: str | None) -> list[str] | None:
+    # 按链路裁剪知识范围：方案不需要指标口径，诊断不需要活动玩法。
+    mapping = {
+        "report": settings.kb_tags_report,
+        "diagnose": settings.kb_tags_diagnose,
+        "plan": settings.kb_tags_plan,
+    }
+    tags = settings.split_csv(mapping.get(intent or "", ""))
+    return tags or None
+
+
+def _content_key(doc: dict[str, Any]) -> str:
+    text = re.sub(r"\s+", "", doc.get("content") or "")
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+class HybridRetriever:
+    """词法 BM25 与向量相似度加权融合，按 tags 预过滤，去重后按分数阈值截断。"""
+
+    def __init__(self, store) -> None:
+        self._store = store
+        self._version = ""
+        self._docs: list[dict[str, Any]] = []
+        self._bm25: BM25Index | None = None
+
+    async def _ensure_index(self) -> None:
+        version, docs = await self._store.all_docs()
+        if self._bm25 is None or version != self._version:
+            self._docs = docs
+            self._bm25 = BM25Index(docs)
+            self._version = version
+
+    async def query(
+        self,
+        query: str,
+        top_k: int = 3,
+        tags: list[str] | None = None,
+        min_score: float | None = None,
+    ) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+        await self._ensure_index()
+        alpha = settings.rag_hybrid_alpha
+        threshold = settings.rag_min_score if min_score is None else min_score
+        candidate_k = max(top_k * 4, settings.rag_candidate_k)
+
+        vector_hits = await self._store.query(query, top_k=candidate_k, tags=tags)
+        wanted = set(tags or [])
+        allowed = {i for i, d in enumerate(self._docs) if not wanted or wanted.intersection(d.get("tags") or [])}
+        lexical = self._bm25.scores(query, allowed)
+        lex_max = max(lexical.values(), default=0.0)
+
+        fused: dict[str, dict[str, Any]] = {}
+        for hit in vector_hits:
+            fused[hit["id"]] = {**hit, "vector_score": hit.get("score") or 0.0, "lexical_score": 0.0}
+        for i, raw in lexical.items():
+            doc = self._docs[i]
+            item = fused.setdefault(doc["id"], {**doc, "vector_score": 0.0, "lexical_score": 0.0})
+            item["lexical_score"] = raw / lex_max if lex_max else 0.0
+
+        for item in fused.values():
+            item["score"] = round(alpha * item["vector_score"] + (1 - alpha) * item["lexical_score"], 4)
+
+        ranked = sorted(fused.values(), key=lambda x: x["score"], reverse=True)
+        output: list[dict[str, Any]] = []
+        seen: set[str] = set()
+        dropped_dup = 0
+        dropped_low = 0
+        for item in ranked:
+            key = _content_key(item)
+            if key in seen:
+                dropped_dup += 1
+                continue
+            seen.add(key)
+            if item["score"] < threshold:
+                dropped_low += 1
+                continue
+            output.append(
+                {
+                    "title": item.get("title", ""),
+                    "content": item.get("content", ""),
+                    "tags": item.get("tags") or [],
+                    "score": item["score"],
+                }
+            )
+            if len(output) >= top_k:
+                break
+
+        debug = {
+            "mode": "hybrid",
+            "tags": tags,
+            "candidates": len(fused),
+            "vector_hits": len(vector_hits),
+            "lexical_hits": len(lexical),
+            "dropped_duplicate": dropped_dup,
+            "dropped_below_threshold": dropped_low,
+            "min_score": threshold,
+        }
+        return output, debug
+
+
+hybrid_retriever = HybridRetriever(chroma_store)
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from app.core.config import get_settings
+from app.rag.chroma_store import chroma_store
+from app.rag.embedding import get_embedder
+from app.rag.executor import embedding_executor
+
+settings = get_settings()
+
+SOURCE_EXTS = {".md", ".markdown", ".txt"}
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+_SENTENCE_RE = re.compile(r"(?<=[。！？!?；;\n])")
+
+
+def content_hash(doc: dict[str, Any]) -> str:
+    payload = json.dumps(
+        {"title": doc.get("title", ""), "tags": list(doc.get("tags") or []), "content": doc.get("content", "")},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _split_long(text: str, chunk_size: int, overlap: int) -> list[str]:
+    # 超长段落先按句切，仍超长再按字符硬切，块间保留 overlap 个字符的上下文。
+    pieces: list[str] = []
+    current = ""
+    for sentence in [s for s in _SENTENCE_RE.split(text) if s.strip()]:
+        while len(sentence) > chunk_size:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:chunk_size])
+            sentence = sentence[max(1, chunk_size - overlap):]
+        if len(current) + len(sentence) > chunk_size and current:
+            pieces.append(current)
+            current = current[-overlap:] if overlap else ""
+        current += sentence
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
+def chunk_text(text: str, chunk_size: int, overlap: int) -> list[str]:
+    # 以空行分段、按段累积到 chunk_size；标题行总是开启新块，避免跨章节混合语义。
+    chunks: list[str] = []
+    current = ""
+    for para in re.split(r"\n\s*\n", text.replace("\r\n", "\n")):
+        para = para.strip()
+        if not para:
+            continue
+        starts_section = bool(_HEADING_RE.match(para))
+        if current and (starts_section or len(current) + len(para) + 2 > chunk_size):
+            chunks.append(current)
+            current = ""
+        if len(para) > chunk_size:
+            chunks.extend(_split_long(para, chunk_size, overlap))
+            continue
+        current = f"{current}\n\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def iter_source_files(root: Path) -> Iterator[Path]:
+    for dirpath, _, filenames in os.walk(root):
+        for name in sorted(filenames):
+            path = Path(dirpath) / name
+            if path.suffix.lower() in SOURCE_EXTS:
+                yield path
+
+
+def iter_dir_chunks(root: Path, chunk_size: int, overlap: int) -> Iterator[dict[str, Any]]:
+    # 流式产出分块：一次只读一个文件。一级子目录名作为 tag，与 KB 现有 tags 体系对齐。
+    for path in iter_source_files(root):
+        rel = path.relative_to(root).as_posix()
+        text = path.read_text(encoding="utf-8", errors="ignore")
+        heading = _HEADING_RE.search(text)
+        title = heading.group(1).strip() if heading else path.stem
+        parts = Path(rel).parts
+        tags = [parts[0]] if len(parts) > 1 else ["playbook"]
+        for i, chunk in enumerate(chunk_text(text, chunk_size, overlap)):
+            yield {"id": f"{rel}#{i}", "title": title, "tags": tags, "content": chunk, "source": rel}
+
+
+class IngestManifest:
+    """记录每个 source 下各分块的内容哈希；按命名空间隔离目录导入与内置 KB。"""
+
+    def __init__(self, path: Path, namespace: str) -> None:
+        self.path = path
+        self.namespace = namespace
+        self.model = f"{settings.embed_backend}:{settings.embed_model_path}"
+        data: dict[str, Any] = {}
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("model") != self.model:
+            # 更换 embedding 模型后旧哈希全部作废，强制重新编码。
+            data = {"model": self.model, "namespaces": {}}
+        self.data = data
+        self.sources: dict[str, dict[str, str]] = data["namespaces"].setdefault(namespace, {})
+
+    def is_unchanged(self, doc: dict[str, Any], digest: str) -> bool:
+        return self.sources.get(doc["source"], {}).get(doc["id"]) == digest
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def _init_embed_worker() -> None:
+    get_embedder()
+
+
+def _embed_in_worker(texts: list[str]) -> list[list[float]]:
+    return get_embedder()(texts)
+
+
+class _Progress:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.seen = 0
+        self.skipped = 0
+        self.embedded = 0
+        self.upserted = 0
+        self.deleted = 0
+
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        label = "完成" if final else "进度"
+        print(
+            f"[ingest] {label}: seen={self.seen} skipped={self.skipped} embedded={self.embedded} "
+            f"upserted={self.upserted} deleted={self.deleted} "
+            f"elapsed={elapsed:.1f}s throughput={self.embedded / elapsed:.1f} chunks/s",
+            flush=True,
+        )
+
+
+async def ingest_docs(
+    docs: Iterable[dict[str, Any]],
+    *,
+    namespace: str,
+    embed_batch: int | None = None,
+    upsert_batch: int | None = None,
+    workers: int | None = None,
+    prune: bool = True,
+    store=None,
+) -> _Progress:
+    # 只对内容哈希变化的分块做 embedding；未变化的直接跳过，未变更语料重跑近乎零成本。
+    store = store or chroma_store
+    embed_batch = embed_batch or settings.kb_ingest_embed_batch
+    upsert_batch = upsert_batch or settings.kb_ingest_upsert_batch
+    workers = settings.kb_ingest_workers if workers is None else workers
+    manifest = IngestManifest(Path(settings.kb_ingest_manifest_abs), namespace)
+    progress = _Progress()
+    seen: dict[str, dict[str, str]] = {}
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_embed_worker) if workers > 0 else None
+    in_flight: list[tuple[asyncio.Future, list[dict[str, Any]], list[str]]] = []
+    pending_upsert: list[tuple[dict[str, Any], list[float], str]] = []
+
+    async def embed(texts: list[str]) -> list[list[float]]:
+        if pool is not None:
+            return await asyncio.wrap_future(pool.submit(_embed_in_worker, texts))
+        return await embedding_executor.run(get_embedder(), texts)
+
+    async def flush_upserts(force: bool = False) -> None:
+        while pending_upsert and (force or len(pending_upsert) >= upsert_batch):
+            batch = pending_upsert[:upsert_batch]
+            del pending_upsert[:upsert_batch]
+            await store.upsert_docs(
+                [{k: d[k] for k in ("id", "title", "content", "tags")} for d, _, _ in batch],
+                embeddings=[v for _, v, _ in batch],
+            )
+            for doc, _, digest in batch:
+                manifest.sources.setdefault(doc["source"], {})[doc["id"]] = digest
+            manifest.save()
+            progress.upserted += len(batch)
+            progress.report()
+
+    async def drain(limit: int) -> None:
+        while len(in_flight) > limit:
+            future, batch_docs, digests = in_flight.pop(0)
+            vectors = await future
+            progress.embedded += len(batch_docs)
+            pending_upsert.extend(zip(batch_docs, vectors, digests))
+            await flush_upserts()
+
+    def submit(batch_docs: list[dict[str, Any]], digests: list[str]) -> None:
+        future = asyncio.ensure_future(embed([d["content"] for d in batch_docs]))
+        in_flight.append((future, batch_docs, digests))
+
+    try:
+        batch_docs: list[dict[str, Any]] = []
+        digests: list[str] = []
+        for doc in docs:
+            doc = {**doc, "source": doc.get("source") or doc["id"]}
+            progress.seen += 1
+            digest = content_hash(doc)
+            seen.setdefault(doc["source"], {})[doc["id"]] = digest
+            if manifest.is_unchanged(doc, digest):
+                progress.skipped += 1
+                continue
+            batch_docs.append(doc)
+            digests.append(digest)
+            if len(batch_docs) >= embed_batch:
+                submit(batch_docs, digests)
+                batch_docs, digests = [], []
+                # 在途批次有上限，内存占用与语料规模无关。
+                await drain(max(1, workers) * 2 - 1)
+        if batch_docs:
+            submit(batch_docs, digests)
+        await drain(0)
+        await flush_upserts(force=True)
+
+        # 清理：同一命名空间下本次未出现的 source，以及 source 内消失的分块。
+        stale: list[str] = []
+        for source, chunks in list(manifest.sources.items()):
+            current = seen.get(source)
+            if current is None:
+                if prune:
+                    stale.extend(chunks)
+                    del manifest.sources[source]
+                continue
+            gone = [doc_id for doc_id in chunks if doc_id not in current]
+            stale.extend(gone)
+            for doc_id in gone:
+                del chunks[doc_id]
+        if stale:
+            await store.delete_docs(stale)
+            progress.deleted = len(stale)
+        manifest.save()
+    finally:
+        for future, _, _ in in_flight:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    progress.report(final=True)
+    return progress
+
+
+async def ingest_dir(root: str, *, chunk_size: int, overlap: int, **kwargs: Any) -> _Progress:
+    root_path = Path(root).resolve()
+    if not root_path.is_dir():
+        raise ValueError(f"目录不存在：{root_path}")
+    chunks = iter_dir_chunks(root_path, chunk_size, overlap)
+    return await ingest_docs(chunks, namespace=f"dir:{root_path.as_posix()}", **kwargs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="增量导入知识库目录（Markdown / 文本）")
+    parser.add_argument("root", help="知识文档目录，一级子目录名作为 tag")
+    parser.add_argument("--chunk-size", type=int, default=settings.kb_ingest_chunk_size)
+    parser.add_argument("--overlap", type=int, default=settings.kb_ingest_chunk_overlap)
+    parser.add_argument("--embed-batch", type=int, default=settings.kb_ingest_embed_batch)
+    parser.add_argument("--upsert-batch", type=int, default=settings.kb_ingest_upsert_batch)
+    parser.add_argument("--workers", type=int, default=settings.kb_ingest_workers, help="embedding 进程数，0 表示进程内")
+    parser.add_argument("--no-prune", action="store_true", help="不删除目录中已消失文件对应的分块")
+    args = parser.parse_args()
+
+    asyncio.run(
+        ingest_dir(
+            args.root,
+            chunk_size=args.chunk_size,
+            overlap=args.overlap,
+            embed_batch=args.embed_batch,
+            upsert_batch=args.upsert_batch,
+            workers=args.workers,
+            prune=not args.no_prune,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 ﻿import asyncio
 
-from app.rag.chroma_store import chroma_store
+from app.rag.ingest import ingest_docs
 
 KB_DOCS = [
     {"id": "m1", "title": "GMV口径", "tags": ["metric"], "content": "GMV 指支付成功订单金额总和，建议按 pay_status=1 统计并排除退款。"},
@@ -18,8 +18,9 @@ KB_DOCS = [
 
 
 async def seed_kb() -> None:
-    await chroma_store.upsert_docs(KB_DOCS)
-    print(f"KB 已写入 {len(KB_DOCS)} 条文档")
+    # 走增量导入：内容未变的文档不会重复 embedding。
+    progress = await ingest_docs(KB_DOCS, namespace="builtin")
+    print(f"KB 共 {len(KB_DOCS)} 条文档，本次写入 {progress.upserted} 条，跳过 {progress.skipped} 条")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from app.core.tracing import tracer
+from app.rag.embedding import embed_query, get_embedder
+from app.rag.executor import embedding_executor
+
+_MANIFEST_NAME = "manifest.json"
+_RELOAD_CHECK_SEC = 1.0
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    version: str
+    ids: list[str]
+    titles: list[str]
+    contents: list[str]
+    tags: list[list[str]]
+    matrix: np.ndarray
+    tag_masks: dict[str, np.ndarray]
+
+    @classmethod
+    def empty(cls) -> "IndexSnapshot":
+        return cls("", [], [], [], [], np.zeros((0, 0), dtype=np.float32), {})
+
+    @classmethod
+    def build(cls, version: str, docs: list[dict[str, Any]], matrix: np.ndarray) -> "IndexSnapshot":
+        tags = [list(d.get("tags") or []) for d in docs]
+        tag_masks: dict[str, np.ndarray] = {}
+        for i, doc_tags in enumerate(tags):
+            for tag in doc_tags:
+                mask = tag_masks.setdefault(tag, np.zeros(len(docs), dtype=bool))
+                mask[i] = True
+        return cls(
+            version=version,
+            ids=[d["id"] for d in docs],
+            titles=[d.get("title", "") for d in docs],
+            contents=[d.get("content", "") for d in docs],
+            tags=tags,
+            matrix=matrix,
+            tag_masks=tag_masks,
+        )
+
+    def docs(self) -> list[dict[str, Any]]:
+        return [
+            {"id": i, "title": t, "content": c, "tags": g}
+            for i, t, c, g in zip(self.ids, self.titles, self.contents, self.tags)
+        ]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorStore:
+    """常驻内存的精确向量检索：归一化 float32 矩阵 + 点积 top-k，索引文件以 mmap 方式加载。"""
+
+    def __init__(self, index_dir: str) -> None:
+        self._dir = Path(index_dir)
+        self._embedder = None
+        self._snapshot = IndexSnapshot.empty()
+        self._manifest_mtime = 0.0
+        self._checked_at = 0.0
+        self._write_lock = threading.Lock()
+        self.reload()
+
+    @property
+    def embedder(self):
+        # 延迟加载模型：只做检索（如基准、预计算向量写入）时无需加载 torch。
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+
+    def reload(self) -> bool:
+        # 读取 manifest 指向的版本；新快照整体替换引用，查询方不会看到半更新状态。
+        manifest_path = self._dir / _MANIFEST_NAME
+        try:
+            mtime = manifest_path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        version = manifest["version"]
+        if version == self._snapshot.version:
+            self._manifest_mtime = mtime
+            return False
+
+        meta = json.loads((self._dir / manifest["meta"]).read_text(encoding="utf-8"))
+        matrix = np.load(self._dir / manifest["vectors"], mmap_mode="r")
+        self._snapshot = IndexSnapshot.build(version, meta["docs"], matrix)
+        self._manifest_mtime = mtime
+        return True
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < _RELOAD_CHECK_SEC:
+            return
+        self._checked_at = now
+        self.reload()
+
+    def _write_snapshot(self, docs: list[dict[str, Any]], matrix: np.ndarray) -> None:
+        # 先写带版本号的数据文件，再原子替换 manifest，最后清理旧版本文件。
+        self._dir.mkdir(parents=True, exist_ok=True)
+        version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        vectors_name = f"vectors-{version}.npy"
+        meta_name = f"meta-{version}.json"
+
+        np.save(self._dir / vectors_name, matrix)
+        (self._dir / meta_name).write_text(
+            json.dumps({"docs": docs, "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0}, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        tmp_manifest = self._dir / f"{_MANIFEST_NAME}.{version}.tmp"
+        tmp_manifest.write_text(
+            json.dumps({"version": version, "vectors": vectors_name, "meta": meta_name, "count": len(docs)}),
+            encoding="utf-8",
+        )
+        os.replace(tmp_manifest, self._dir / _MANIFEST_NAME)
+
+        keep = {vectors_name, meta_name, _MANIFEST_NAME}
+        for path in self._dir.iterdir():
+            if path.name in keep or not path.name.startswith(("vectors-", "meta-")):
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                # Windows 下仍被 mmap 的旧文件删除失败，下次写入再清理。
+                pass
+
+    def _upsert_sync(self, docs: list[dict[str, Any]], embeddings: np.ndarray, delete_ids: set[str] | None = None) -> None:
+        with self._write_lock:
+            self.reload()
+            current = self._snapshot
+            merged = {doc["id"]: (doc, current.matrix[i]) for i, doc in enumerate(current.docs())}
+            for doc_id in delete_ids or ():
+                merged.pop(doc_id, None)
+            for doc, vector in zip(docs, embeddings):
+                merged[doc["id"]] = (
+                    {"id": doc["id"], "title": doc["title"], "content": doc["content"], "tags": list(doc["tags"])},
+                    vector,
+                )
+            new_docs = [d for d, _ in merged.values()]
+            matrix = _normalize(np.stack([v for _, v in merged.values()])) if merged else np.zeros((0, 0), np.float32)
+            self._write_snapshot(new_docs, matrix)
+            self.reload()
+
+    async def upsert_docs(self, docs: list[dict[str, Any]], embeddings: list[list[float]] | None = None) -> None:
+        def _upsert() -> None:
+            vectors = embeddings if embeddings is not None else self.embedder([d["content"] for d in docs])
+            self._upsert_sync(docs, np.asarray(vectors, dtype=np.float32))
+
+        await embedding_executor.run(_upsert)
+
+    async def delete_docs(self, ids: list[str]) -> None:
+        if not ids:
+            return
+        await embedding_executor.run(self._upsert_sync, [], np.zeros((0, 0), np.float32), set(ids))
+
+    async def _encode(self, texts: list[str]) -> np.ndarray:
+        vectors = await embedding_executor.run(self.embedder, texts)
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def search(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 5,
+        tags: list[str] | None = None,
+    ) -> list[list[dict[str, Any]]]:
+        # 多条 query 共用一次矩阵乘法：(m, d) @ (d, n) -> (m, n)。
+        self._maybe_reload()
+        snap = self._snapshot
+        n = len(snap.ids)
+        if n == 0 or top_k <= 0:
+            return [[] for _ in range(len(query_vectors))]
+
+        scores = np.asarray(query_vectors, dtype=np.float32) @ snap.matrix.T
+        if tags:
+            allowed = np.zeros(n, dtype=bool)
+            for tag in tags:
+                mask = snap.tag_masks.get(tag)
+                if mask is not None:
+                    allowed |= mask
+            if not allowed.any():
+                return [[] for _ in range(len(query_vectors))]
+            scores[:, ~allowed] = -np.inf
+
+        k = min(top_k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n), (len(scores), 1))
+        order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+        top = np.take_along_axis(top, order, axis=1)
+
+        output: list[list[dict[str, Any]]] = []
+        for row_scores, row_idx in zip(scores, top):
+            hits: list[dict[str, Any]] = []
+            for idx in row_idx:
+                score = float(row_scores[idx])
+                if score == -np.inf:
+                    continue
+                hits.append(
+                    {
+                        "id": snap.ids[idx],
+                        "title": snap.titles[idx],
+                        "content": snap.contents[idx],
+                        "tags": snap.tags[idx],
+                        "score": score,
+                    }
+                )
+            output.append(hits)
+        return output
+
+    async def all_docs(self) -> tuple[str, list[dict[str, Any]]]:
+        self._maybe_reload()
+        snap = self._snapshot
+        return snap.version, snap.docs()
+
+    async def query(self, query: str, top_k: int = 5, tags: list[str] | None = None) -> list[dict[str, Any]]:
+        vectors = _normalize(np.asarray([await embed_query(query)], dtype=np.float32))
+        with tracer.span("vector.query", backend="numpy", top_k=top_k):
+            return self.search(vectors, top_k=top_k, tags=tags)[0]
+
+    async def query_many(
+        self,
+        queries: list[str],
+        top_k: int = 5,
+        tags: list[str] | None = None,
+    ) -> list[list[dict[str, Any]]]:
+        if not queries:
+            return []
+        vectors = await self._encode(queries)
+        return self.search(vectors, top_k=top_k, tags=tags)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+_INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+_FP32_FILE = "model.onnx"
+_INT8_FILE = "model.int8.onnx"
+
+
+def _require_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as exc:
+        raise RuntimeError("EMBED_BACKEND=onnx 需要安装 onnxruntime：pip install onnxruntime onnx") from exc
+    return onnxruntime
+
+
+def export_onnx(model_path: str, output_dir: str, quantize: bool = True) -> Path:
+    # 从本地 bge 目录导出 BERT 主干到 ONNX；池化(CLS)与归一化在推理侧完成。
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    out = Path(output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path).eval()
+
+    dummy = tokenizer(["门店复购率下降原因"], return_tensors="pt")
+    inputs = tuple(dummy[name] for name in _INPUT_NAMES)
+    fp32_path = out / _FP32_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            inputs,
+            str(fp32_path),
+            input_names=_INPUT_NAMES,
+            output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "seq"} for name in _INPUT_NAMES},
+                "last_hidden_state": {0: "batch", 1: "seq"},
+                "pooler_output": {0: "batch"},
+            },
+            opset_version=14,
+            do_constant_folding=True,
+        )
+    tokenizer.save_pretrained(str(out))
+
+    if not quantize:
+        return fp32_path
+
+    _require_onnxruntime()
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = out / _INT8_FILE
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    return int8_path
+
+
+class OnnxEmbeddingFunction:
+    def __init__(self, onnx_dir: str, threads: int = 0, quantized: bool = True, max_length: int = 512):
+        ort = _require_onnxruntime()
+        from transformers import AutoTokenizer
+
+        model_dir = Path(onnx_dir)
+        model_file = model_dir / (_INT8_FILE if quantized else _FP32_FILE)
+        if not model_file.exists():
+            raise RuntimeError(f"ONNX 模型不存在：{model_file}，请先执行 python -m app.rag.onnx_embedding")
+
+        options = ort.SessionOptions()
+        # 单会话独占 intra-op 线程；多请求并发由上层执行器控制，避免线程超订。
+        options.intra_op_num_threads = threads or (os.cpu_count() or 1)
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.session = ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+        self._feed_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = max_length
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        encoded = self.tokenizer(
+            input,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in self._feed_names}
+        hidden = self.session.run(["last_hidden_state"], feeds)[0]
+        # bge 使用 CLS 向量作为句向量，再做 L2 归一化（与 sentence-transformers 配置一致）。
+        cls = hidden[:, 0]
+        norms = np.linalg.norm(cls, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (cls / norms).tolist()
+
+    def name(self) -> str:
+        # 与 torch 后端同名，Chroma 已有 collection 可直接复用。
+        return "local-bge-base-zh-v1.5"
+
+    def embed_documents(self, input: list[str]) -> list[list[float]]:
+        return self.__call__(input)
+
+    def embed_query(self, input: list[str] | str) -> list[list[float]]:
+        texts = input if isinstance(input, list) else [input]
+        return self.__call__(texts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="导出 bge 模型为 ONNX（默认 int8 动态量化）")
+    parser.add_argument("--model-path", default=settings.embed_model_abs)
+    parser.add_argument("--output-dir", default=settings.embed_onnx_dir_abs)
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+
+    path = export_onnx(args.model_path, args.output_dir, quantize=not args.no_quantize)
+    print(f"ONNX 模型已导出：{path}")
+
+
+if __name__ == "__main__":
+    main()
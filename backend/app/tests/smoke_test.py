@@ -3,6 +3,7 @@
 import httpx
 
 from app.db.engine import engine
+from app.graph.followup import parse_followup
 from app.graph.graph import ainvoke
 
 
@@ -16,13 +17,30 @@ async def main() -> None:
     answer = b.get("answer") or ""
     assert "(data)" in answer and "(kb)" in answer
 
+    # 追问识别：带明确标记或不引入新指标/维度的才复用上一轮结果，完整的新问题走正常路由。
+    last_query = "最近7天各门店GMV、客单价、订单数"
+    assert parse_followup("只看线上", last_query) is not None
+    assert parse_followup("按渠道再拆一下", last_query) is not None
+    assert parse_followup("前5", last_query) is not None
+    assert parse_followup("门店销售额排序前5", last_query) is None
+    assert parse_followup("各城市订单排序", last_query) is None
+
+    s1 = await ainvoke(last_query, session_id="smoke-followup")
+    assert s1.get("intent") == "report"
+    s2 = await ainvoke("按gmv降序取前3", session_id="smoke-followup")
+    assert s2.get("intent") == "followup"
+    s3 = await ainvoke("门店销售额排序前5", session_id="smoke-followup")
+    assert s3.get("intent") != "followup"
+    assert s3.get("user_query") == "门店销售额排序前5"
+
     c = await ainvoke("给高价值老客做一个促复购活动，预算3万，7天")
     assert c.get("intent") == "plan"
     assert int(c.get("plan", {}).get("budget", 0)) == 30000
 
     plan = c["plan"]
     async with httpx.AsyncClient(base_url="http://127.0.0.1:8000", timeout=20.0) as client:
-        d1 = await client.post("/api/execute", json={"plan": plan})
+        # CRM 投递在后台完成，wait_ms 让接口等到投递结果再返回。
+        d1 = await client.post("/api/execute", json={"plan": plan, "wait_ms": 15000})
         d1.raise_for_status()
         execution1 = d1.json()["execution"]
         assert execution1["publish_status"] == "published"
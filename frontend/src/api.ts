@@ -7,20 +7,30 @@ const client = axios.create({
   timeout: 30000
 });
 
+type ReportPayload = { columns: string[]; rows: Record<string, unknown>[] };
+
 type ChatDonePayload = {
   intent?: string;
   answer?: string;
-  report?: { columns: string[]; rows: Record<string, unknown>[] };
+  report?: ReportPayload;
   plan?: Record<string, unknown>;
   debug?: Record<string, unknown>;
 };
 
+export type ChatProgressEvent =
+  | { type: "intent"; node: string; intent: string }
+  | { type: "sql"; node: string; sql: string | null; error: string | null }
+  | { type: "report"; node: string; report: ReportPayload }
+  | { type: "knowledge"; node: string; knowledge: Record<string, unknown>[] }
+  | { type: "plan"; node: string; plan: Record<string, unknown> };
+
 export type ActionLogSummary = {
   summary: string;
   metrics: {
     total: number;
     success: number;
     failed: number;
+    pending: number;
     success_rate: number;
     last_created_at: string | null;
   };
@@ -29,10 +39,16 @@ export type ActionLogSummary = {
     idempotency_key: string;
     action_type: string;
     status: string;
-    request_json: string | null;
+    request_json?: string | null;
     error_message: string | null;
     created_at: string;
   }>;
+  next_before_id: number | null;
+};
+
+export type ActionLogDetail = ActionLogSummary["items"][number] & {
+  request_json: string | null;
+  response_json: string | null;
 };
 
 export async function chat(query: string) {
@@ -44,9 +60,11 @@ export async function chatStream(
   query: string,
   handlers: {
     onToken?: (token: string) => void;
+    onProgress?: (event: ChatProgressEvent) => void;
     onDone?: (result: ChatDonePayload) => void;
     onError?: (message: string) => void;
-  } = {}
+  } = {},
+  sessionId?: string
 ) {
   const response = await fetch(`${baseURL}/api/chat/stream`, {
     method: "POST",
@@ -54,7 +72,7 @@ export async function chatStream(
       "Content-Type": "application/json",
       Accept: "text/event-stream"
     },
-    body: JSON.stringify({ query })
+    body: JSON.stringify({ query, session_id: sessionId })
   });
 
   if (!response.ok || !response.body) {
@@ -71,10 +89,14 @@ export async function chatStream(
       const event = JSON.parse(cleaned) as
         | { type: "start" }
         | { type: "token"; content: string }
+        | ChatProgressEvent
         | { type: "done"; result: ChatDonePayload }
         | { type: "error"; message: string };
 
       if (event.type === "token") handlers.onToken?.(event.content || "");
+      if (["intent", "sql", "report", "knowledge", "plan"].includes(event.type)) {
+        handlers.onProgress?.(event as ChatProgressEvent);
+      }
       if (event.type === "done") handlers.onDone?.(event.result || {});
       if (event.type === "error") handlers.onError?.(event.message || "未知错误");
     } catch {
@@ -119,7 +141,31 @@ export async function executePlan(plan: Record<string, unknown>) {
   return data;
 }
 
-export async function getActionLogsSummary(limit = 20): Promise<ActionLogSummary> {
-  const { data } = await client.get("/api/action-logs/summary", { params: { limit } });
+export async function getExecution(idempotencyKey: string) {
+  const { data } = await client.get(`/api/execute/${idempotencyKey}`);
+  return data;
+}
+
+// /api/execute 只返回 pending，CRM 投递在后台完成；按幂等键轮询直到有结果或超时。
+export async function waitForExecution(idempotencyKey: string, timeoutMs = 30000, intervalMs = 500) {
+  const deadline = Date.now() + timeoutMs;
+  while (true) {
+    const data = await getExecution(idempotencyKey);
+    if (data.status === "success" || data.status === "failed" || Date.now() >= deadline) {
+      return data;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+}
+
+export async function getActionLogsSummary(limit = 20, beforeId?: number | null): Promise<ActionLogSummary> {
+  const params: Record<string, number> = { limit };
+  if (beforeId != null) params.before_id = beforeId;
+  const { data } = await client.get("/api/action-logs/summary", { params });
+  return data;
+}
+
+export async function getActionLogDetail(id: number): Promise<ActionLogDetail> {
+  const { data } = await client.get(`/api/action-logs/${id}`);
   return data;
 }